@@ -12,7 +12,7 @@ import voluptuous as vol
 import homeassistant.helpers.config_validation as cv
 from .const import DOMAIN, COINGECKO_API_URL, UPDATE_INTERVAL, RATE_LIMIT
 from .db import save_crypto, load_crypto_attributes, delete_crypto_db
-from .outils import send_req_backend
+from .outils import send_req_backend, async_open_session, async_close_session
 from .coingecko import send_req_coingecko, fetch_crypto_id_from_coingecko
 from .price_updater import add_crypto_to_general_db
 
@@ -34,6 +34,9 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     if entry.entry_id in hass.data[DOMAIN]:
         return False  # Entry déjà configurée
 
+    # Client HTTP partagé (connexions persistantes) vers l'addon et CoinGecko
+    await async_open_session()
+
     coordinator = PortfolioCryptoCoordinator(hass, entry, update_interval=RATE_LIMIT)
     hass.data[DOMAIN][entry.entry_id] = coordinator
 
@@ -242,6 +245,7 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
         await hass.config_entries.async_forward_entry_unload(entry, "sensor")
         hass.services.async_remove(DOMAIN, "add_crypto")
         hass.data[DOMAIN].pop(entry.entry_id)
+        await async_close_session()
 
     return True
 
@@ -1,5 +1,6 @@
 import logging
 import voluptuous as vol
+from urllib.parse import urlencode
 from homeassistant import config_entries
 from homeassistant.core import callback
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
@@ -30,6 +31,7 @@ class PortfolioCryptoConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 class PortfolioCryptoOptionsFlowHandler(config_entries.OptionsFlow):
     def __init__(self, config_entry):
         self.config_entry = config_entry
+        self.suggestions = {}  # {crypto_id: {id, symbol, name, match}} des cryptos proposées à l'étape de confirmation
 
     async def async_step_init(self, user_input=None):
         if user_input is not None:
@@ -50,19 +52,24 @@ class PortfolioCryptoOptionsFlowHandler(config_entries.OptionsFlow):
             crypto_id = await fetch_crypto_id_from_coingecko(crypto_name_or_id)
             
             if crypto_id:
+                self.suggestions = {}
                 return self.async_show_form(
                     step_id="confirm_add_crypto",
-                    data_schema=vol.Schema({
-                        vol.Required("crypto_name", default=crypto_name_or_id, description="Nom de la cryptomonnaie"): str,
-                        vol.Required("crypto_id", default=crypto_id, description="ID de la cryptomonnaie"): str,
-                    }),
+                    data_schema=self.confirm_schema(crypto_name_or_id, crypto_id),
                     errors={},
                 )
             else:
+                # Proposer les cryptos les plus proches trouvées dans le catalogue local de l'addon
+                suggestions = await self.fetch_suggestions(crypto_name_or_id)
+                if suggestions:
+                    # Un seul choix : le nom enregistré est celui de la crypto choisie
+                    self.suggestions = {coin["id"]: coin for coin in suggestions}
+                    return self.async_show_form(
+                        step_id="confirm_add_crypto",
+                        data_schema=self.confirm_schema(None, suggestions[0]["id"]),
+                        errors={},
+                    )
                 errors = {"base": "crypto_not_found"}
-                # Check if the API limit has been reached
-                if crypto_id is None:
-                    errors["base"] = "Limite API CoinGecko atteinte. Réessayez dans 1 minute."
                 return self.async_show_form(
                     step_id="init",
                     data_schema=vol.Schema({
@@ -70,13 +77,33 @@ class PortfolioCryptoOptionsFlowHandler(config_entries.OptionsFlow):
                     }),
                     errors=errors,
                 )
-            
+
+    def confirm_schema(self, crypto_name, crypto_id):
+        if self.suggestions:
+            choices = {coin["id"]: f"{coin['name']} ({coin['symbol'].upper()})" for coin in self.suggestions.values()}
+            return vol.Schema({
+                vol.Required("crypto_id", default=crypto_id, description="ID de la cryptomonnaie"): vol.In(choices),
+            })
+        return vol.Schema({
+            vol.Required("crypto_name", default=crypto_name, description="Nom de la cryptomonnaie"): str,
+            vol.Required("crypto_id", default=crypto_id, description="ID de la cryptomonnaie"): str,
+        })
+
+    async def fetch_suggestions(self, query):
+        url = f"http://localhost:{PORT_APP}/search_coins"
+        response = await send_req_backend(f"{url}?{urlencode({'q': query, 'limit': 5})}", {}, "Search Coins", method='get')
+        if response and response.status == 200:
+            return await response.json()
+        return []
             
     async def async_step_confirm_add_crypto(self, user_input=None):
         errors = {}
         if user_input is not None:
-            crypto_name = user_input.get("crypto_name")
             crypto_id = user_input.get("crypto_id")
+            if crypto_id in self.suggestions:
+                crypto_name = self.suggestions[crypto_id]["name"]
+            else:
+                crypto_name = user_input.get("crypto_name")
 
             # Vérifier si la crypto est déjà enregistrée dans l'intégration
             cryptos = self.config_entry.options.get("cryptos", [])
@@ -110,11 +137,9 @@ class PortfolioCryptoOptionsFlowHandler(config_entries.OptionsFlow):
                 else:
                     errors["base"] = "db_error"
 
+        user_input = user_input or {}
         return self.async_show_form(
             step_id="confirm_add_crypto",
-            data_schema=vol.Schema({
-                vol.Required("crypto_name", default=user_input.get("crypto_name"), description="Nom de la cryptomonnaie"): str,
-                vol.Required("crypto_id", default=user_input.get("crypto_id"), description="ID de la cryptomonnaie"): str,
-            }),
+            data_schema=self.confirm_schema(user_input.get("crypto_name"), user_input.get("crypto_id")),
             errors=errors,
         )
@@ -11,5 +11,42 @@ UPDATE_INTERVAL = 10 # Intervalle de mise à jour en minutes
 RATE_LIMIT = 30  # Limite de taux en minutes pour les requêtes à CoinGecko
 UPDATE_INTERVAL_SENSOR = 15 # Intervalle de mise à jour en minutes
 PORT_APP = 5000
+PORT_INGRESS = 8099
 PATH_DB_BASE = "/config/portfolio_crypto"
 UPDATE_INTERVAL_PRICE_UPDATER = 300
+# Budgets de requêtes CoinGecko par offre : nombre d'appels par période (secondes),
+# rafale autorisée et nombre de requêtes simultanées
+COINGECKO_API_TIERS = {
+    "free": {"rate": 30, "period": 60, "burst": 5, "concurrency": 2},
+    "analyst": {"rate": 500, "period": 60, "burst": 50, "concurrency": 8},
+    "lite": {"rate": 500, "period": 60, "burst": 50, "concurrency": 8},
+    "pro": {"rate": 1000, "period": 60, "burst": 100, "concurrency": 16},
+}
+COINGECKO_API_TIER = "free"
+COINGECKO_PRO_API_URL = "https://pro-api.coingecko.com/api/v3"
+# Historique des prix : résolutions d'agrégation (secondes) et rétention par résolution (jours)
+PRICE_HISTORY_RESOLUTIONS = {"1h": 3600, "1d": 86400}
+PRICE_HISTORY_RETENTION_DAYS = {"raw": 7, "1h": 90, "1d": 3650}
+HISTORY_BACKFILL_CHUNK_DAYS = 365  # Période maximale par appel market_chart/range (limite de l'offre gratuite)
+HISTORY_BACKFILL_MAX_REQUESTS = 30  # Appels de rattrapage de l'historique par cycle du démon de prix
+COIN_INDEX_REFRESH_INTERVAL = 86400  # Rafraîchissement du catalogue local des cryptos en secondes
+# Client HTTP partagé : taille du pool de connexions et délais (secondes)
+HTTP_POOL_LIMIT = 20
+HTTP_POOL_LIMIT_PER_HOST = 8
+HTTP_KEEPALIVE_TIMEOUT = 30
+HTTP_TIMEOUT = 30
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_ETAG_CACHE_ENTRIES = 64  # Réponses GET conservées par le client pour les requêtes conditionnelles (If-None-Match)
+# Connexions SQLite des portefeuilles : cache de pages (Kio) et attente sur verrou (secondes)
+SQLITE_CACHE_SIZE_KB = 8000
+SQLITE_BUSY_TIMEOUT = 10
+DEFAULT_COST_BASIS_METHOD = "fifo"  # Méthode de prix de revient par lots : fifo, lifo, hifo ou average
+# Mode ASGI de l'addon : threads pour les accès SQLite et pour les vues Flask servies en WSGI
+ASGI_DB_THREADS = 8
+ASGI_WSGI_THREADS = 10
+# Cache des réponses des routes de lecture : nombre d'entrées (LRU) et durée de vie (secondes)
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_TTL = 300
+# Liste paginée des transactions (/transactions/<entry_id>?limit=...) : taille de page par défaut et maximale
+TRANSACTIONS_PAGE_SIZE = 100
+TRANSACTIONS_PAGE_MAX = 1000
@@ -12,7 +12,7 @@ from .const import DOMAIN, COINGECKO_API_URL, UPDATE_INTERVAL, RATE_LIMIT, UPDAT
 from .db import save_crypto, load_crypto_attributes, delete_crypto_db
 import ast
 from .outils import send_req_backend
-from .coingecko import send_req_coingecko, fetch_crypto_id_from_coingecko, get_crypto_price
+from .coingecko import send_req_coingecko, fetch_crypto_id_from_coingecko
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -74,14 +74,17 @@ class PortfolioCryptoCoordinator(DataUpdateCoordinator):
 
         _LOGGER.info("Fetching new data from API/database")
 
-        # Fetch data from API or database
+        # Un seul appel à l'addon pour les totaux et toutes les cryptos
+        snapshot = await self.fetch_snapshot()
+        summary = snapshot.get("summary", {})
+        snapshot_cryptos = snapshot.get("cryptos", {})
+
         data = {}
-        transactions = await self.fetch_transactions()
-        data["transactions"] = len(transactions)
-        data["total_investment"] = await self.fetch_total_investment()
-        data["total_profit_loss"] = await self.fetch_total_profit_loss()
-        data["total_profit_loss_percent"] = await self.fetch_total_profit_loss_percent()
-        data["total_value"] = await self.fetch_total_value()
+        data["transactions"] = summary.get("transactions", 0)
+        data["total_investment"] = summary.get("total_investment", 0)
+        data["total_profit_loss"] = summary.get("total_profit_loss", 0)
+        data["total_profit_loss_percent"] = summary.get("total_profit_loss_percent", 0)
+        data["total_value"] = summary.get("total_value", 0)
 
         for crypto in self.config_entry.options.get("cryptos", []):
             if isinstance(crypto, dict) and "id" in crypto:
@@ -94,46 +97,18 @@ class PortfolioCryptoCoordinator(DataUpdateCoordinator):
                 _LOGGER.error(f"Le format de 'crypto' est incorrect: {crypto}")
                 continue
 
-            crypto_data = await self.fetch_crypto_profit_loss(crypto_id)
-            crypto_transactions = await self.fetch_crypto_transactions(crypto_id)
-
-            # Calcul du prix moyen
-            total_quantity = 0
-            total_cost = 0
-            for transaction in crypto_transactions:
-                if transaction[5] == 'buy':
-                    quantity = transaction[3]
-                    price = transaction[4]
-                    total_quantity += quantity
-                    total_cost += price
-                elif transaction[5] == 'sell':
-                    quantity = transaction[3]
-                    total_quantity -= quantity
-
-            if total_quantity > 0:
-                average_price = total_cost / total_quantity
-            else:
-                average_price = 0
-
-            current_price = await get_crypto_price(crypto_id)
-
-            crypto_data["transactions_count"] = len(crypto_transactions)
-            crypto_data["average_price"] = average_price
-            crypto_data["current_price"] = current_price
-            crypto_data["total_tokens"] = total_quantity
-
-
+            crypto_data = snapshot_cryptos.get(crypto_id, {})
             data[crypto_id] = {
                 "crypto_id": crypto_id,
                 "crypto_name": crypto_name,
-                "investment": crypto_data.get("investment"),
-                "current_value": crypto_data.get("current_value"),
-                "profit_loss": crypto_data.get("profit_loss"),
-                "profit_loss_percent": crypto_data.get("profit_loss_percent"),
-                "transactions_count": crypto_data.get("transactions_count"),
-                "average_price": crypto_data.get("average_price"),
-                "current_price": crypto_data.get("current_price"),
-                "total_tokens": crypto_data.get("total_tokens")
+                "investment": crypto_data.get("investment", 0),
+                "current_value": crypto_data.get("current_value", 0),
+                "profit_loss": crypto_data.get("profit_loss", 0),
+                "profit_loss_percent": crypto_data.get("profit_loss_percent", 0),
+                "transactions_count": crypto_data.get("transactions_count", 0),
+                "average_price": crypto_data.get("average_price", 0),
+                "current_price": crypto_data.get("current_price", 0),
+                "total_tokens": crypto_data.get("total_tokens", 0)
             }
         _LOGGER.info(f"Fetched data: {data}")
         _LOGGER.info("New data fetched successfully")
@@ -141,79 +116,14 @@ class PortfolioCryptoCoordinator(DataUpdateCoordinator):
 
 
 
-    async def fetch_crypto_profit_loss(self, crypto_id):
-        entry_id = self.config_entry.entry_id
-        url = f"http://localhost:{PORT_APP}/crypto_profit_loss/{entry_id}/{crypto_id}"
-        response = await send_req_backend(url, {}, "Fetch Crypto Profit/Loss", method='get')
-        if response and response.status == 200:
-            return await response.json()
-        else:
-            return {
-                "investment": 0,
-                "current_value": 0,
-                "profit_loss": 0,
-                "profit_loss_percent": 0
-            }
-
-    async def fetch_crypto_transactions(self, crypto_id):
+    async def fetch_snapshot(self):
         entry_id = self.config_entry.entry_id
-        url = f"http://localhost:{PORT_APP}/transactions/{entry_id}/{crypto_id}"
-        response = await send_req_backend(url, {}, "Fetch Crypto Transactions", method='get')
+        url = f"http://localhost:{PORT_APP}/snapshot/{entry_id}"
+        response = await send_req_backend(url, {}, "Fetch Snapshot", method='get')
         if response and response.status == 200:
             return await response.json()
         else:
-            return []
-        
-    async def fetch_transactions(self):
-        entry_id = self.config_entry.entry_id
-        url = f"http://localhost:{PORT_APP}/transactions/{entry_id}"
-        response = await send_req_backend(url, {}, "Fetch Transactions", method='get')
-        if response and response.status == 200:
-            return await response.json()
-        else:
-            return []
-
-    async def fetch_total_investment(self):
-        entry_id = self.config_entry.entry_id
-        url = f"http://localhost:{PORT_APP}/profit_loss/{entry_id}"
-        response = await send_req_backend(url, {}, "Fetch Total Investment", method='get')
-        if response and response.status == 200:
-            data = await response.json()
-            return data['summary']['total_investment']
-        else:
-            return 0
-
-    async def fetch_total_profit_loss(self):
-        entry_id = self.config_entry.entry_id
-        url = f"http://localhost:{PORT_APP}/profit_loss/{entry_id}"
-        response = await send_req_backend(url, {}, "Fetch Total Profit/Loss", method='get')
-        if response and response.status == 200:
-            data = await response.json()
-            return data['summary']['total_profit_loss']
-        else:
-            return 0
-
-    async def fetch_total_profit_loss_percent(self):
-        entry_id = self.config_entry.entry_id
-        url = f"http://localhost:{PORT_APP}/profit_loss/{entry_id}"
-        response = await send_req_backend(url, {}, "Fetch Total Profit/Loss Percent", method='get')
-        if response and response.status == 200:
-            data = await response.json()
-            return data['summary']['total_profit_loss_percent']
-        else:
-            return 0
-
-    async def fetch_total_value(self):
-        entry_id = self.config_entry.entry_id
-        url = f"http://localhost:{PORT_APP}/profit_loss/{entry_id}"
-        response = await send_req_backend(url, {}, "Fetch Total Value", method='get')
-        if response and response.status == 200:
-            data = await response.json()
-            return data['summary']['total_value']
-        else:
-            return 0
-        
-    
+            return {}
 
     async def fetch_crypto_data(self, crypto_id):
         
@@ -0,0 +1,107 @@
+"""
+Fichier bench_pnl.py
+Compare le calcul du profit/perte par boucle Python sur les transactions (ancienne
+méthode, lignes indexées par position) au calcul vectorisé de pnl_vector. Les
+colonnes NumPy sont mises en cache par base dans l'addon (household.py) : le temps
+« à chaud » correspond aux requêtes suivantes tant que la base n'a pas changé.
+
+Utilisation : python portfolio_crypto_addon/benchmarks/bench_pnl.py [nombre de lignes] [nombre de portefeuilles]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from portfolio_crypto.pnl_vector import build_transaction_columns, merge_transaction_columns, compute_positions, positions_report  # noqa: E402
+
+COINS = [f'coin-{i}' for i in range(200)]
+
+
+def generate_transactions(rows, portfolios, seed=42):
+    """Transactions synthétiques au format de la table : (id, crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price)"""
+    rng = random.Random(seed)
+    result = {}
+    for p in range(portfolios):
+        transactions = []
+        for i in range(rows // portfolios):
+            crypto_id = rng.choice(COINS)
+            quantity = rng.uniform(0.01, 5)
+            price = rng.uniform(1, 50000)
+            transaction_type = 'buy' if rng.random() < 0.7 else 'sell'
+            date = f'20{rng.randint(18, 24)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+            transactions.append((i, crypto_id, crypto_id, quantity, quantity * price, transaction_type, 'bench', date, price))
+        result[f'wallet{p}'] = transactions
+    return result
+
+
+def python_loop(transactions_by_portfolio, prices):
+    """Ancienne méthode : une boucle Python par transaction, colonnes lues par position"""
+    summary = {}
+    for entry_id, transactions in transactions_by_portfolio.items():
+        coins = {}
+        for transaction in transactions:
+            coin = coins.setdefault(transaction[2], {"investment": 0, "quantity": 0})
+            if transaction[5] == 'buy':
+                coin["investment"] += transaction[4]
+                coin["quantity"] += transaction[3]
+            elif transaction[5] == 'sell':
+                coin["investment"] -= transaction[4]
+                coin["quantity"] -= transaction[3]
+        total_investment = 0
+        total_value = 0
+        for crypto_id, coin in coins.items():
+            total_investment += coin["investment"]
+            total_value += coin["quantity"] * prices[crypto_id]
+        summary[entry_id] = (total_investment, total_value)
+    return summary
+
+
+def build_columns(transactions_by_portfolio):
+    """Colonnes par portefeuille (ce que l'addon garde en cache), à partir des lignes lues en base"""
+    return [
+        build_transaction_columns({entry_id: [(t[2], t[3], t[4], t[5], t[7]) for t in transactions]})
+        for entry_id, transactions in transactions_by_portfolio.items()
+    ]
+
+
+def vectorized(parts, prices):
+    columns = merge_transaction_columns(parts)
+    return positions_report(columns, compute_positions(columns, prices))
+
+
+def best_of(function, *args, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    portfolios = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    transactions = generate_transactions(rows, portfolios)
+    prices = {coin: random.uniform(1, 50000) for coin in COINS}
+
+    expected, loop_time = best_of(python_loop, transactions, prices)
+    parts, build_time = best_of(build_columns, transactions)
+    report, compute_time = best_of(vectorized, parts, prices)
+
+    for entry_id, (investment, value) in expected.items():
+        got = report["portfolios"][entry_id]
+        assert abs(got["total_investment"] - investment) < 1e-6 * max(1, abs(investment))
+        assert abs(got["total_value"] - value) < 1e-6 * max(1, abs(value))
+
+    print(f"{rows} transactions, {portfolios} portefeuille(s)")
+    print(f"Boucle Python                    : {loop_time * 1000:8.1f} ms")
+    print(f"NumPy à froid (colonnes + calcul): {(build_time + compute_time) * 1000:8.1f} ms")
+    print(f"NumPy à chaud (colonnes en cache): {compute_time * 1000:6.1f} ms  -> x{loop_time / compute_time:.1f}")
+
+
+if __name__ == '__main__':
+    main()
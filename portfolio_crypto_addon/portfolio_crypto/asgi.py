@@ -0,0 +1,230 @@
+"""
+Fichier asgi.py
+Ce fichier est le point d'entrée ASGI de l'addon Portfolio Crypto, alternative à
+wsgi.py : les routes les plus appelées (coordinateur et tableaux de bord) sont servies
+par des gestionnaires asynchrones Starlette, les accès SQLite étant délégués à un pool
+de threads borné ; toutes les autres routes sont transmises à l'application Flask.
+Un seul processus uvicorn écoute sur le port de l'API et sur celui de l'ingress.
+
+Lancement : python3 -m portfolio_crypto.asgi
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+from .const import PORT_APP, PORT_INGRESS, DEFAULT_COST_BASIS_METHOD, ASGI_DB_THREADS, ASGI_WSGI_THREADS
+from .coingecko import read_crypto_prices
+from .db import get_database_path
+from .coin_search import search_coins
+from .equity import get_equity_curve
+from .household import get_household_holdings, get_portfolio_positions, household_crypto_ids, calculate_household_summary, get_transaction_columns
+from .lots import calculate_crypto_profit_loss
+from .pnl_vector import compute_positions, positions_report
+from .price_history import get_price_history
+from .portfolio_crypto import app as flask_app, load_snapshot_coins, build_portfolio_snapshot
+from .response_cache import NOT_MODIFIED, request_key, lookup_response, store_response, portfolio_version, household_version, price_version
+
+_LOGGER = logging.getLogger(__name__)
+
+# Pool borné : au plus ASGI_DB_THREADS requêtes SQLite simultanées, quel que soit le nombre de clients
+_db_executor = ThreadPoolExecutor(max_workers=ASGI_DB_THREADS, thread_name_prefix="asgi-db")
+
+
+async def run_db(func, *args):
+    """Exécuter une fonction bloquante (accès SQLite, calcul NumPy) dans le pool de threads"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args))
+
+
+def _int_arg(request, name):
+    # Même comportement que request.args.get(name, type=int) de Flask : None si absent ou invalide
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def _error(message, status_code):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def _portfolio_version(uses_prices=False, with_history=False):
+    """Version d'une réponse d'un portefeuille ; None si sa base n'existe pas (pas de cache)"""
+    def version(request):
+        entry_id = request.path_params['entry_id']
+        if not os.path.exists(get_database_path(entry_id)):
+            return None
+        current = portfolio_version(entry_id, uses_prices)
+        return current + price_version() if with_history else current
+    return version
+
+
+def versioned(version):
+    """Adaptateur Starlette de response_cache (cached_response / versioned_response) : ETag, 304 et cache des réponses 200.
+
+    version(request) est exécutée dans le pool de threads (lecture des compteurs SQLite).
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            current = await run_db(version, request)
+            if current is None:
+                return await handler(request)
+            key = request_key(
+                f"asgi.{handler.__name__}",
+                request.path_params.get('entry_id'),
+                request.path_params,
+                request.query_params.multi_items(),
+            )
+            etag, cached = lookup_response(key, current, request.headers.get('if-none-match'))
+            if cached is NOT_MODIFIED:
+                return Response(status_code=304, headers={"ETag": f'"{etag}"'})
+            if cached is not None:
+                response = Response(cached[0], media_type=cached[1])
+            else:
+                response = await handler(request)
+                if response.status_code != 200:
+                    return response
+                store_response(key, current, response.body, response.media_type)
+            response.headers["ETag"] = f'"{etag}"'
+            return response
+        return wrapper
+    return decorator
+
+
+@versioned(_portfolio_version(uses_prices=True))
+async def snapshot(request):
+    """Retourner en une seule réponse les totaux et les données par crypto pour le coordinateur"""
+    entry_id = request.path_params['entry_id']
+    try:
+        coins = await run_db(load_snapshot_coins, entry_id)
+        prices = await run_db(read_crypto_prices, list(coins))
+        return JSONResponse(build_portfolio_snapshot(coins, prices))
+    except Exception as e:
+        _LOGGER.error(f"Erreur lors du calcul de l'instantané du portefeuille {entry_id}: {e}")
+        return _error("Erreur Interne", 500)
+
+
+@versioned(lambda request: household_version())
+async def household(request):
+    """Vue consolidée de tous les portefeuilles : totaux, totaux par portefeuille et par crypto"""
+    try:
+        holdings = await run_db(get_household_holdings)
+        prices = await run_db(read_crypto_prices, household_crypto_ids(holdings))
+        return JSONResponse(calculate_household_summary(holdings, prices))
+    except Exception as e:
+        _LOGGER.error(f"Erreur lors du calcul de la vue consolidée: {e}")
+        return _error("Erreur Interne", 500)
+
+
+@versioned(lambda request: household_version(request.query_params.getlist('entry_id')))
+async def pnl(request):
+    """Profit/perte de plusieurs portefeuilles (entry_id répétable, tous par défaut), éventuellement à une date (as_of)"""
+    try:
+        columns = await run_db(get_transaction_columns, request.query_params.getlist('entry_id'))
+        prices = await run_db(read_crypto_prices, columns.coins)
+        as_of = request.query_params.get('as_of')
+        lot_positions = await run_db(get_portfolio_positions, columns.portfolios, as_of)
+        positions = await run_db(compute_positions, columns, prices, lot_positions, as_of)
+        return JSONResponse(positions_report(columns, positions))
+    except ValueError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        _LOGGER.error(f"Erreur lors du calcul vectorisé du profit/perte: {e}")
+        return _error("Erreur Interne", 500)
+
+
+@versioned(_portfolio_version(uses_prices=True))
+async def crypto_profit_loss(request):
+    """Calculer et retourner le profit/perte pour une crypto-monnaie spécifique et un ID d'entrée donné"""
+    entry_id = request.path_params['entry_id']
+    crypto_id = request.path_params['crypto_id']
+    try:
+        current_price = (await run_db(read_crypto_prices, [crypto_id]))[crypto_id]
+        method = request.query_params.get('method', DEFAULT_COST_BASIS_METHOD)
+        return JSONResponse(await run_db(calculate_crypto_profit_loss, entry_id, crypto_id, current_price, method))
+    except Exception as e:
+        _LOGGER.error(f"Erreur lors du calcul du profit/perte pour {crypto_id} dans l'entrée {entry_id}: {e}")
+        return _error("Erreur Interne", 500)
+
+
+@versioned(_portfolio_version(uses_prices=True, with_history=True))
+async def equity_curve(request):
+    """Valeur du portefeuille dans le temps (resolution=1h|1d, start/end en timestamps unix)"""
+    entry_id = request.path_params['entry_id']
+    try:
+        resolution = request.query_params.get('resolution', '1d')
+        return JSONResponse(await run_db(get_equity_curve, entry_id, resolution, _int_arg(request, 'start'), _int_arg(request, 'end')))
+    except ValueError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        _LOGGER.error(f"Erreur lors du calcul de la courbe de valeur pour l'entrée {entry_id}: {e}")
+        return _error("Erreur Interne", 500)
+
+
+@versioned(lambda request: price_version())
+async def price_history(request):
+    """Retourner les bougies OHLC agrégées d'une crypto-monnaie (resolution=1h|1d, start/end en timestamps unix)"""
+    crypto_id = request.path_params['crypto_id']
+    try:
+        resolution = request.query_params.get('resolution', '1d')
+        return JSONResponse(await run_db(get_price_history, crypto_id, resolution, _int_arg(request, 'start'), _int_arg(request, 'end')))
+    except ValueError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        _LOGGER.error(f"Erreur lors de la récupération de l'historique des prix pour {crypto_id}: {e}")
+        return _error("Erreur Interne", 500)
+
+
+async def search_coins_route(request):
+    """Suggestions de cryptos pour l'autocomplétion, depuis le catalogue local"""
+    query = request.query_params.get('q', '')
+    limit = min(_int_arg(request, 'limit') or 10, 50)
+    try:
+        return JSONResponse(await run_db(search_coins, query, limit))
+    except Exception as e:
+        _LOGGER.error(f"Erreur lors de la recherche de cryptos pour '{query}': {e}")
+        return _error("Erreur Interne", 500)
+
+
+app = Starlette(routes=[
+    Route('/snapshot/{entry_id}', snapshot, methods=['GET']),
+    Route('/household', household, methods=['GET']),
+    Route('/pnl', pnl, methods=['GET']),
+    Route('/crypto_profit_loss/{entry_id}/{crypto_id}', crypto_profit_loss, methods=['GET']),
+    Route('/equity_curve/{entry_id}', equity_curve, methods=['GET']),
+    Route('/price_history/{crypto_id}', price_history, methods=['GET']),
+    Route('/search_coins', search_coins_route, methods=['GET']),
+    # Toutes les autres routes : application Flask, exécutée dans son propre pool de threads
+    Mount('/', app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+])
+
+
+def bind_socket(port, host='0.0.0.0'):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def main():
+    """Servir l'API (PORT_APP) et l'ingress (PORT_INGRESS) depuis un seul processus et une seule boucle"""
+    config = uvicorn.Config(app, log_config=None, access_log=False)
+    server = uvicorn.Server(config)
+    sockets = [bind_socket(PORT_APP), bind_socket(PORT_INGRESS)]
+    _LOGGER.info(f"Serveur ASGI démarré sur les ports {PORT_APP} et {PORT_INGRESS}")
+    server.run(sockets=sockets)
+
+
+if __name__ == "__main__":
+    main()
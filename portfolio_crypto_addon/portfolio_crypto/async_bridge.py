@@ -0,0 +1,86 @@
+"""
+Fichier async_bridge.py
+Ce fichier fournit la boucle d'événements persistante du worker : un thread démarré à
+la première utilisation exécute une boucle asyncio pendant toute la vie du processus.
+Les vues Flask (synchrones) y planifient leurs coroutines avec run_sync au lieu de
+créer et détruire une boucle par appel avec asyncio.run ; la session aiohttp partagée
+reste ainsi ouverte d'une requête à l'autre.
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import os
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+BRIDGE_TIMEOUT = 60  # Attente maximale d'une coroutine depuis une vue (secondes)
+
+
+class EventLoopThread:
+    """Boucle asyncio exécutée dans un thread démon, une par processus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+
+    def _run(self, loop, ready):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        loop.run_forever()
+
+    def get_loop(self):
+        # Un fork (workers gunicorn) n'hérite pas du thread : une nouvelle boucle est démarrée
+        if self._loop is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                thread = threading.Thread(target=self._run, args=(loop, ready), name="async-bridge", daemon=True)
+                thread.start()
+                ready.wait()
+                self._loop, self._thread, self._pid = loop, thread, os.getpid()
+                _LOGGER.info(f"Boucle d'événements persistante démarrée (pid {self._pid})")
+        return self._loop
+
+    def run(self, coro, timeout=BRIDGE_TIMEOUT):
+        """Exécuter une coroutine sur la boucle et attendre son résultat depuis un thread synchrone"""
+        loop = self.get_loop()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("run_sync ne peut pas être appelé depuis la boucle persistante")
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or self._pid != os.getpid() or not thread.is_alive():
+                return
+            try:
+                # Fermer la session aiohttp partagée avant d'arrêter la boucle
+                from .outils import async_close_session
+                asyncio.run_coroutine_threadsafe(async_close_session(), loop).result(5)
+            except Exception as e:
+                _LOGGER.warning(f"Fermeture de la session HTTP impossible: {e}")
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            self._loop = None
+
+
+_bridge = EventLoopThread()
+atexit.register(_bridge.stop)
+
+
+def run_sync(coro, timeout=BRIDGE_TIMEOUT):
+    """Équivalent de asyncio.run(coro) pour les vues Flask, sur la boucle persistante du worker"""
+    return _bridge.run(coro, timeout)
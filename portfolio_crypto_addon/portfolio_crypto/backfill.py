@@ -0,0 +1,143 @@
+"""
+Fichier backfill.py
+Ce fichier gère le rattrapage de l'historique des prix : les couples (crypto, jour)
+des transactions de tous les portefeuilles sont dédoublonnés, ceux absents de la
+table daily_prices sont regroupés par crypto et récupérés par périodes entières avec
+/coins/{id}/market_chart/range (un appel par crypto et par période, et non un appel
+par jour). Les prix historiques sont ensuite lus localement.
+"""
+
+import logging
+import sqlite3
+import time
+from .const import COINGECKO_API_URL_PRICE, HISTORY_BACKFILL_CHUNK_DAYS, HISTORY_BACKFILL_MAX_REQUESTS
+from .household import discover_portfolios
+from .price_history import PRICE_DB_PATH, create_price_history_tables, parse_day, save_daily_prices
+
+_LOGGER = logging.getLogger(__name__)
+
+DAY = 86400
+
+# Réponses qui signifient « pas de données » (crypto inconnue, période refusée) : les jours
+# demandés sont notés sans prix. Les autres erreurs (clé d'API absente ou invalide, 403,
+# 429...) sont retentées au prochain cycle.
+NO_DATA_STATUSES = (400, 404)
+
+
+def collect_transaction_days(portfolios=None):
+    """Couples (crypto_id, jour) distincts des transactions de tous les portefeuilles : {crypto_id: {jours}}"""
+    days = {}
+    for entry_id, db_path in (portfolios or discover_portfolios()).items():
+        try:
+            conn = sqlite3.connect(db_path)
+            try:
+                rows = conn.execute('''
+                    SELECT DISTINCT crypto_id, substr(date, 1, 10) FROM transactions
+                    WHERE crypto_id IS NOT NULL AND crypto_id != '' AND date IS NOT NULL
+                ''').fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            _LOGGER.error(f"Portefeuille {entry_id} ignoré pour le rattrapage de l'historique: {e}")
+            continue
+        for crypto_id, date in rows:
+            day = parse_day(date)
+            if day is not None:
+                days.setdefault(crypto_id, set()).add(day)
+    return days
+
+
+def find_missing_days(days, now=None, db_path=PRICE_DB_PATH):
+    """Retirer les jours déjà connus (y compris sans prix) et le jour en cours : {crypto_id: [jours triés]}"""
+    now = int(now if now is not None else time.time())
+    today = now - now % DAY
+    missing = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        create_price_history_tables(conn)
+        for crypto_id, wanted in days.items():
+            known = {day for (day,) in conn.execute('SELECT day FROM daily_prices WHERE crypto_id = ?', (crypto_id,))}
+            # Le jour en cours est couvert par les bougies du démon de prix
+            remaining = sorted(day for day in wanted if day < today and day not in known)
+            if remaining:
+                missing[crypto_id] = remaining
+    finally:
+        conn.close()
+    return missing
+
+
+def plan_ranges(days, chunk_days=HISTORY_BACKFILL_CHUNK_DAYS):
+    """Regrouper des jours triés en périodes [début, fin] d'au plus chunk_days jours"""
+    ranges = []
+    for day in days:
+        if ranges and day - ranges[-1][0] < chunk_days * DAY:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(period) for period in ranges]
+
+
+def daily_prices_from_chart(data, start, end):
+    """Premier prix de chaque jour d'une réponse market_chart/range : {jour: prix}"""
+    prices = {}
+    for point in (data or {}).get('prices') or []:
+        try:
+            ts = int(point[0]) // 1000
+            price = float(point[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        day = ts - ts % DAY
+        if start <= day <= end and (day not in prices or ts < prices[day][0]):
+            prices[day] = (ts, price)
+    return {day: price for day, (_, price) in prices.items()}
+
+
+async def fetch_price_range(engine, crypto_id, start, end):
+    """Prix journaliers d'une crypto sur [start, end] en un appel.
+
+    Retourne None si l'appel a échoué (nouvel essai au prochain cycle) et {} si
+    CoinGecko n'a pas de données pour la période (statuts NO_DATA_STATUSES).
+    """
+    url = f"{COINGECKO_API_URL_PRICE}/coins/{crypto_id}/market_chart/range"
+    # Fin de période au lendemain : le point de 00:00 du dernier jour est inclus
+    params = {"vs_currency": "usd", "from": start, "to": end + DAY}
+    result = await engine.fetch(url, params=params, title=f"Historique des prix de {crypto_id}")
+    if result is None:
+        return None
+    if result.status in NO_DATA_STATUSES:
+        return {}
+    if result.status != 200:
+        return None
+    return daily_prices_from_chart(result.data, start, end)
+
+
+async def backfill_historical_prices(engine, max_requests=HISTORY_BACKFILL_MAX_REQUESTS, db_path=PRICE_DB_PATH):
+    """Rattraper les prix journaliers manquants des transactions, dans la limite de max_requests appels"""
+    missing = find_missing_days(collect_transaction_days(), db_path=db_path)
+    if not missing:
+        return 0
+    plan = [
+        (crypto_id, start, end, [day for day in days if start <= day <= end])
+        for crypto_id, days in missing.items()
+        for start, end in plan_ranges(days)
+    ]
+    _LOGGER.info(f"Rattrapage de l'historique : {sum(len(days) for days in missing.values())} jour(s) manquant(s), {len(plan)} appel(s) nécessaires")
+    requests = 0
+    saved = 0
+    for crypto_id, start, end, wanted in plan[:max_requests]:
+        requests += 1
+        prices = await fetch_price_range(engine, crypto_id, start, end)
+        if prices is None:
+            continue
+        # Tous les jours reçus sont conservés ; les jours demandés sans prix sont notés pour ne pas être redemandés
+        rows = [(crypto_id, day, price) for day, price in prices.items()]
+        rows.extend((crypto_id, day, None) for day in wanted if day not in prices)
+        conn = sqlite3.connect(db_path, timeout=10)
+        try:
+            with conn:
+                save_daily_prices(conn, rows)
+        finally:
+            conn.close()
+        saved += len(prices)
+    _LOGGER.info(f"Rattrapage de l'historique : {saved} prix journaliers enregistrés en {requests} appel(s)")
+    return requests
@@ -0,0 +1,118 @@
+"""
+Fichier bulk_transactions.py
+Ce fichier gère l'import de transactions par lots : lecture d'un corps JSON ou NDJSON,
+validation ligne par ligne, résolution des ids de cryptos en une passe sur le catalogue
+local puis insertion dans une seule transaction SQLite.
+"""
+
+import json
+import logging
+import math
+from datetime import datetime
+from .coin_index import coin_index
+from .db import add_transactions
+
+TRANSACTION_TYPES = ('buy', 'sell')
+
+
+def parse_bulk_payload(body, content_type=''):
+    """Lire un corps JSON (liste ou {"transactions": [...]}) ou NDJSON.
+
+    Retourne une liste de (index, données, erreur) : une ligne NDJSON illisible
+    devient une erreur de ligne au lieu de faire échouer tout le lot.
+    """
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    if 'ndjson' in (content_type or '') or 'jsonlines' in (content_type or ''):
+        records = []
+        for index, line in enumerate(text.splitlines()):
+            if not line.strip():
+                continue
+            try:
+                records.append((index, json.loads(line), None))
+            except ValueError as e:
+                records.append((index, None, f"JSON invalide: {e}"))
+        return records
+
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('transactions')
+    if not isinstance(data, list):
+        raise ValueError("Le corps doit être une liste de transactions")
+    return [(index, row, None) for index, row in enumerate(data)]
+
+
+def normalize_transaction(data, crypto_id):
+    """Valider une transaction et la convertir en ligne de la table 'transactions'"""
+    if not isinstance(data, dict):
+        raise ValueError("La transaction doit être un objet")
+    crypto_name = data.get('crypto_name')
+    if not crypto_name:
+        raise ValueError("crypto_name manquant")
+    if not crypto_id:
+        raise ValueError(f"Cryptomonnaie introuvable: {crypto_name}")
+    try:
+        quantity = float(data['quantity'])
+        price_usd = float(data['price_usd'])
+    except KeyError as e:
+        raise ValueError(f"Champ manquant: {e.args[0]}")
+    except (TypeError, ValueError):
+        raise ValueError("quantity et price_usd doivent être numériques")
+    # NaN et l'infini passent les comparaisons ci-dessous et rendraient les réponses JSON invalides
+    if not (math.isfinite(quantity) and math.isfinite(price_usd)):
+        raise ValueError("quantity et price_usd doivent être des nombres finis")
+    if quantity <= 0 or price_usd < 0:
+        raise ValueError("quantity doit être positive et price_usd ne peut pas être négatif")
+    transaction_type = data.get('transaction_type')
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError(f"transaction_type invalide: {transaction_type}")
+    date = data.get('date')
+    try:
+        datetime.strptime(str(date)[:10], "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Date invalide: {date}")
+    location = data.get('location') or ''
+    historical_price = price_usd / quantity
+    if not math.isfinite(historical_price):
+        raise ValueError("quantity trop petite pour calculer le prix unitaire")
+    return (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price)
+
+
+def resolve_crypto_ids(records):
+    """Résoudre en une passe les ids de toutes les cryptos du lot (un appel par nom distinct)"""
+    coin_index.revalidate()
+    resolved = {}
+    for _, data, _ in records:
+        if not isinstance(data, dict):
+            continue
+        key = data.get('crypto_id') or data.get('crypto_name')
+        if key and key not in resolved:
+            resolved[key] = coin_index.resolve(key)
+    return resolved
+
+
+def ingest_transactions(entry_id, records, strict=False, checkpoint=None):
+    """Valider puis insérer un lot de transactions.
+
+    Les lignes valides sont insérées dans une seule transaction ; en mode strict,
+    la moindre erreur annule tout le lot.
+    """
+    resolved = resolve_crypto_ids(records)
+    rows = []
+    errors = []
+    for index, data, error in records:
+        if error is None:
+            try:
+                key = (data.get('crypto_id') or data.get('crypto_name')) if isinstance(data, dict) else None
+                rows.append(normalize_transaction(data, resolved.get(key)))
+                continue
+            except ValueError as e:
+                error = str(e)
+        errors.append({"index": index, "error": error})
+
+    if errors and strict:
+        logging.warning(f"Import par lot refusé pour l'entrée {entry_id}: {len(errors)} lignes invalides")
+        return {"inserted": 0, "errors": errors}
+    inserted = add_transactions(entry_id, rows, checkpoint) if rows or checkpoint else 0
+    if errors:
+        logging.warning(f"Import par lot pour l'entrée {entry_id}: {len(errors)} lignes ignorées")
+    return {"inserted": inserted, "errors": errors}
@@ -0,0 +1,177 @@
+"""
+Fichier coin_index.py
+Ce fichier gère le catalogue local des cryptos CoinGecko (coins_list.db) : il est
+rafraîchi périodiquement par le démon de prix avec des requêtes conditionnelles et
+chargé en mémoire sous forme de tables de hachage par id, nom et symbole.
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+import time
+from .const import COINGECKO_API_URL, PATH_DB_BASE, COIN_INDEX_REFRESH_INTERVAL
+
+_LOGGER = logging.getLogger(__name__)
+
+COIN_INDEX_DB_PATH = f'{PATH_DB_BASE}/coins_list.db'
+
+def create_coin_index_tables(conn):
+    """Créer les tables du catalogue si elles n'existent pas"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS coins (
+            id TEXT PRIMARY KEY,
+            symbol TEXT,
+            name TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+def save_coin_list(coins, etag=None, last_modified=None, db_path=COIN_INDEX_DB_PATH):
+    """Remplacer le catalogue par la liste /coins/list reçue, dans une seule transaction"""
+    rows = [
+        (coin['id'], coin.get('symbol') or '', coin.get('name') or '')
+        for coin in coins if isinstance(coin, dict) and coin.get('id')
+    ]
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            create_coin_index_tables(conn)
+            conn.execute('DELETE FROM coins')
+            conn.executemany('INSERT OR REPLACE INTO coins (id, symbol, name) VALUES (?, ?, ?)', rows)
+            conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', [
+                ('etag', etag or ''),
+                ('last_modified', last_modified or ''),
+                ('checked_at', str(int(time.time()))),
+            ])
+    finally:
+        conn.close()
+    _LOGGER.info(f"Catalogue local des cryptos mis à jour: {len(rows)} cryptos")
+    return len(rows)
+
+def load_coin_index_meta(db_path=COIN_INDEX_DB_PATH):
+    conn = sqlite3.connect(db_path)
+    try:
+        create_coin_index_tables(conn)
+        return dict(conn.execute('SELECT key, value FROM meta').fetchall())
+    finally:
+        conn.close()
+
+def touch_coin_index(db_path=COIN_INDEX_DB_PATH):
+    """Noter que le catalogue a été revalidé sans changement"""
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            create_coin_index_tables(conn)
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('checked_at', str(int(time.time()))))
+    finally:
+        conn.close()
+
+async def refresh_coin_index(engine, force=False, db_path=COIN_INDEX_DB_PATH):
+    """Rafraîchir le catalogue via le moteur de requêtes si l'intervalle est écoulé.
+
+    Les en-têtes ETag / Last-Modified de la dernière réponse sont renvoyés pour
+    qu'un catalogue inchangé ne coûte qu'une réponse 304.
+    """
+    meta = load_coin_index_meta(db_path)
+    checked_at = int(meta.get('checked_at') or 0)
+    if not force and time.time() - checked_at < COIN_INDEX_REFRESH_INTERVAL:
+        return False
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    result = await engine.fetch(COINGECKO_API_URL, headers=headers, title="Catalogue des cryptos")
+    if result is None:
+        return False
+    if result.status == 304:
+        touch_coin_index(db_path)
+        _LOGGER.info("Catalogue local des cryptos inchangé")
+        return False
+    if result.status == 200 and isinstance(result.data, list):
+        save_coin_list(result.data, result.headers.get('ETag'), result.headers.get('Last-Modified'), db_path)
+        return True
+    return False
+
+
+class CoinIndex:
+    """Catalogue en mémoire, rechargé uniquement quand coins_list.db a été modifiée"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self.coins = []
+        self.by_id = {}
+        self.by_name = {}
+        self.by_symbol = {}
+
+    def _connection(self):
+        # Une connexion par processus : elle ne doit pas être héritée d'un fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._pid = os.getpid()
+            self._data_version = None
+        return self._conn
+
+    def _load(self, rows):
+        by_id = {}
+        by_name = {}
+        by_symbol = {}
+        for coin_id, symbol, name in rows:
+            by_id[coin_id.lower()] = coin_id
+            if name:
+                by_name.setdefault(name.lower(), coin_id)
+            if symbol:
+                by_symbol.setdefault(symbol.lower(), []).append(coin_id)
+        self.coins = rows
+        self.by_id = by_id
+        self.by_name = by_name
+        self.by_symbol = by_symbol
+
+    def revalidate(self):
+        """Recharger le catalogue si un autre processus l'a modifié"""
+        with self._lock:
+            try:
+                conn = self._connection()
+                data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if data_version != self._data_version:
+                    create_coin_index_tables(conn)
+                    conn.commit()
+                    self._load(conn.execute('SELECT id, symbol, name FROM coins').fetchall())
+                    self._data_version = data_version
+            except sqlite3.Error as e:
+                _LOGGER.error(f"Erreur lors du chargement du catalogue des cryptos: {e}")
+            return self
+
+    def is_empty(self):
+        return not self.revalidate().by_id
+
+    def resolve(self, crypto_name_or_id):
+        """Résoudre un id, un nom ou un symbole (s'il est sans ambiguïté) en id CoinGecko"""
+        if not crypto_name_or_id:
+            return None
+        self.revalidate()
+        key = crypto_name_or_id.strip().lower()
+        crypto_id = self.by_id.get(key) or self.by_name.get(key)
+        if crypto_id:
+            return crypto_id
+        candidates = self.by_symbol.get(key, [])
+        if len(candidates) == 1:
+            return candidates[0]
+        return None
+
+
+coin_index = CoinIndex(COIN_INDEX_DB_PATH)
+
+def resolve_crypto_id(crypto_name_or_id):
+    """Résoudre un nom ou un id de crypto depuis le catalogue local, sans appel réseau"""
+    return coin_index.resolve(crypto_name_or_id)
@@ -0,0 +1,141 @@
+"""
+Fichier coin_search.py
+Ce fichier fournit la recherche de cryptos pour l'autocomplétion : recherche par
+préfixe sur les ids, noms, symboles et mots des noms, puis recherche approchée par
+trigrammes quand les préfixes ne donnent pas assez de résultats. Tout est calculé
+sur le catalogue local, sans appel à CoinGecko.
+"""
+
+import heapq
+import threading
+from bisect import bisect_left
+from collections import Counter
+from .coin_index import coin_index
+
+# Rang des correspondances : plus petit = meilleur
+MATCH_EXACT = 0
+MATCH_PREFIX = 1
+MATCH_WORD_PREFIX = 2
+MATCH_FUZZY = 3
+
+# Les préfixes de 1 ou 2 caractères couvrent des milliers de clés : leurs meilleurs
+# résultats sont précalculés
+SHORT_PREFIX_LENGTH = 2
+SHORT_PREFIX_TOP = 20
+MIN_FUZZY_SCORE = 0.3
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CoinSearchIndex:
+    """Index de recherche construit à partir d'une liste (id, symbole, nom)"""
+
+    def __init__(self, coins):
+        self.coins = coins
+        keys = []
+        for idx, (coin_id, symbol, name) in enumerate(coins):
+            for key in {coin_id.lower(), (name or '').lower(), (symbol or '').lower()}:
+                if key:
+                    keys.append((key, MATCH_PREFIX, idx))
+            words = (name or '').lower().split()
+            for word in words[1:]:
+                keys.append((word, MATCH_WORD_PREFIX, idx))
+        # Tableau trié des clés : un trie aplati, parcouru par dichotomie
+        keys.sort()
+        self.keys = keys
+        self.key_strings = [key for key, _, _ in keys]
+
+        self.short_prefixes = {}
+        for key, kind, idx in keys:
+            for length in range(1, min(SHORT_PREFIX_LENGTH, len(key)) + 1):
+                self.short_prefixes.setdefault(key[:length], []).append(self._rank(key, kind, idx, key[:length]))
+        for prefix, ranked in self.short_prefixes.items():
+            ranked.sort()
+            self.short_prefixes[prefix] = self._unique(ranked, SHORT_PREFIX_TOP)
+
+        self.postings = {}
+        self.trigram_counts = []
+        for idx, (coin_id, symbol, name) in enumerate(coins):
+            grams = trigrams(coin_id.lower()) | trigrams((name or '').lower())
+            self.trigram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(idx)
+
+    def _rank(self, key, kind, idx, query):
+        kind = MATCH_EXACT if key == query else kind
+        return (kind, len(key), len(self.coins[idx][0]), idx)
+
+    @staticmethod
+    def _unique(ranked, limit):
+        seen = set()
+        result = []
+        for rank in ranked:
+            idx = rank[-1]
+            if idx not in seen:
+                seen.add(idx)
+                result.append(rank)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def prefix_search(self, query, limit):
+        if len(query) <= SHORT_PREFIX_LENGTH:
+            return self.short_prefixes.get(query, [])[:limit]
+        # Toute la plage des clés commençant par la requête est classée avant de couper
+        start = bisect_left(self.key_strings, query)
+        end = bisect_left(self.key_strings, query[:-1] + chr(ord(query[-1]) + 1), start)
+        best = {}
+        for key, kind, idx in self.keys[start:end]:
+            rank = self._rank(key, kind, idx, query)
+            if idx not in best or rank < best[idx]:
+                best[idx] = rank
+        return heapq.nsmallest(limit, best.values())
+
+    def fuzzy_search(self, query, limit):
+        grams = trigrams(query)
+        counts = Counter()
+        for gram in grams:
+            counts.update(self.postings.get(gram, ()))
+        scored = []
+        for idx, common in counts.items():
+            # Coefficient de Dice entre les trigrammes de la requête et ceux de la crypto
+            score = 2 * common / (len(grams) + self.trigram_counts[idx])
+            if score >= MIN_FUZZY_SCORE:
+                scored.append((MATCH_FUZZY, -score, len(self.coins[idx][0]), idx))
+        scored.sort()
+        return scored[:limit]
+
+    def search(self, query, limit=10):
+        query = (query or '').strip().lower()
+        if not query:
+            return []
+        ranked = self.prefix_search(query, limit)
+        if len(ranked) < limit and len(query) >= 3:
+            ranked = self._unique(ranked + self.fuzzy_search(query, limit), limit)
+        results = []
+        for kind, _, _, idx in ranked:
+            coin_id, symbol, name = self.coins[idx]
+            results.append({
+                "id": coin_id,
+                "symbol": symbol,
+                "name": name,
+                "match": ("exact", "prefix", "word_prefix", "fuzzy")[kind],
+            })
+        return results
+
+
+_search_index = None
+_search_lock = threading.Lock()
+
+def search_coins(query, limit=10):
+    """Rechercher des cryptos dans le catalogue local, l'index étant reconstruit si le catalogue a changé"""
+    global _search_index
+    coins = coin_index.revalidate().coins
+    with _search_lock:
+        if _search_index is None or _search_index.coins is not coins:
+            _search_index = CoinSearchIndex(coins)
+        index = _search_index
+    return index.search(query, limit)
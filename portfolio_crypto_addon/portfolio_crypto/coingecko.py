@@ -1,51 +1,116 @@
 import aiohttp
+import asyncio
 import os
 import sqlite3
 import logging
+import threading
 from .const import DOMAIN, COINGECKO_API_URL, COINGECKO_API_URL_PRICE, UPDATE_INTERVAL, RATE_LIMIT, UPDATE_INTERVAL_SENSOR, PORT_APP, PATH_DB_BASE
+from .coin_index import coin_index, save_coin_list
+from .outils import BackendResponse, get_session
 
 _LOGGER = logging.getLogger(__name__)
 
+
+class PriceCache:
+    """Cache mémoire de la table prices, rechargée uniquement quand le démon de prix a écrit"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._prices = {}
+        self._generation = 0
+
+    def _connection(self):
+        # Une connexion par processus : elle ne doit pas être héritée d'un fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._pid = os.getpid()
+            self._data_version = None
+        return self._conn
+
+    def _revalidate(self):
+        """Recharger la table si un autre processus l'a modifiée depuis le dernier chargement"""
+        with self._lock:
+            try:
+                conn = self._connection()
+                # data_version change dès qu'une autre connexion a validé une écriture
+                data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if data_version != self._data_version:
+                    rows = conn.execute('SELECT crypto_id, price FROM prices').fetchall()
+                    self._prices = {crypto_id: price for crypto_id, price in rows}
+                    self._generation = self._read_generation(conn)
+                    self._data_version = data_version
+            except sqlite3.Error as e:
+                _LOGGER.error(f"Erreur lors du chargement du cache des prix: {e}")
+            return self._prices
+
+    def _read_generation(self, conn):
+        try:
+            row = conn.execute("SELECT value FROM history_meta WHERE key = 'price_generation'").fetchone()
+        except sqlite3.OperationalError:
+            return 0  # Table créée au premier rafraîchissement du démon de prix
+        return row[0] if row else 0
+
+    def generation(self):
+        """Numéro du dernier rafraîchissement des prix, incrémenté par le démon de prix"""
+        self._revalidate()
+        return self._generation
+
+    def get(self, crypto_id):
+        return self._revalidate().get(crypto_id) or 0
+
+    def get_many(self, crypto_ids):
+        prices = self._revalidate()
+        return {crypto_id: prices.get(crypto_id) or 0 for crypto_id in crypto_ids}
+
+
+_price_cache = PriceCache(f'{PATH_DB_BASE}/cache_prix_crypto.db')
+
+
 async def send_req_coingecko(url, title, params=None):
     try:
-        async with aiohttp.ClientSession() as session:
-            #_LOGGER.info(f"Appel de l'URL CoinGecko {url} avec params : {params}")
-            
-            async with session.get(url, params=params) as response:
-                response_text = await response.text()
-                #_LOGGER.info(f"Statut de la réponse: {response.status}, Texte de la réponse: {response_text}")
-                _LOGGER.info(f"response.statu =  {response.status}")
-                if response.status == 200:
-                    #_LOGGER.info(f"Réponse 200 pour {title} : {response_text}")
-                    return response
-                elif response.status == 429:
-                    _LOGGER.warning("Limitation Api Coingecko reessayez dans 1 min")
-                    return None  # or you can return a specific error object or code
-                else:
-                    _LOGGER.error(f"Échec pour la requete CoinGecko : {title}, code de statut: {response.status}, texte de la réponse: {response_text}")
-                    return False
+        session = get_session()
+        #_LOGGER.info(f"Appel de l'URL CoinGecko {url} avec params : {params}")
+
+        async with session.get(url, params=params) as response:
+            response_text = await response.text()
+            #_LOGGER.info(f"Statut de la réponse: {response.status}, Texte de la réponse: {response_text}")
+            _LOGGER.info(f"response.statu =  {response.status}")
+            if response.status == 200:
+                #_LOGGER.info(f"Réponse 200 pour {title} : {response_text}")
+                return BackendResponse(response.status, dict(response.headers), response_text)
+            elif response.status == 429:
+                _LOGGER.warning("Limitation Api Coingecko reessayez dans 1 min")
+                return None  # or you can return a specific error object or code
+            else:
+                _LOGGER.error(f"Échec pour la requete CoinGecko : {title}, code de statut: {response.status}, texte de la réponse: {response_text}")
+                return False
     except Exception as e:
         _LOGGER.error(f"Erreur lors de l'appel CoinGecko pour {title}: {e}")
         return False
     
 async def fetch_crypto_id_from_coingecko(crypto_name_or_id):
-    url = f"{COINGECKO_API_URL}?query={crypto_name_or_id}"
-    
-    response = await send_req_coingecko(url, "Fetch Crypto ID")
+    """Résoudre l'id CoinGecko d'une crypto depuis le catalogue local.
+
+    Le catalogue n'est téléchargé ici que s'il est encore vide (premier démarrage),
+    ensuite c'est le démon de prix qui le tient à jour. Les accès SQLite au catalogue
+    sont exécutés dans le pool de threads de la boucle : dans Home Assistant, ils ne
+    doivent pas bloquer la boucle d'événements.
+    """
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, coin_index.is_empty):
+        return await loop.run_in_executor(None, coin_index.resolve, crypto_name_or_id)
+
+    response = await send_req_coingecko(COINGECKO_API_URL, "Fetch Crypto ID")
     if response and response.status == 200:
         try:
             result = await response.json()
             if isinstance(result, list):
-                for coin in result:
-                    if isinstance(coin, dict):
-                        if coin.get('name', '').lower() == crypto_name_or_id.lower() or coin.get('id', '').lower() == crypto_name_or_id.lower():
-                            return coin['id']
-            elif isinstance(result, dict):
-                if result.get('name', '').lower() == crypto_name_or_id.lower() or result.get('id', '').lower() == crypto_name_or_id.lower():
-                    return result['id']
-            elif isinstance(result, str):
-                if result.lower() == crypto_name_or_id.lower():
-                    return result
+                await loop.run_in_executor(None, save_coin_list, result)
+                return await loop.run_in_executor(None, coin_index.resolve, crypto_name_or_id)
             else:
                 _LOGGER.error("Unexpected response format from CoinGecko API")
                 return None
@@ -58,30 +123,16 @@ async def fetch_crypto_id_from_coingecko(crypto_name_or_id):
     
 async def get_crypto_price(crypto_id):
     """Récupérer le prix actuel d'une crypto-monnaie"""
-    conn = sqlite3.connect(f'{PATH_DB_BASE}/cache_prix_crypto.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT price FROM prices WHERE crypto_id = ?', (crypto_id,))
-    row = cursor.fetchone()
-    conn.close()
-
-    if row:
-        return row[0]
-    else:
-        return 0
-
-async def get_historical_price(crypto_id, date):
-    return None
-#    """Récupérer le prix historique d'une crypto-monnaie pour une date donnée"""
-#    url = f"{COINGECKO_API_URL}/coins/{crypto_id}/history?date={date}"
-#    
-#    response = await send_req_coingecko(url, "Get Historical Price")
-#    if response and response.status == 200:
-#        try:
-#            data = await response.json()
-#            return data['market_data']['current_price']['usd']
-#        except (KeyError, Exception) as e:
-#            _LOGGER.error(f"Erreur lors de la récupération du prix historique pour {crypto_id} à la date {date}: {e}")
-#            return None
-#    else:
-#        _LOGGER.error(f"Erreur lors de la récupération du prix historique pour {crypto_id} à la date {date}")
-#        return None
\ No newline at end of file
+    return _price_cache.get(crypto_id)
+
+async def get_crypto_prices(crypto_ids):
+    """Récupérer les prix actuels de plusieurs crypto-monnaies : {crypto_id: prix}"""
+    return _price_cache.get_many(crypto_ids)
+
+def read_crypto_prices(crypto_ids):
+    """Version bloquante de get_crypto_prices (lecture SQLite si le démon de prix a écrit), pour un pool de threads"""
+    return _price_cache.get_many(crypto_ids)
+
+def get_price_generation():
+    """Numéro du dernier rafraîchissement des prix (validation des réponses en cache)"""
+    return _price_cache.generation()
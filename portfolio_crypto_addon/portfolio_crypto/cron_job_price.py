@@ -1,12 +1,17 @@
 import logging
 import asyncio
 import sqlite3
-import requests
 from datetime import datetime
+from .fetch_engine import CoinGeckoFetchEngine
+from .price_history import record_price_batch, bump_price_generation
+from .coin_index import refresh_coin_index
+from .backfill import backfill_historical_prices
 
 PATH_DB_BASE = "/config/portfolio_crypto"
 UPDATE_INTERVAL_PRICE_UPDATER = 300  # 10 minutes en secondes
 COINGECKO_API_URL_PRICE = "https://api.coingecko.com/api/v3/simple/price"
+COINGECKO_MAX_IDS_PER_REQUEST = 100  # Nombre maximum d'ids par appel /simple/price
+COINGECKO_MAX_URL_LENGTH = 2000  # Longueur maximale de l'URL acceptée par l'API
 
 # Configurer les logs
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(name)s:%(message)s')
@@ -17,24 +22,44 @@ def get_crypto_list():
     cursor.execute('SELECT crypto_id FROM cryptos')
     cryptos = cursor.fetchall()
     conn.close()
-    return [crypto[0] for crypto in cryptos]
+    # Une même crypto peut être suivie par plusieurs portefeuilles
+    return list(dict.fromkeys(crypto[0] for crypto in cryptos if crypto[0]))
 
-def update_crypto_price(crypto_id):
-    try:
-        url = f"{COINGECKO_API_URL_PRICE}?ids={crypto_id}&vs_currencies=usd"
-        logging.info(f"URL PRICE UPDATER {url}")
-        response = requests.get(url)
-        if response.status_code == 200:
-            price = response.json().get(crypto_id, {}).get('usd', 0)
-            if price:
-                logging.info(f"Prix récupéré pour {crypto_id}: {price}")
-                save_crypto_price(crypto_id, price)
-            else:
-                logging.error(f"Prix non trouvé dans la réponse pour {crypto_id}: {response.json()}")
+def chunk_crypto_ids(crypto_ids):
+    """Découper la liste des ids en lots respectant les limites d'ids et de longueur d'URL de l'API"""
+    base_length = len(f"{COINGECKO_API_URL_PRICE}?ids=&vs_currencies=usd")
+    chunks = []
+    chunk = []
+    length = base_length
+    for crypto_id in crypto_ids:
+        # +1 pour la virgule séparant les ids
+        extra = len(crypto_id) + (1 if chunk else 0)
+        if chunk and (len(chunk) >= COINGECKO_MAX_IDS_PER_REQUEST or length + extra > COINGECKO_MAX_URL_LENGTH):
+            chunks.append(chunk)
+            chunk = []
+            length = base_length
+            extra = len(crypto_id)
+        chunk.append(crypto_id)
+        length += extra
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+async def fetch_crypto_prices(engine, crypto_ids):
+    """Récupérer les prix d'un lot de cryptos en un seul appel /simple/price"""
+    params = {"ids": ",".join(crypto_ids), "vs_currencies": "usd"}
+    data = await engine.get_json(COINGECKO_API_URL_PRICE, params=params, title=f"Prix d'un lot de {len(crypto_ids)} cryptos")
+    if data is None:
+        logging.error(f"Échec de la récupération des prix pour le lot de {len(crypto_ids)} cryptos")
+        return {}
+    prices = {}
+    for crypto_id in crypto_ids:
+        price = data.get(crypto_id, {}).get('usd', 0)
+        if price:
+            prices[crypto_id] = price
         else:
-            logging.error(f"Échec de la récupération du prix pour {crypto_id}: {response.status_code}")
-    except Exception as e:
-        logging.error(f"Erreur lors de la mise à jour du prix pour {crypto_id}: {e}")
+            logging.error(f"Prix non trouvé dans la réponse pour {crypto_id}")
+    return prices
 
 def save_crypto_price(crypto_id, price):
     conn = sqlite3.connect(f'{PATH_DB_BASE}/cache_prix_crypto.db')
@@ -65,8 +90,62 @@ def save_crypto_price(crypto_id, price):
     conn.commit()
     conn.close()
 
-async def update_crypto_prices():
+def save_crypto_prices(prices):
+    """Enregistrer les prix d'un rafraîchissement complet et leur historique dans une seule transaction"""
+    if not prices:
+        return
+    now = datetime.now()
+    timestamp = now.isoformat()
+    conn = sqlite3.connect(f'{PATH_DB_BASE}/cache_prix_crypto.db', timeout=10)
+    # WAL : les lectures des workers ne bloquent pas l'écriture du lot de prix
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    try:
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS prices (
+                    crypto_id TEXT PRIMARY KEY,
+                    price REAL,
+                    timestamp TEXT
+                )
+            ''')
+            for crypto_id, price in prices.items():
+                # La table créée par run.sh n'a pas de contrainte d'unicité sur crypto_id : pas d'UPSERT possible
+                cursor.execute('''
+                    UPDATE prices
+                    SET price = ?, timestamp = ?
+                    WHERE crypto_id = ?
+                ''', (price, timestamp, crypto_id))
+                if cursor.rowcount == 0:
+                    cursor.execute('''
+                        INSERT INTO prices (crypto_id, price, timestamp)
+                        VALUES (?, ?, ?)
+                    ''', (crypto_id, price, timestamp))
+            # Historique et agrégation incrémentale des bougies 1h/1d
+            record_price_batch(conn, prices, now.timestamp())
+            bump_price_generation(conn)
+    finally:
+        conn.close()
+
+async def refresh_crypto_prices(engine, crypto_ids):
+    """Rafraîchir les prix de toutes les cryptos suivies, les lots étant envoyés en parallèle dans le budget du moteur"""
+    prices = {}
+    chunks = chunk_crypto_ids(crypto_ids)
+    logging.info(f"Récupération des prix en {len(chunks)} lot(s)")
+    for chunk_prices in await asyncio.gather(*(fetch_crypto_prices(engine, chunk) for chunk in chunks)):
+        prices.update(chunk_prices)
+    save_crypto_prices(prices)
+    logging.info(f"Prix mis à jour pour {len(prices)}/{len(crypto_ids)} cryptos, compteurs CoinGecko: {engine.stats.as_dict()}")
+    return prices
+
+async def update_crypto_prices(engine):
     while True:
+        try:
+            # Le catalogue local n'est retéléchargé qu'une fois par COIN_INDEX_REFRESH_INTERVAL
+            await refresh_coin_index(engine)
+        except Exception as e:
+            logging.error(f"Erreur lors du rafraîchissement du catalogue des cryptos: {e}")
         logging.info("Starting to update crypto prices...")
         cryptos = get_crypto_list()
         if not cryptos:
@@ -74,20 +153,25 @@ async def update_crypto_prices():
             await asyncio.sleep(UPDATE_INTERVAL_PRICE_UPDATER)
         else:
             #logging.info(f"cryptos : {cryptos}")
-            for crypto_id in cryptos:
-                logging.info(f"Updating price for {crypto_id}")
-                update_crypto_price(crypto_id)
-                await asyncio.sleep(UPDATE_INTERVAL_PRICE_UPDATER)  # Sleep for the defined interval
-        logging.info("Finished updating crypto prices. Restarting loop...")
+            logging.info(f"Updating prices for {len(cryptos)} cryptos")
+            await refresh_crypto_prices(engine, cryptos)
+            try:
+                # Prix journaliers passés des transactions, par périodes entières
+                await backfill_historical_prices(engine)
+            except Exception as e:
+                logging.error(f"Erreur lors du rattrapage de l'historique des prix: {e}")
+            logging.info("Finished updating crypto prices. Restarting loop...")
+            await asyncio.sleep(UPDATE_INTERVAL_PRICE_UPDATER)  # Sleep for the defined interval
 
 
 async def main():
-    while True:
-        try:
-            await update_crypto_prices()
-        except Exception as e:
-            logging.error(f"Unhandled error occurred: {e}")
-            await asyncio.sleep(60)  # Wait a bit before restarting in case of error
+    async with CoinGeckoFetchEngine() as engine:
+        while True:
+            try:
+                await update_crypto_prices(engine)
+            except Exception as e:
+                logging.error(f"Unhandled error occurred: {e}")
+                await asyncio.sleep(60)  # Wait a bit before restarting in case of error
 
 if __name__ == "__main__":
     asyncio.run(main())
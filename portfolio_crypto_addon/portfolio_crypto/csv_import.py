@@ -0,0 +1,236 @@
+"""
+Fichier csv_import.py
+Ce fichier gère l'import des historiques CSV exportés par les plateformes d'échange
+(Binance, Kraken, Coinbase). Le fichier est lu en flux, ligne à ligne : chaque ligne
+est convertie par le convertisseur de la plateforme en transaction au format de
+l'import par lots, puis insérée par paquets avec un point de reprise.
+"""
+
+import codecs
+import csv
+import logging
+import math
+import re
+from datetime import datetime, timezone
+from .bulk_transactions import ingest_transactions
+from .db import get_import_checkpoint
+
+CSV_IMPORT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+# Seules les paires cotées en dollars sont importées : price_usd est un montant en USD
+USD_QUOTES = ('USDT', 'USDC', 'BUSD', 'FDUSD', 'TUSD', 'DAI', 'USD')
+
+# Symboles ambigus dans le catalogue CoinGecko (jetons homonymes) : id de la crypto principale
+SYMBOL_IDS = {
+    'BTC': 'bitcoin',
+    'ETH': 'ethereum',
+    'BNB': 'binancecoin',
+    'SOL': 'solana',
+    'XRP': 'ripple',
+    'ADA': 'cardano',
+    'DOGE': 'dogecoin',
+    'DOT': 'polkadot',
+    'LTC': 'litecoin',
+    'LINK': 'chainlink',
+    'AVAX': 'avalanche-2',
+    'MATIC': 'matic-network',
+    'ATOM': 'cosmos',
+    'USDT': 'tether',
+    'USDC': 'usd-coin',
+}
+
+# Codes d'actifs historiques de Kraken
+KRAKEN_ASSETS = {'XXBT': 'BTC', 'XBT': 'BTC', 'XETH': 'ETH', 'XXDG': 'DOGE', 'XDG': 'DOGE', 'XLTC': 'LTC', 'XXRP': 'XRP'}
+
+_AMOUNT_RE = re.compile(r'^\s*([-+]?[\d.,]+(?:[eE][-+]?\d+)?)\s*([A-Za-z0-9]*)\s*$')
+
+
+def parse_number(value):
+    """Convertir un nombre exporté ('1,234.5', '0.1 ', '') en float"""
+    if value is None or not str(value).strip():
+        return 0.0
+    number = float(str(value).replace(',', '').replace('$', '').strip())
+    if not math.isfinite(number):
+        raise ValueError(f"Nombre invalide: {value}")
+    return number
+
+
+def parse_amount(value):
+    """Séparer un montant Binance du type '0.5BTC' en (0.5, 'BTC')"""
+    match = _AMOUNT_RE.match(value or '')
+    if not match:
+        raise ValueError(f"Montant invalide: {value}")
+    return parse_number(match.group(1)), match.group(2).upper()
+
+
+def parse_timestamp(value):
+    """Normaliser un horodatage d'export en 'YYYY-MM-DD HH:MM:SS' (UTC)"""
+    value = (value or '').strip()
+    if not value:
+        raise ValueError("Date manquante")
+    if re.fullmatch(r'\d{10}(\.\d+)?', value):
+        parsed = datetime.fromtimestamp(float(value), tz=timezone.utc)
+    else:
+        text = value.replace('T', ' ').replace('Z', '+00:00').replace(' UTC', '+00:00')
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            # Fractions de seconde au-delà de la microseconde (Kraken)
+            parsed = datetime.fromisoformat(re.sub(r'(\.\d{6})\d+', r'\1', text))
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def split_pair(pair):
+    """Séparer une paire ('BTCUSDT', 'XXBTZUSD', 'ETH-USD') en (base, cotation)"""
+    pair = pair.upper().replace('-', '').replace('/', '')
+    # Anciennes paires Kraken : base sur 4 caractères en X... et cotation ZUSD (XXBTZUSD)
+    if len(pair) == 8 and pair.startswith('X') and pair.endswith('ZUSD'):
+        return KRAKEN_ASSETS.get(pair[:4], pair[1:4]), 'USD'
+    for quote in USD_QUOTES:
+        if pair.endswith(quote) and len(pair) > len(quote):
+            base = pair[:-len(quote)]
+            return KRAKEN_ASSETS.get(base, base), quote
+    raise ValueError(f"Devise de cotation non supportée: {pair}")
+
+
+def symbol_transaction(symbol, quantity, total_usd, side, date, location, symbol_map):
+    """Construire une transaction au format de l'import par lots"""
+    symbol = symbol.upper()
+    crypto_id = symbol_map.get(symbol) or SYMBOL_IDS.get(symbol)
+    transaction = {
+        "crypto_name": symbol,
+        "quantity": quantity,
+        "price_usd": total_usd,
+        "transaction_type": side,
+        "date": date,
+        "location": location,
+    }
+    if crypto_id:
+        transaction["crypto_id"] = crypto_id
+    return transaction
+
+
+def map_binance(row, symbol_map):
+    """Historique des trades Binance : Date(UTC), Pair, Side, Price, Executed, Amount, Fee"""
+    base, quote = split_pair(row['Pair'])
+    side = row['Side'].strip().lower()
+    quantity, _ = parse_amount(row['Executed'])
+    total, _ = parse_amount(row['Amount'])
+    fee, fee_asset = parse_amount(row.get('Fee') or '0')
+    # Les frais réduisent la quantité reçue ou s'ajoutent au coût selon l'actif prélevé
+    if fee_asset == base:
+        quantity = quantity - fee if side == 'buy' else quantity + fee
+    elif fee_asset == quote:
+        total = total + fee if side == 'buy' else total - fee
+    return symbol_transaction(base, quantity, total, side, parse_timestamp(row['Date(UTC)']), 'Binance', symbol_map)
+
+
+def map_kraken(row, symbol_map):
+    """trades.csv de Kraken : pair, time, type, price, cost, fee, vol (frais en devise de cotation)"""
+    base, _ = split_pair(row['pair'])
+    side = row['type'].strip().lower()
+    cost = parse_number(row['cost'])
+    fee = parse_number(row.get('fee'))
+    total = cost + fee if side == 'buy' else cost - fee
+    return symbol_transaction(base, parse_number(row['vol']), total, side, parse_timestamp(row['time']), 'Kraken', symbol_map)
+
+
+def map_coinbase(row, symbol_map):
+    """Relevé de transactions Coinbase : seuls les achats et ventes sont importés"""
+    kind = row['Transaction Type'].strip().lower()
+    if kind.endswith('buy'):
+        side = 'buy'
+    elif kind.endswith('sell'):
+        side = 'sell'
+    else:
+        return None
+    currency = (row.get('Spot Price Currency') or row.get('Price Currency') or 'USD').strip().upper()
+    if currency not in USD_QUOTES:
+        raise ValueError(f"Devise non supportée: {currency}")
+    total_column = next((column for column in row if column and column.startswith('Total')), None)
+    total = parse_number(row.get(total_column)) if total_column else parse_number(row.get('Subtotal'))
+    return symbol_transaction(row['Asset'], abs(parse_number(row['Quantity Transacted'])), abs(total), side,
+                              parse_timestamp(row['Timestamp']), 'Coinbase', symbol_map)
+
+
+# Convertisseurs par plateforme : colonnes identifiant l'en-tête et fonction de conversion
+CSV_FORMATS = {
+    'binance': ({'Date(UTC)', 'Pair', 'Side', 'Executed', 'Amount'}, map_binance),
+    'kraken': ({'pair', 'time', 'type', 'cost', 'vol'}, map_kraken),
+    'coinbase': ({'Timestamp', 'Transaction Type', 'Asset', 'Quantity Transacted'}, map_coinbase),
+}
+
+
+def read_csv_rows(stream, fmt=None):
+    """Parcourir un fichier CSV binaire en flux et retourner (format, itérateur de lignes)
+
+    L'en-tête est cherché dans les premières lignes : Coinbase ajoute un préambule
+    avant les colonnes.
+    """
+    # codecs plutôt que io.TextIOWrapper : le SpooledTemporaryFile des envois Werkzeug
+    # n'a pas de méthode readable() avant Python 3.11
+    reader = csv.reader(codecs.getreader('utf-8-sig')(stream))
+    for _ in range(20):
+        header = next(reader, None)
+        if header is None:
+            break
+        columns = {column.strip() for column in header}
+        for name, (required, _) in CSV_FORMATS.items():
+            if (fmt is None or fmt == name) and required <= columns:
+                header = [column.strip() for column in header]
+                return name, (dict(zip(header, values)) for values in reader if any(values))
+    raise ValueError("Format CSV non reconnu")
+
+
+def import_csv(entry_id, stream, import_id, fmt=None, symbol_map=None, batch_size=CSV_IMPORT_BATCH_SIZE):
+    """Importer un CSV de plateforme d'échange, par paquets, en reprenant après le dernier point de reprise"""
+    symbol_map = {symbol.upper(): crypto_id for symbol, crypto_id in (symbol_map or {}).items()}
+    fmt, rows = read_csv_rows(stream, fmt)
+    mapper = CSV_FORMATS[fmt][1]
+    checkpoint = get_import_checkpoint(entry_id, import_id)
+    if checkpoint and checkpoint["completed"]:
+        return {"import_id": import_id, "format": fmt, "status": "already_completed", **checkpoint, "errors": []}
+    skip = checkpoint["rows_done"] if checkpoint else 0
+
+    inserted = 0
+    error_count = 0
+    errors = []
+    batch = []
+    index = -1
+
+    def flush(completed):
+        nonlocal inserted, error_count
+        result = ingest_transactions(entry_id, batch, checkpoint=(import_id, fmt, index + 1, completed))
+        inserted += result["inserted"]
+        error_count += len(result["errors"])
+        errors.extend(result["errors"][:MAX_REPORTED_ERRORS - len(errors)])
+        batch.clear()
+
+    for index, row in enumerate(rows):
+        if index < skip:
+            continue
+        try:
+            transaction = mapper(row, symbol_map)
+        except (KeyError, ValueError) as e:
+            batch.append((index, None, f"Ligne invalide: {e}"))
+        else:
+            if transaction is not None:
+                batch.append((index, transaction, None))
+        if len(batch) >= batch_size:
+            flush(False)
+    flush(True)
+
+    logging.info(f"Import CSV {import_id} ({fmt}) pour l'entrée {entry_id}: {inserted} transactions ajoutées, {error_count} erreurs")
+    return {
+        "import_id": import_id,
+        "format": fmt,
+        "status": "completed",
+        "resumed_from": skip,
+        "rows_done": index + 1,
+        "inserted": inserted,
+        "error_count": error_count,
+        "errors": errors,
+    }
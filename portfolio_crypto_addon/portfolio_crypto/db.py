@@ -1,10 +1,14 @@
 import sqlite3
 import os
+import base64
+import json
+from datetime import date as Date
 import logging
+import threading
 import requests
 import asyncio 
 from flask import Flask, jsonify, request, send_file
-from .const import COINGECKO_API_URL, UPDATE_INTERVAL, RATE_LIMIT, PORT_APP, PATH_DB_BASE
+from .const import COINGECKO_API_URL, UPDATE_INTERVAL, RATE_LIMIT, PORT_APP, PATH_DB_BASE, SQLITE_CACHE_SIZE_KB, SQLITE_BUSY_TIMEOUT, TRANSACTIONS_PAGE_MAX
 from .coingecko import get_crypto_price
 
 # Configurer les logs
@@ -17,17 +21,68 @@ def get_database_path(entry_id):
     #logging.info(f"Chemin de la base de données pour l'entrée {entry_id}: {db_path}")
     return db_path
 
-def get_database_path_export(entry_id):
-    """Récupérer le chemin de la base de données pour un ID d'entrée donné"""
-    #db_path = os.path.join('/app', f'portfolio_crypto_{entry_id}.db')
-    db_path = f'{PATH_DB_BASE}/portfolio_crypto_{entry_id}.db'
-    #logging.info(f"Chemin de la base de données pour l'entrée {entry_id}: {db_path}")
-    return db_path
+# Connexions mises en cache par thread (et par processus) et bases dont le schéma est déjà vérifié
+_local = threading.local()
+_initialized = set()
+_init_lock = threading.Lock()
+
+def connect_database(db_path):
+    """Ouvrir une connexion configurée : journal WAL, synchronous NORMAL et cache de pages dimensionné"""
+    conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+    return conn
+
+def _thread_connections():
+    # Les connexions ne doivent pas être partagées avec un processus issu d'un fork
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+    return _local.connections
+
+def get_connection(entry_id):
+    """Récupérer la connexion du thread courant pour la base d'un ID d'entrée donné"""
+    return get_path_connection(get_database_path(entry_id))
+
+def get_path_connection(db_path):
+    """Récupérer la connexion du thread courant pour une base SQLite désignée par son chemin"""
+    connections = _thread_connections()
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = connect_database(db_path)
+        connections[db_path] = conn
+    return conn
+
+def close_connection(entry_id):
+    """Fermer la connexion du thread courant et oublier l'initialisation du schéma (remplacement du fichier)"""
+    db_path = get_database_path(entry_id)
+    conn = _thread_connections().pop(db_path, None)
+    if conn is not None:
+        conn.close()
+    with _init_lock:
+        _initialized.discard(db_path)
+
+def ensure_initialized(db_path, initialize):
+    """Exécuter initialize() (création des tables) une seule fois par processus pour une base"""
+    if db_path in _initialized:
+        return
+    with _init_lock:
+        if db_path not in _initialized:
+            initialize()
+            _initialized.add(db_path)
+
+def ensure_schema(entry_id):
+    """Créer et migrer les tables d'un portefeuille une seule fois par processus"""
+    def initialize():
+        create_table(entry_id)
+        create_crypto_table(entry_id)
+        migrate_database(entry_id)
+    ensure_initialized(get_database_path(entry_id), initialize)
 
 def create_table(entry_id):
-    db_path = get_database_path(entry_id)
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(entry_id)
         cursor = conn.cursor()
         
         # Vérifier si la table 'transactions' existe déjà
@@ -52,14 +107,13 @@ def create_table(entry_id):
         else:
             logging.info(f"Table 'transactions' existe déjà pour l'entrée {entry_id}")
 
-        conn.close()
+        create_holdings_table(conn)
     except Exception as e:
         logging.error(f"Erreur lors de la création de la table pour l'entrée {entry_id}: {e}")
 
 def create_crypto_table(entry_id):
-    db_path = get_database_path(entry_id)
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(entry_id)
         cursor = conn.cursor()
         
         # Vérifier si la table 'cryptos' existe déjà
@@ -79,88 +133,420 @@ def create_crypto_table(entry_id):
         else:
             logging.info(f"Table 'cryptos' existe déjà pour l'entrée {entry_id}")
 
-        conn.close()
     except Exception as e:
         logging.error(f"Erreur lors de la création de la table 'cryptos' pour l'entrée {entry_id}: {e}")
 
-def save_crypto(entry_id, crypto_name, crypto_id):
-    create_crypto_table(entry_id)
-    conn = sqlite3.connect(get_database_path(entry_id))
+# Migrations du schéma, numérotées à partir de 1 et suivies par PRAGMA user_version.
+# Ne jamais modifier une migration publiée : en ajouter une nouvelle à la fin.
+MIGRATIONS = [
+    ("Index des transactions par crypto, date et type", [
+        'CREATE INDEX IF NOT EXISTS idx_transactions_crypto_date ON transactions (crypto_id, date)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions (transaction_type)',
+    ]),
+    ("Unicité des cryptos par entrée", [
+        # Les anciennes versions pouvaient enregistrer deux fois la même crypto
+        'DELETE FROM cryptos WHERE id NOT IN (SELECT MIN(id) FROM cryptos GROUP BY entry_id, crypto_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_cryptos_entry_crypto ON cryptos (entry_id, crypto_id)',
+    ]),
+    ("Points de reprise des imports CSV", [
+        '''CREATE TABLE IF NOT EXISTS import_checkpoints (
+            import_id TEXT PRIMARY KEY,
+            source TEXT,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            inserted INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )''',
+    ]),
+    ("Table meta (époque du registre) et index chronologique des transactions", [
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_date_id ON transactions (date, id)',
+    ]),
+    # Toute écriture sur les transactions passe par 'holdings' (une ligne par crypto et par lot) :
+    # des déclencheurs sur 'holdings' et 'cryptos' suffisent à versionner le portefeuille
+    ("Compteur d'écritures (version du portefeuille pour les caches de réponses)", [
+        '''CREATE TRIGGER IF NOT EXISTS trg_holdings_insert_version AFTER INSERT ON holdings BEGIN
+            INSERT INTO meta (key, value) VALUES ('write_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_holdings_update_version AFTER UPDATE ON holdings BEGIN
+            INSERT INTO meta (key, value) VALUES ('write_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_holdings_delete_version AFTER DELETE ON holdings BEGIN
+            INSERT INTO meta (key, value) VALUES ('write_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_cryptos_insert_version AFTER INSERT ON cryptos BEGIN
+            INSERT INTO meta (key, value) VALUES ('write_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_cryptos_update_version AFTER UPDATE ON cryptos BEGIN
+            INSERT INTO meta (key, value) VALUES ('write_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_cryptos_delete_version AFTER DELETE ON cryptos BEGIN
+            INSERT INTO meta (key, value) VALUES ('write_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1;
+        END''',
+    ]),
+]
+
+def migrate_database(entry_id):
+    """Appliquer les migrations manquantes, chacune dans sa propre transaction"""
+    conn = get_connection(entry_id)
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    while version < len(MIGRATIONS):
+        description, statements = MIGRATIONS[version]
+        with conn:
+            # Relire la version sous verrou : un autre worker a pu migrer entre-temps
+            conn.execute('BEGIN IMMEDIATE')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                break
+            description, statements = MIGRATIONS[version]
+            for statement in statements:
+                conn.execute(statement)
+            version += 1
+            conn.execute(f'PRAGMA user_version = {version}')
+        logging.info(f"Migration {version} appliquée pour l'entrée {entry_id}: {description}")
+
+# Agrégats par crypto : quantité détenue, investissement net (achats - ventes),
+# coût total des achats (base du prix moyen) et nombre de transactions
+HOLDINGS_AGGREGATE_SQL = '''
+    SELECT crypto_id,
+           SUM(CASE transaction_type WHEN 'buy' THEN quantity WHEN 'sell' THEN -quantity ELSE 0 END),
+           SUM(CASE transaction_type WHEN 'buy' THEN price_usd WHEN 'sell' THEN -price_usd ELSE 0 END),
+           SUM(CASE WHEN transaction_type = 'buy' THEN price_usd ELSE 0 END),
+           COUNT(*)
+    FROM transactions
+    GROUP BY crypto_id
+'''
+
+def create_holdings_table(conn):
+    """Créer la table 'holdings' si elle n'existe pas et la remplir depuis les transactions existantes"""
     cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='holdings'")
+    if cursor.fetchone() is None:
+        with conn:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS holdings (
+                    crypto_id TEXT PRIMARY KEY,
+                    quantity REAL NOT NULL DEFAULT 0,
+                    invested REAL NOT NULL DEFAULT 0,
+                    cost_basis REAL NOT NULL DEFAULT 0,
+                    tx_count INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transactions'")
+            if cursor.fetchone() is not None:
+                _rebuild_holdings(cursor)
+        logging.info("Table 'holdings' créée")
+
+def _rebuild_holdings(cursor):
+    cursor.execute('DELETE FROM holdings')
+    cursor.execute(f'INSERT INTO holdings (crypto_id, quantity, invested, cost_basis, tx_count) {HOLDINGS_AGGREGATE_SQL}')
+
+def _apply_holding(cursor, crypto_id, quantity, price_usd, transaction_type, sign=1):
+    """Ajouter (sign=1) ou retirer (sign=-1) l'effet d'une transaction sur la ligne 'holdings' de la crypto"""
+    quantity = quantity or 0
+    price_usd = price_usd or 0
+    if transaction_type == 'buy':
+        delta = (quantity, price_usd, price_usd)
+    elif transaction_type == 'sell':
+        delta = (-quantity, -price_usd, 0)
+    else:
+        delta = (0, 0, 0)
+    cursor.execute('''
+        INSERT INTO holdings (crypto_id, quantity, invested, cost_basis, tx_count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (crypto_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            invested = invested + excluded.invested,
+            cost_basis = cost_basis + excluded.cost_basis,
+            tx_count = tx_count + excluded.tx_count
+    ''', (crypto_id, sign * delta[0], sign * delta[1], sign * delta[2], sign))
+    if sign < 0:
+        cursor.execute('DELETE FROM holdings WHERE crypto_id = ? AND tx_count <= 0', (crypto_id,))
+
+def _bump_ledger_epoch(cursor):
+    """Signaler que l'historique a été réécrit (modification, suppression, import, ajout antidaté) :
+    les états calculés de façon incrémentale à partir des transactions doivent être recalculés"""
+    cursor.execute('''
+        INSERT INTO meta (key, value) VALUES ('ledger_epoch', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+    ''')
+
+def _check_backdated(cursor, dates):
+    """Incrémenter l'époque si des transactions sont insérées avant la plus récente déjà enregistrée"""
+    latest = cursor.execute('SELECT MAX(date) FROM transactions').fetchone()[0]
+    if latest is None:
+        return
+    # Une date absente est triée avant toutes les autres
+    if any(date is None for date in dates) or min(str(date) for date in dates) < str(latest):
+        _bump_ledger_epoch(cursor)
+
+def get_ledger_epoch(entry_id):
+    ensure_schema(entry_id)
+    row = get_connection(entry_id).execute("SELECT value FROM meta WHERE key = 'ledger_epoch'").fetchone()
+    return row[0] if row else 0
+
+def get_write_version(entry_id):
+    """Compteur incrémenté par chaque écriture validée sur le portefeuille, quel que soit le processus"""
+    ensure_schema(entry_id)
+    row = get_connection(entry_id).execute("SELECT value FROM meta WHERE key = 'write_version'").fetchone()
+    return row[0] if row else 0
+
+def _apply_holdings_batch(cursor, rows):
+    """Appliquer l'effet d'un lot de transactions (crypto_id, quantity, price_usd, transaction_type) : une mise à jour par crypto"""
+    deltas = {}
+    for crypto_id, quantity, price_usd, transaction_type in rows:
+        quantity = quantity or 0
+        price_usd = price_usd or 0
+        delta = deltas.setdefault(crypto_id, [0, 0, 0, 0])
+        if transaction_type == 'buy':
+            delta[0] += quantity
+            delta[1] += price_usd
+            delta[2] += price_usd
+        elif transaction_type == 'sell':
+            delta[0] -= quantity
+            delta[1] -= price_usd
+        delta[3] += 1
+    cursor.executemany('''
+        INSERT INTO holdings (crypto_id, quantity, invested, cost_basis, tx_count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (crypto_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            invested = invested + excluded.invested,
+            cost_basis = cost_basis + excluded.cost_basis,
+            tx_count = tx_count + excluded.tx_count
+    ''', [(crypto_id, *delta) for crypto_id, delta in deltas.items()])
+
+def get_holdings(entry_id):
+    """Récupérer les agrégats par crypto : {crypto_id: {quantity, invested, cost_basis, tx_count}}"""
+    ensure_schema(entry_id)
+    cursor = get_connection(entry_id).cursor()
+    cursor.execute('SELECT crypto_id, quantity, invested, cost_basis, tx_count FROM holdings')
+    return {
+        crypto_id: {"quantity": quantity, "invested": invested, "cost_basis": cost_basis, "tx_count": tx_count}
+        for crypto_id, quantity, invested, cost_basis, tx_count in cursor.fetchall()
+    }
+
+def rebuild_holdings(entry_id):
+    """Recalculer entièrement la table 'holdings' depuis les transactions"""
+    ensure_schema(entry_id)
+    conn = get_connection(entry_id)
+    with conn:
+        _rebuild_holdings(conn.cursor())
+    logging.info(f"Table 'holdings' recalculée pour l'entrée {entry_id}")
+
+def verify_holdings(entry_id, tolerance=1e-6):
+    """Comparer la table 'holdings' aux transactions ; retourne la liste des écarts"""
+    ensure_schema(entry_id)
+    cursor = get_connection(entry_id).cursor()
+    cursor.execute(HOLDINGS_AGGREGATE_SQL)
+    expected = {row[0]: row[1:] for row in cursor.fetchall()}
+    cursor.execute('SELECT crypto_id, quantity, invested, cost_basis, tx_count FROM holdings')
+    actual = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    mismatches = []
+    for crypto_id in sorted(set(expected) | set(actual)):
+        exp = expected.get(crypto_id, (0, 0, 0, 0))
+        act = actual.get(crypto_id, (0, 0, 0, 0))
+        if any(abs((e or 0) - (a or 0)) > tolerance * max(1, abs(e or 0)) for e, a in zip(exp, act)):
+            mismatches.append({
+                "crypto_id": crypto_id,
+                "expected": dict(zip(("quantity", "invested", "cost_basis", "tx_count"), exp)),
+                "actual": dict(zip(("quantity", "invested", "cost_basis", "tx_count"), act)),
+            })
+    return mismatches
+
+def save_crypto(entry_id, crypto_name, crypto_id):
+    ensure_schema(entry_id)
+    conn = get_connection(entry_id)
     try:
-        cursor.execute('''
-            INSERT INTO cryptos (entry_id, crypto_name, crypto_id)
-            VALUES (?, ?, ?)
-        ''', (entry_id, crypto_name, crypto_id))
-        conn.commit()
+        with conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO cryptos (entry_id, crypto_name, crypto_id)
+                VALUES (?, ?, ?)
+            ''', (entry_id, crypto_name, crypto_id))
         logging.info(f"Crypto {crypto_name} avec ID {crypto_id} sauvegardée pour l'entrée {entry_id}")
     except Exception as e:
         logging.error(f"Erreur lors de la sauvegarde de la crypto pour l'entrée {entry_id}: {e}")
-    finally:
-        conn.close()
 
 def get_cryptos(entry_id):
-    create_crypto_table(entry_id)
-    conn = sqlite3.connect(get_database_path(entry_id))
-    cursor = conn.cursor()
+    ensure_schema(entry_id)
+    cursor = get_connection(entry_id).cursor()
     cursor.execute('SELECT crypto_name, crypto_id FROM cryptos WHERE entry_id = ?', (entry_id,))
     cryptos = cursor.fetchall()
-    conn.close()
     return cryptos
 
 def add_transaction(entry_id, crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price):
     """Ajouter une transaction à la base de données"""
-    create_table(entry_id)  # Assurer que la table est créée avant d'ajouter des données
-    conn = sqlite3.connect(get_database_path(entry_id))
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO transactions (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price))
-    conn.commit()
-    conn.close()
+    ensure_schema(entry_id)  # Assurer que la table est créée avant d'ajouter des données
+    conn = get_connection(entry_id)
+    with conn:
+        cursor = conn.cursor()
+        _check_backdated(cursor, [date])
+        cursor.execute('''
+            INSERT INTO transactions (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price))
+        _apply_holding(cursor, crypto_id, quantity, price_usd, transaction_type)
+
+def add_transactions(entry_id, transactions, checkpoint=None):
+    """Ajouter un lot de transactions (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price) en une seule transaction.
+
+    checkpoint (import_id, source, rows_done, completed) est enregistré dans la même
+    transaction que le lot : une reprise ne peut ni perdre ni doubler de lignes.
+    """
+    ensure_schema(entry_id)
+    conn = get_connection(entry_id)
+    with conn:
+        cursor = conn.cursor()
+        _check_backdated(cursor, [t[6] for t in transactions])
+        cursor.executemany('''
+            INSERT INTO transactions (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', transactions)
+        _apply_holdings_batch(cursor, [(t[1], t[2], t[3], t[4]) for t in transactions])
+        if checkpoint:
+            import_id, source, rows_done, completed = checkpoint
+            cursor.execute('''
+                INSERT INTO import_checkpoints (import_id, source, rows_done, inserted, completed, updated_at)
+                VALUES (?, ?, ?, ?, ?, datetime('now'))
+                ON CONFLICT (import_id) DO UPDATE SET
+                    rows_done = excluded.rows_done,
+                    inserted = inserted + excluded.inserted,
+                    completed = excluded.completed,
+                    updated_at = excluded.updated_at
+            ''', (import_id, source, rows_done, len(transactions), int(completed)))
+    logging.info(f"{len(transactions)} transactions ajoutées pour l'entrée {entry_id}")
+    return len(transactions)
+
+def get_import_checkpoint(entry_id, import_id):
+    """Récupérer l'avancement d'un import CSV : {source, rows_done, inserted, completed, updated_at} ou None"""
+    ensure_schema(entry_id)
+    cursor = get_connection(entry_id).cursor()
+    cursor.execute('SELECT source, rows_done, inserted, completed, updated_at FROM import_checkpoints WHERE import_id = ?', (import_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip(("source", "rows_done", "inserted", "completed", "updated_at"), row))
+
+def reset_import_checkpoint(entry_id, import_id):
+    ensure_schema(entry_id)
+    conn = get_connection(entry_id)
+    with conn:
+        conn.execute('DELETE FROM import_checkpoints WHERE import_id = ?', (import_id,))
 
 def get_transactions(entry_id):
     """Récupérer toutes les transactions pour un ID d'entrée donné"""
-    conn = sqlite3.connect(get_database_path(entry_id))
-    cursor = conn.cursor()
+    ensure_schema(entry_id)
+    cursor = get_connection(entry_id).cursor()
     cursor.execute('SELECT * FROM transactions')
     transactions = cursor.fetchall()
-    conn.close()
     return transactions
 
-def get_all_transactions():
-    """Récupérer toutes les transactions de toutes les bases de données"""
-    databases = [f for f in os.listdir(os.getenv('HASS_CONFIG', '.')) if f.startswith('portfolio_crypto_') and f.endswith('.db')]
-    all_transactions = []
-    for db in databases:
-        conn = sqlite3.connect(os.path.join(os.getenv('HASS_CONFIG', '.'), db))
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM transactions')
-        transactions = cursor.fetchall()
-        all_transactions.extend(transactions)
-        conn.close()
-    return all_transactions
+def encode_transaction_cursor(date, transaction_id):
+    """Curseur opaque d'une page de transactions : position (date, id) de la dernière ligne retournée"""
+    return base64.urlsafe_b64encode(json.dumps([date, transaction_id]).encode()).decode().rstrip('=')
+
+def decode_transaction_cursor(cursor):
+    """Position (date, id) d'un curseur de encode_transaction_cursor ; ValueError s'il est invalide"""
+    try:
+        date, transaction_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Curseur invalide: {cursor}") from e
+    if not isinstance(transaction_id, int) or not (date is None or isinstance(date, str)):
+        raise ValueError(f"Curseur invalide: {cursor}")
+    return date, transaction_id
+
+def get_transactions_page(entry_id, limit, after=None, crypto_id=None, transaction_type=None, start=None, end=None):
+    """Récupérer une page de transactions triées par (date, id), à partir du curseur 'after'.
+
+    Les filtres (crypto_id, type, dates de début et de fin incluses) sont appliqués en SQL
+    et le parcours suit les index (date, id) ou (crypto_id, date) : seules limit + 1
+    lignes sont lues, quelle que soit la taille du registre. Retourne (transactions,
+    curseur de la page suivante ou None).
+    """
+    if not 1 <= limit <= TRANSACTIONS_PAGE_MAX:
+        raise ValueError(f"limit doit être compris entre 1 et {TRANSACTIONS_PAGE_MAX}")
+    for bound in (start, end):
+        try:
+            if bound is not None:
+                Date.fromisoformat(bound)
+        except ValueError:
+            raise ValueError(f"Date invalide (AAAA-MM-JJ attendu): {bound}")
+    conditions = []
+    params = []
+    if crypto_id is not None:
+        conditions.append('crypto_id = ?')
+        params.append(crypto_id)
+    if transaction_type is not None:
+        conditions.append('transaction_type = ?')
+        params.append(transaction_type)
+    if start is not None:
+        conditions.append('date >= ?')
+        params.append(start)
+    if end is not None:
+        # Fin incluse : les dates avec heure du dernier jour ('2024-01-31T12:00') restent dans la période
+        conditions.append('date < ?')
+        params.append(end + '\uffff')
+    if after is not None:
+        date, transaction_id = decode_transaction_cursor(after)
+        if date is None:
+            # Les transactions sans date sont triées en premier
+            conditions.append('((date IS NULL AND id > ?) OR date IS NOT NULL)')
+            params.append(transaction_id)
+        else:
+            conditions.append('(date, id) > (?, ?)')
+            params.extend((date, transaction_id))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    ensure_schema(entry_id)
+    columns = ', '.join(('id',) + TRANSACTION_COLUMNS)
+    rows = get_connection(entry_id).execute(
+        f'SELECT {columns} FROM transactions {where} ORDER BY date, id LIMIT ?', (*params, limit + 1)
+    ).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_transaction_cursor(rows[-1][7], rows[-1][0])
 
 def delete_transaction(entry_id, transaction_id):
     """Supprimer une transaction de la base de données"""
-    conn = sqlite3.connect(get_database_path(entry_id))
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
-    conn.commit()
-    conn.close()
+    ensure_schema(entry_id)
+    conn = get_connection(entry_id)
+    with conn:
+        cursor = conn.cursor()
+        # Verrou d'écriture dès la lecture de l'ancienne ligne
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT crypto_id, quantity, price_usd, transaction_type FROM transactions WHERE id = ?', (transaction_id,))
+        old = cursor.fetchone()
+        cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
+        if old:
+            _apply_holding(cursor, *old, sign=-1)
+            _bump_ledger_epoch(cursor)
 
 def update_transaction(entry_id, transaction_id, crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price):
     """Mettre à jour une transaction dans la base de données"""
-    conn = sqlite3.connect(get_database_path(entry_id))
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE transactions
-        SET crypto_name = ?, crypto_id = ?, quantity = ?, price_usd = ?, transaction_type = ?, location = ?, date = ?, historical_price = ?
-        WHERE id = ?
-    ''', (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price, transaction_id))
-    conn.commit()
-    conn.close()
+    ensure_schema(entry_id)
+    conn = get_connection(entry_id)
+    with conn:
+        cursor = conn.cursor()
+        # Verrou d'écriture dès la lecture de l'ancienne ligne
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT crypto_id, quantity, price_usd, transaction_type FROM transactions WHERE id = ?', (transaction_id,))
+        old = cursor.fetchone()
+        cursor.execute('''
+            UPDATE transactions
+            SET crypto_name = ?, crypto_id = ?, quantity = ?, price_usd = ?, transaction_type = ?, location = ?, date = ?, historical_price = ?
+            WHERE id = ?
+        ''', (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price, transaction_id))
+        if old:
+            _apply_holding(cursor, *old, sign=-1)
+            _apply_holding(cursor, crypto_id, quantity, price_usd, transaction_type)
+            _bump_ledger_epoch(cursor)
 
 #def get_crypto_transactions(entry_id, crypto_name):
 #    """Récupérer les transactions d'une crypto-monnaie spécifique pour un ID d'entrée donné"""
@@ -173,11 +559,10 @@ def update_transaction(entry_id, transaction_id, crypto_name, crypto_id, quantit
 
 def get_crypto_transactions(entry_id, crypto_id):
     """Récupérer les transactions pour une crypto-monnaie spécifique et un ID d'entrée donné"""
-    conn = sqlite3.connect(get_database_path(entry_id))
-    cursor = conn.cursor()
+    ensure_schema(entry_id)
+    cursor = get_connection(entry_id).cursor()
     cursor.execute('SELECT * FROM transactions WHERE crypto_id = ?', (crypto_id,))
     transactions = cursor.fetchall()
-    conn.close()
     return transactions
 
 #def get_crypto_price(crypto_id):
@@ -200,41 +585,12 @@ def get_crypto_id(name):
             return coin['id']
     return None
 
-def calculate_crypto_profit_loss(entry_id, crypto_id):
-    """Calculer le profit/perte pour une crypto-monnaie spécifique et un ID d'entrée donné"""
-    transactions = get_crypto_transactions(entry_id, crypto_id)
-    #crypto_id = get_crypto_id(crypto_id)
-    current_price = asyncio.run(get_crypto_price(crypto_id))
-    logging.info(f"Crypto avec ID: {crypto_id} current_price {current_price}")
-    investment = 0
-    quantity_held = 0
-    for transaction in transactions:
-        if transaction[5] == 'buy':
-            investment += transaction[4]
-            quantity_held += transaction[3]
-        elif transaction[5] == 'sell':
-            investment -= transaction[4]
-            quantity_held -= transaction[3]
-
-    current_value = quantity_held * current_price
-    profit_loss = current_value - investment
-    profit_loss_percent = (profit_loss / investment) * 100 if investment != 0 else 0
-
-    return {
-        "investment": investment,
-        "current_value": current_value,
-        "profit_loss": profit_loss,
-        "profit_loss_percent": profit_loss_percent
-    }
-
 def load_crypto_attributes(entry_id):
     """Charger les attributs des cryptos depuis la base de données pour un ID d'entrée donné"""
-    create_crypto_table(entry_id)
-    conn = sqlite3.connect(get_database_path(entry_id))
-    cursor = conn.cursor()
+    ensure_schema(entry_id)
+    cursor = get_connection(entry_id).cursor()
     cursor.execute('SELECT crypto_name, crypto_id FROM cryptos WHERE entry_id = ?', (entry_id,))
     cryptos = cursor.fetchall()
-    conn.close()
     return {crypto_id: {'crypto_name': crypto_name, 'crypto_id': crypto_id} for crypto_name, crypto_id in cryptos}
 
 
@@ -242,18 +598,19 @@ def load_crypto_attributes(entry_id):
 def delete_crypto_db(entry_id, crypto_id):
     """Supprimer une crypto-monnaie et ses transactions de la base de données pour un ID d'entrée donné"""
     try:
-        conn = sqlite3.connect(get_database_path(entry_id))
-        cursor = conn.cursor()
-        
-        # Supprimer les transactions associées à la crypto_id
-        cursor.execute('DELETE FROM transactions WHERE crypto_id = ?', (crypto_id,))
-        conn.commit()
-        
-        # Supprimer la crypto de la table cryptos
-        cursor.execute('DELETE FROM cryptos WHERE crypto_id = ?', (crypto_id,))
-        conn.commit()
-        
-        conn.close()
+        ensure_schema(entry_id)
+        conn = get_connection(entry_id)
+        with conn:
+            cursor = conn.cursor()
+
+            # Supprimer les transactions associées à la crypto_id
+            cursor.execute('DELETE FROM transactions WHERE crypto_id = ?', (crypto_id,))
+
+            # Supprimer la crypto de la table cryptos et ses agrégats
+            cursor.execute('DELETE FROM cryptos WHERE crypto_id = ?', (crypto_id,))
+            cursor.execute('DELETE FROM holdings WHERE crypto_id = ?', (crypto_id,))
+            _bump_ledger_epoch(cursor)
+
         logging.info(f"Crypto avec ID: {crypto_id} et ses transactions supprimées dans l'entrée {entry_id}")
         return True
     except Exception as e:
@@ -261,95 +618,80 @@ def delete_crypto_db(entry_id, crypto_id):
         return False
 
 
-def export_db(entry_id):
-    try:
-        db_path = get_database_path_export(entry_id)
-        return send_file(db_path, as_attachment=True, download_name=f'portfolio_crypto_{entry_id}.db')
-    except Exception as e:
-        logging.error(f"Erreur lors de l'exportation de la base de données pour l'ID d'entrée {entry_id}: {e}")
-        raise
+TRANSACTION_COLUMNS = ('crypto_name', 'crypto_id', 'quantity', 'price_usd', 'transaction_type', 'location', 'date', 'historical_price')
 
-def import_db(entry_id, db_path):
+def validate_import_file(db_path):
+    """Vérifier qu'un fichier envoyé est une base SQLite intègre contenant une table 'transactions' exploitable"""
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT * FROM transactions')
-        transactions = cursor.fetchall()
-        logging.info(f"Transactions lues depuis le fichier: {transactions}")
-
-        cursor.execute('SELECT crypto_name, crypto_id FROM cryptos')
-        cryptos = cursor.fetchall()
-        logging.info(f"Cryptos lues depuis le fichier: {cryptos}")
-
-        conn.close()
-
-        # Assurez-vous que chaque transaction a au moins 9 colonnes
-        formatted_transactions = []
-        for transaction in transactions:
-            if len(transaction) >= 9:
-                formatted_transactions.append(transaction)
-            else:
-                logging.error(f"Transaction avec nombre de colonnes incorrect: {transaction}")
-
-        import_transactions(entry_id, formatted_transactions)
-        missing_cryptos = verify_cryptos(entry_id, cryptos)
-
-        if missing_cryptos:
-            return missing_cryptos
-        else:
-            return False
-        
-    except Exception as e:
-        logging.error(f"Erreur lors de l'importation de la base de données: {e}")
-        raise
-
-def import_transactions(entry_id, transactions):
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    except sqlite3.Error as e:
+        raise ValueError(f"Fichier illisible: {e}")
     try:
-        db_path = get_database_path(entry_id)
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('DELETE FROM transactions')
-
-        for transaction in transactions:
-            logging.info(f"Transaction reçue: {transaction}")
-            # Assurez-vous de ne prendre que les 8 dernières colonnes
-            if len(transaction) >= 8:
-                cursor.execute('''
-                    INSERT INTO transactions (crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', transaction[-8:])
-            else:
-                logging.error(f"Nombre de paramètres incorrect pour la transaction: {transaction}")
-
-        conn.commit()
+        if conn.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+            raise ValueError("Base de données corrompue")
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(transactions)')}
+        missing = [column for column in TRANSACTION_COLUMNS if column not in columns]
+        if missing:
+            raise ValueError(f"Table 'transactions' absente ou incomplète (colonnes manquantes: {', '.join(missing)})")
+        has_cryptos = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='cryptos'").fetchone() is not None
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Fichier SQLite invalide: {e}")
+    finally:
         conn.close()
-        logging.info(f"Transactions importées avec succès pour l'ID d'entrée: {entry_id}")
-    except Exception as e:
-        logging.error(f"Erreur lors de l'importation des transactions: {e}")
-        raise
-
-    
-def verify_cryptos(entry_id, cryptos):
+    return has_cryptos
+
+def import_db(entry_id, db_path, mode='replace'):
+    """Importer les transactions d'une base envoyée, attachée à la base du portefeuille.
+
+    mode='replace' remplace toutes les transactions, mode='merge' ajoute celles qui
+    n'existent pas déjà. Tout se fait dans une seule transaction SQL : en cas d'erreur
+    la base du portefeuille reste inchangée. Retourne les cryptos (nom, id) présentes
+    dans le fichier mais pas enregistrées dans le portefeuille.
+    """
+    if mode not in ('replace', 'merge'):
+        raise ValueError(f"Mode d'import invalide: {mode}")
+    has_cryptos = validate_import_file(db_path)
+    ensure_schema(entry_id)
+    conn = get_connection(entry_id)
+    columns = ', '.join(TRANSACTION_COLUMNS)
+    conn.execute('ATTACH DATABASE ? AS upload', (db_path,))
     try:
-        db_path = get_database_path(entry_id)
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT crypto_name, crypto_id FROM cryptos')
-        existing_cryptos = cursor.fetchall()
-        existing_cryptos_dict = {crypto_id: crypto_name for crypto_name, crypto_id in existing_cryptos}
-        
-        missing_cryptos = []
-        for crypto_name, crypto_id in cryptos:
-            if crypto_id not in existing_cryptos_dict:
-                missing_cryptos.append((crypto_name, crypto_id))
-        
-        conn.close()
-        return missing_cryptos
-    except Exception as e:
-        logging.error(f"Erreur lors de la vérification des cryptos: {e}")
-        raise
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            if mode == 'replace':
+                cursor.execute('DELETE FROM transactions')
+                cursor.execute(f'INSERT INTO transactions ({columns}) SELECT {columns} FROM upload.transactions ORDER BY id')
+            else:
+                # Une transaction identique (crypto, date, type, quantité, montant) n'est pas importée deux fois
+                cursor.execute(f'''
+                    INSERT INTO transactions ({columns})
+                    SELECT {columns} FROM upload.transactions AS u
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM main.transactions AS t
+                        WHERE t.crypto_id = u.crypto_id AND t.date IS u.date AND t.transaction_type IS u.transaction_type
+                          AND t.quantity IS u.quantity AND t.price_usd IS u.price_usd
+                    )
+                    ORDER BY id
+                ''')
+            imported = cursor.rowcount
+            _rebuild_holdings(cursor)
+            _bump_ledger_epoch(cursor)
+
+            source = '''
+                SELECT crypto_name, crypto_id FROM upload.cryptos
+                UNION
+                SELECT MIN(crypto_name), crypto_id FROM upload.transactions GROUP BY crypto_id
+            ''' if has_cryptos else 'SELECT MIN(crypto_name), crypto_id FROM upload.transactions GROUP BY crypto_id'
+            cursor.execute(f'''
+                SELECT MIN(crypto_name), crypto_id FROM ({source})
+                WHERE crypto_id IS NOT NULL AND crypto_id NOT IN (SELECT crypto_id FROM main.cryptos WHERE entry_id = ?)
+                GROUP BY crypto_id
+            ''', (entry_id,))
+            missing_cryptos = cursor.fetchall()
+    finally:
+        conn.execute('DETACH DATABASE upload')
+    logging.info(f"Import ({mode}) pour l'entrée {entry_id}: {imported} transactions importées, {len(missing_cryptos)} cryptos non enregistrées")
+    return missing_cryptos
 
 
@@ -0,0 +1,173 @@
+"""
+Fichier db_export.py
+Ce fichier gère l'export d'un portefeuille : copie cohérente de la base avec l'API de
+sauvegarde SQLite (par paquets de pages, sans bloquer les écritures), puis envoi en
+flux au format SQLite, JSON ou CSV, éventuellement compressé (gzip ou zstd).
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import zlib
+from .db import get_database_path, ensure_schema, connect_database, TRANSACTION_COLUMNS
+
+try:
+    import zstandard
+except ImportError:  # Dépendance optionnelle : seule la compression gzip est alors disponible
+    zstandard = None
+
+EXPORT_BACKUP_PAGES = 256  # Pages copiées par étape de sauvegarde
+EXPORT_BACKUP_SLEEP = 0.005  # Pause entre deux étapes pour laisser passer les écritures (secondes)
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_ROWS_PER_CHUNK = 1000
+
+EXPORT_FORMATS = {
+    'sqlite': ('application/vnd.sqlite3', 'db'),
+    'json': ('application/json', 'json'),
+    'csv': ('text/csv', 'csv'),
+}
+EXPORT_COMPRESSIONS = {
+    'none': (None, ''),
+    'gzip': ('application/gzip', '.gz'),
+    'zstd': ('application/zstd', '.zst'),
+}
+
+
+def snapshot_database(entry_id):
+    """Copier la base du portefeuille dans un fichier temporaire avec l'API de sauvegarde SQLite.
+
+    La copie se fait par paquets de pages : les écritures concurrentes ne sont pas
+    bloquées et la copie obtenue correspond à un état validé de la base.
+    """
+    ensure_schema(entry_id)
+    db_path = get_database_path(entry_id)
+    fd, snapshot_path = tempfile.mkstemp(suffix='.export.db', dir=os.path.dirname(db_path))
+    os.close(fd)
+    source = connect_database(db_path)
+    target = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(target, pages=EXPORT_BACKUP_PAGES, sleep=EXPORT_BACKUP_SLEEP)
+        # Fichier autonome : pas de journal WAL à côté de la copie
+        target.execute('PRAGMA journal_mode=DELETE')
+    except Exception:
+        target.close()
+        os.remove(snapshot_path)
+        raise
+    finally:
+        source.close()
+    target.close()
+    return snapshot_path
+
+
+def _sqlite_chunks(snapshot_path):
+    with open(snapshot_path, 'rb') as snapshot:
+        while True:
+            chunk = snapshot.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _query_rows(snapshot_path, query):
+    conn = sqlite3.connect(snapshot_path)
+    try:
+        cursor = conn.execute(query)
+        while True:
+            rows = cursor.fetchmany(EXPORT_ROWS_PER_CHUNK)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def _json_chunks(snapshot_path, entry_id):
+    yield json.dumps({"entry_id": entry_id})[:-1].encode() + b', "cryptos": '
+    cryptos = [
+        {"crypto_name": name, "crypto_id": crypto_id}
+        for rows in _query_rows(snapshot_path, 'SELECT crypto_name, crypto_id FROM cryptos ORDER BY id')
+        for name, crypto_id in rows
+    ]
+    yield json.dumps(cryptos).encode() + b', "transactions": ['
+    first = True
+    for rows in _query_rows(snapshot_path, f'SELECT id, {", ".join(TRANSACTION_COLUMNS)} FROM transactions ORDER BY id'):
+        parts = [json.dumps(dict(zip(('id',) + TRANSACTION_COLUMNS, row))) for row in rows]
+        yield (('' if first else ', ') + ', '.join(parts)).encode()
+        first = False
+    yield b']}'
+
+
+def _csv_chunks(snapshot_path):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('id',) + TRANSACTION_COLUMNS)
+    for rows in _query_rows(snapshot_path, f'SELECT id, {", ".join(TRANSACTION_COLUMNS)} FROM transactions ORDER BY id'):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _compress(chunks, compression):
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 : en-tête gzip
+        finish = compressor.flush
+    elif compression == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+        finish = compressor.flush
+    else:
+        yield from chunks
+        return
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def export_stream(entry_id, fmt='sqlite', compression='none'):
+    """Préparer l'export d'un portefeuille.
+
+    Retourne (générateur de morceaux, type MIME, nom de fichier, nettoyage). La copie
+    est prise immédiatement ; le fichier temporaire est supprimé à la fin de l'envoi.
+    Un générateur fermé sans avoir démarré (requête HEAD, client déconnecté) n'exécute
+    pas son bloc finally : l'appelant doit aussi appeler nettoyage() à la fermeture
+    de la réponse.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export invalide: {fmt}")
+    if compression not in EXPORT_COMPRESSIONS:
+        raise ValueError(f"Compression invalide: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("Compression zstd indisponible (module zstandard non installé)")
+
+    snapshot_path = snapshot_database(entry_id)
+
+    def cleanup():
+        try:
+            os.remove(snapshot_path)
+        except FileNotFoundError:
+            pass
+
+    def generate():
+        try:
+            if fmt == 'sqlite':
+                chunks = _sqlite_chunks(snapshot_path)
+            elif fmt == 'json':
+                chunks = _json_chunks(snapshot_path, entry_id)
+            else:
+                chunks = _csv_chunks(snapshot_path)
+            yield from _compress(chunks, compression)
+        finally:
+            cleanup()
+            logging.info(f"Export ({fmt}, {compression}) terminé pour l'entrée {entry_id}")
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    compressed_mimetype, suffix = EXPORT_COMPRESSIONS[compression]
+    return generate(), compressed_mimetype or mimetype, f'portfolio_crypto_{entry_id}.{extension}{suffix}', cleanup
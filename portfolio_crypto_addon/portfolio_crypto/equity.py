@@ -0,0 +1,135 @@
+"""
+Fichier equity.py
+Ce fichier calcule l'évolution de la valeur d'un portefeuille (courbe de valeur) à la
+résolution horaire ou journalière. Les quantités détenues à chaque instant sont
+obtenues par sommes cumulées sur les transactions, les prix par une jointure « au
+plus récent » (np.searchsorted) sur les bougies de l'historique local. Les courbes
+sont mises en cache par (entry_id, résolution) et seulement prolongées quand de
+nouveaux prix arrivent.
+"""
+
+import threading
+import time
+import numpy as np
+from .const import PRICE_HISTORY_RESOLUTIONS, PRICE_HISTORY_RETENTION_DAYS
+from .household import get_portfolio_columns
+from .price_history import get_close_prices, get_history_generation
+
+
+class EquityCurve:
+    """Courbe de valeur d'un portefeuille, calculée à partir d'un jeu de colonnes de transactions"""
+
+    def __init__(self, columns, step, generation=0):
+        self.columns = columns
+        self.step = step
+        self.generation = generation  # Génération de l'historique journalier utilisée pour le calcul
+        self.buckets = np.empty(0, dtype=np.int64)
+        self.value = np.empty(0, dtype=np.float64)
+        self.invested = np.empty(0, dtype=np.float64)
+        # Prix connu de chaque crypto avant la dernière bougie calculée (report pour le prolongement)
+        self.carry = {}
+        self.lock = threading.Lock()
+
+    def _holdings_at(self, grid_end):
+        """Quantité et coût net cumulés de chaque crypto à la fin de chaque bougie : (cryptos, points)"""
+        columns = self.columns
+        ts = columns.timestamps.astype('int64')
+        # Une date illisible (NaT) est comptée dès le début
+        ts = np.where(np.isnat(columns.timestamps), np.iinfo(np.int64).min, ts)
+        quantity = np.zeros((len(columns.coins), len(grid_end)))
+        invested = np.zeros(len(grid_end))
+        order = np.argsort(ts, kind='stable')
+        sorted_ts = ts[order]
+        positions = np.searchsorted(sorted_ts, grid_end, side='left')  # transactions strictement avant la fin
+        cumulative_cost = np.concatenate(([0.0], np.cumsum(columns.cost[order])))
+        invested += cumulative_cost[positions]
+        for code in range(len(columns.coins)):
+            coin_mask = columns.coin_codes[order] == code
+            coin_ts = sorted_ts[coin_mask]
+            cumulative = np.concatenate(([0.0], np.cumsum(columns.quantity[order][coin_mask])))
+            quantity[code] = cumulative[np.searchsorted(coin_ts, grid_end, side='left')]
+        return quantity, invested
+
+    def _prices_at(self, grid, series):
+        """Prix au plus récent de chaque crypto pour chaque bougie de la grille : (cryptos, points)
+
+        NaN avant la première bougie connue d'une crypto : son prix y est inconnu, pas nul.
+        """
+        prices = np.full((len(self.columns.coins), len(grid)), np.nan)
+        for code, crypto_id in enumerate(self.columns.coins):
+            rows = series.get(crypto_id) or []
+            carry = self.carry.get(crypto_id)
+            buckets = np.array([bucket for bucket, _ in rows], dtype=np.int64)
+            closes = np.array([close for _, close in rows], dtype=np.float64)
+            if carry is not None:
+                buckets = np.concatenate(([np.iinfo(np.int64).min], buckets))
+                closes = np.concatenate(([carry], closes))
+            if not len(buckets):
+                continue
+            index = np.searchsorted(buckets, grid, side='right') - 1
+            prices[code] = np.where(index >= 0, closes[np.maximum(index, 0)], np.nan)
+        return prices
+
+    def extend(self, resolution, now):
+        """Calculer les bougies manquantes, en recalculant la dernière (encore en formation)"""
+        step = self.step
+        now_bucket = now - now % step
+        if len(self.buckets):
+            start = series_start = int(self.buckets[-1])
+            keep = len(self.buckets) - 1
+        else:
+            timestamps = self.columns.timestamps[~np.isnat(self.columns.timestamps)]
+            if not len(timestamps):
+                return
+            first = int(timestamps.min().astype('int64'))
+            oldest = now - PRICE_HISTORY_RETENTION_DAYS[resolution] * 86400
+            start = max(first - first % step, oldest - oldest % step)
+            series_start = 0  # Premier calcul : les prix antérieurs servent au report
+            keep = 0
+        grid = np.arange(start, now_bucket + step, step, dtype=np.int64)
+        series = get_close_prices(self.columns.coins, resolution, series_start, now_bucket)
+        quantity, invested = self._holdings_at(grid + step)
+        prices = self._prices_at(grid, series)
+        # Une crypto détenue sans prix connu rend la valeur de la bougie inconnue (NaN, émise à null)
+        value = np.where(quantity != 0, quantity * prices, 0.0).sum(axis=0)
+
+        if len(grid) > 1:
+            # Report des prix connus avant la nouvelle dernière bougie
+            for code, crypto_id in enumerate(self.columns.coins):
+                if not np.isnan(prices[code, -2]):
+                    self.carry[crypto_id] = prices[code, -2]
+        self.buckets = np.concatenate((self.buckets[:keep], grid))
+        self.value = np.concatenate((self.value[:keep], value))
+        self.invested = np.concatenate((self.invested[:keep], invested))
+
+    def points(self, start=None, end=None):
+        mask = np.ones(len(self.buckets), dtype=bool)
+        if start is not None:
+            mask &= self.buckets >= int(start)
+        if end is not None:
+            mask &= self.buckets <= int(end)
+        return [
+            {"ts": int(ts), "value": None if np.isnan(value) else float(value), "invested": float(invested)}
+            for ts, value, invested in zip(self.buckets[mask], self.value[mask], self.invested[mask])
+        ]
+
+
+_curves = {}
+_curves_lock = threading.Lock()
+
+def get_equity_curve(entry_id, resolution='1d', start=None, end=None):
+    """Valeur du portefeuille par bougie : [{ts, value, invested}] (value null si un prix manque), depuis le cache prolongé si le registre n'a pas changé"""
+    if resolution not in PRICE_HISTORY_RESOLUTIONS:
+        raise ValueError(f"Résolution inconnue: {resolution}")
+    columns = get_portfolio_columns(entry_id)
+    generation = get_history_generation() if resolution == '1d' else 0
+    key = (entry_id, resolution)
+    with _curves_lock:
+        curve = _curves.get(key)
+        # Les colonnes sont recréées à chaque écriture sur la base, et un rattrapage de
+        # l'historique complète les jours passés : la courbe est alors recalculée
+        if curve is None or curve.columns is not columns or curve.generation != generation:
+            curve = _curves[key] = EquityCurve(columns, PRICE_HISTORY_RESOLUTIONS[resolution], generation)
+    with curve.lock:
+        curve.extend(resolution, int(time.time()))
+        return curve.points(start, end)
@@ -0,0 +1,197 @@
+"""
+Fichier fetch_engine.py
+Ce fichier contient le moteur de requêtes CoinGecko utilisé par le démon de prix :
+une session aiohttp unique, un limiteur à jetons calé sur l'offre CoinGecko,
+le respect de l'en-tête Retry-After et un backoff exponentiel avec gigue.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from .const import COINGECKO_API_TIERS, COINGECKO_API_TIER, COINGECKO_PRO_API_URL
+
+_LOGGER = logging.getLogger(__name__)
+
+COINGECKO_PUBLIC_API_URL = "https://api.coingecko.com/api/v3"
+
+FetchResult = namedtuple("FetchResult", ["status", "headers", "data"])
+
+
+class TokenBucket:
+    """Limiteur à jetons : `rate` requêtes par `period` secondes avec une rafale de `burst`"""
+
+    def __init__(self, rate, period, burst=1):
+        self.fill_rate = rate / period
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.fill_rate)
+        self.updated_at = now
+
+    def pause(self, seconds):
+        """Suspendre les envois (Retry-After) et vider le seau"""
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.updated_at = max(self.updated_at, self.blocked_until)
+
+    async def acquire(self):
+        """Attendre qu'un jeton soit disponible puis le consommer"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.fill_rate)
+
+
+class FetchStats:
+    """Compteurs du moteur de requêtes"""
+
+    def __init__(self):
+        self.sent = 0
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+
+    def as_dict(self):
+        return {
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+def parse_retry_after(value):
+    """Convertir un en-tête Retry-After (secondes ou date HTTP) en secondes"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CoinGeckoFetchEngine:
+    """Moteur de requêtes CoinGecko partageant une session et un budget de requêtes"""
+
+    def __init__(self, tier=None, api_key=None, max_retries=5, base_backoff=1.0, max_backoff=60.0, timeout=30):
+        self.tier = tier or os.getenv("COINGECKO_API_TIER", COINGECKO_API_TIER)
+        if self.tier not in COINGECKO_API_TIERS:
+            _LOGGER.warning(f"Offre CoinGecko inconnue '{self.tier}', utilisation de l'offre free")
+            self.tier = "free"
+        self.api_key = api_key if api_key is not None else os.getenv("COINGECKO_API_KEY")
+        budget = COINGECKO_API_TIERS[self.tier]
+        self.bucket = TokenBucket(budget["rate"], budget["period"], budget["burst"])
+        self.concurrency = budget["concurrency"]
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.stats = FetchStats()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self._auth_headers(),
+            )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _auth_headers(self):
+        if not self.api_key:
+            return {}
+        if self.tier == "free":
+            return {"x-cg-demo-api-key": self.api_key}
+        return {"x-cg-pro-api-key": self.api_key}
+
+    def _resolve_url(self, url):
+        # Les offres payantes utilisent un autre domaine que l'API publique
+        if self.tier != "free" and self.api_key and url.startswith(COINGECKO_PUBLIC_API_URL):
+            return COINGECKO_PRO_API_URL + url[len(COINGECKO_PUBLIC_API_URL):]
+        return url
+
+    def _backoff(self, attempt):
+        # Backoff exponentiel avec gigue complète
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    async def fetch(self, url, params=None, headers=None, title=""):
+        """Exécuter une requête GET dans le budget ; retourne un FetchResult ou None après échec"""
+        await self.start()
+        url = self._resolve_url(url)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats.retried += 1
+            await self.bucket.acquire()
+            backoff = None  # Pause avant la tentative suivante, prise hors du sémaphore et de la connexion
+            try:
+                async with self._semaphore:
+                    self.stats.sent += 1
+                    async with self._session.get(url, params=params, headers=headers) as response:
+                        if response.status == 429:
+                            self.stats.throttled += 1
+                            wait_time = parse_retry_after(response.headers.get("Retry-After"))
+                            if wait_time is None:
+                                wait_time = self._backoff(attempt) + 60 / COINGECKO_API_TIERS[self.tier]["rate"]
+                            _LOGGER.warning(f"Limitation Api Coingecko pour {title}, pause de {wait_time:.1f} secondes")
+                            self.bucket.pause(wait_time)
+                            continue
+                        if response.status >= 500:
+                            _LOGGER.warning(f"Erreur serveur CoinGecko pour {title}: {response.status}")
+                            backoff = self._backoff(attempt)
+                        else:
+                            data = await response.json(content_type=None) if response.status == 200 else None
+                            if response.status not in (200, 304):
+                                _LOGGER.error(f"Échec pour la requete CoinGecko : {title}, code de statut: {response.status}")
+                            return FetchResult(response.status, dict(response.headers), data)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                _LOGGER.warning(f"Erreur réseau lors de l'appel CoinGecko pour {title}: {e}")
+                backoff = self._backoff(attempt)
+            if backoff is not None:
+                await asyncio.sleep(backoff)
+        self.stats.failed += 1
+        _LOGGER.error(f"Abandon de la requete CoinGecko {title} après {self.max_retries + 1} tentatives")
+        return None
+
+    async def get_json(self, url, params=None, title=""):
+        """Retourner le JSON d'une réponse 200, sinon None"""
+        result = await self.fetch(url, params=params, title=title)
+        if result is not None and result.status == 200:
+            return result.data
+        return None
@@ -0,0 +1,200 @@
+"""
+Fichier household.py
+Ce fichier gère la vue consolidée de tous les portefeuilles (foyer) : découverte des
+bases portfolio_crypto_*.db, positions de chacune (état des lots, lots.py) et fusion
+par crypto et par portefeuille. Le résultat de chaque base est mis en cache et n'est relu que
+lorsque son compteur d'écritures (meta.write_version) a changé ; ce compteur est
+stocké dans la base, le cache est donc partagé par tous les threads du processus.
+"""
+
+import glob
+import logging
+import os
+import sqlite3
+import threading
+from .const import PATH_DB_BASE
+from .db import ensure_schema, connect_database, get_database_path, TRANSACTION_COLUMNS
+from .lots import get_positions, replay_positions, value_position, total_fields
+from .pnl_vector import build_transaction_columns, merge_transaction_columns, parse_as_of
+
+PORTFOLIO_DB_PREFIX = 'portfolio_crypto_'
+
+# Connexions de lecture par thread (les lectures des threads ne se bloquent pas)
+_local = threading.local()
+_cache = {}
+_columns_cache = {}
+_cache_lock = threading.Lock()
+
+
+def discover_portfolios():
+    """Lister les portefeuilles présents : {entry_id: chemin de la base}"""
+    portfolios = {}
+    for path in glob.glob(os.path.join(PATH_DB_BASE, f'{PORTFOLIO_DB_PREFIX}*.db')):
+        entry_id = os.path.basename(path)[len(PORTFOLIO_DB_PREFIX):-len('.db')]
+        if entry_id:
+            portfolios[entry_id] = path
+    return portfolios
+
+
+def _reader(db_path):
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+    conn = _local.connections.get(db_path)
+    if conn is None:
+        conn = connect_database(db_path)
+        _local.connections[db_path] = conn
+    return conn
+
+
+def _write_version(conn):
+    """Compteur d'écritures de la base (déclencheurs de la migration 5), identique pour toutes les connexions"""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'write_version'").fetchone()
+    return row[0] if row else 0
+
+
+def _portfolio_holdings(entry_id, db_path):
+    """Positions d'un portefeuille (lots.position_fields), depuis le cache si la base n'a pas changé"""
+    conn = _reader(db_path)
+    # Version lue avant les données : une écriture concurrente rend au pire l'entrée périmée au prochain appel
+    key = _write_version(conn)
+    with _cache_lock:
+        cached = _cache.get(db_path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    holdings = get_positions(entry_id)
+    with _cache_lock:
+        _cache[db_path] = (key, holdings)
+    return holdings
+
+
+def _portfolio_columns(entry_id, db_path):
+    """Transactions d'un portefeuille en colonnes NumPy, reconstruites seulement si la base a changé"""
+    conn = _reader(db_path)
+    key = _write_version(conn)
+    with _cache_lock:
+        cached = _columns_cache.get(db_path)
+    if cached and cached[0] == key:
+        return cached[1]
+    rows = conn.execute('SELECT crypto_id, quantity, price_usd, transaction_type, date FROM transactions').fetchall()
+    columns = build_transaction_columns({entry_id: rows})
+    with _cache_lock:
+        _columns_cache[db_path] = (key, columns)
+    return columns
+
+
+def get_portfolio_columns(entry_id):
+    """Colonnes d'un seul portefeuille ; le même objet est retourné tant que la base n'a pas changé"""
+    db_path = get_database_path(entry_id)
+    if not os.path.exists(db_path):
+        raise ValueError(f"Portefeuille inconnu: {entry_id}")
+    ensure_schema(entry_id)
+    return _portfolio_columns(entry_id, db_path)
+
+
+def get_transaction_columns(entry_ids=None):
+    """Colonnes des transactions des portefeuilles demandés (tous par défaut), fusionnées pour un calcul en une passe"""
+    portfolios = discover_portfolios()
+    parts = []
+    for entry_id in (entry_ids or sorted(portfolios)):
+        if entry_id not in portfolios:
+            raise ValueError(f"Portefeuille inconnu: {entry_id}")
+        ensure_schema(entry_id)
+        parts.append(_portfolio_columns(entry_id, portfolios[entry_id]))
+    return merge_transaction_columns(parts)
+
+
+def get_portfolio_positions(entry_ids, as_of=None):
+    """Positions (état des lots) des portefeuilles donnés, à la date as_of si elle est fournie : {entry_id: {crypto_id: {...}}}"""
+    if as_of is not None:
+        as_of = str(parse_as_of(as_of))
+        return {entry_id: replay_positions(entry_id, as_of) for entry_id in entry_ids}
+    return {entry_id: get_positions(entry_id) for entry_id in entry_ids}
+
+
+def get_household_holdings():
+    """Positions de chaque portefeuille : {entry_id: {crypto_id: {...}}}"""
+    portfolios = discover_portfolios()
+    result = {}
+    for entry_id, db_path in portfolios.items():
+        try:
+            ensure_schema(entry_id)
+            result[entry_id] = _portfolio_holdings(entry_id, db_path)
+        except sqlite3.Error as e:
+            logging.error(f"Portefeuille {entry_id} ignoré dans la vue consolidée: {e}")
+    with _cache_lock:
+        # Oublier les bases supprimées
+        known = set(portfolios.values())
+        for path in [path for path in _cache if path not in known]:
+            del _cache[path]
+        for path in [path for path in _columns_cache if path not in known]:
+            del _columns_cache[path]
+    return result
+
+
+def household_crypto_ids(household):
+    """Toutes les cryptos détenues dans au moins un portefeuille"""
+    return sorted({crypto_id for holdings in household.values() for crypto_id in holdings})
+
+
+def calculate_household_summary(household, prices):
+    """Fusionner les positions de get_household_holdings() par crypto et par portefeuille, aux prix {crypto_id: prix}"""
+    portfolios = {}
+    engaged = {}
+    cryptos = {}
+    for entry_id, holdings in household.items():
+        valued = {crypto_id: value_position(coin, prices.get(crypto_id) or 0) for crypto_id, coin in holdings.items()}
+        for crypto_id, coin in holdings.items():
+            merged = cryptos.setdefault(crypto_id, {
+                "total_tokens": 0, "investment": 0, "realized_profit_loss": 0, "engaged": 0, "current_value": 0,
+                "transactions_count": 0, "current_price": prices.get(crypto_id) or 0, "portfolios": {},
+            })
+            merged["total_tokens"] += coin["quantity"]
+            merged["investment"] += coin["invested"]
+            merged["realized_profit_loss"] += coin["realized"]
+            merged["engaged"] += coin["engaged"]
+            merged["current_value"] += valued[crypto_id]["current_value"]
+            merged["transactions_count"] += coin["tx_count"]
+            merged["portfolios"][entry_id] = coin["quantity"]
+        portfolios[entry_id] = {
+            "transactions": sum(coin["tx_count"] for coin in holdings.values()),
+            **total_fields(
+                sum(coin["invested"] for coin in holdings.values()),
+                sum(result["current_value"] for result in valued.values()),
+                sum(coin["realized"] for coin in holdings.values()),
+                sum(coin["engaged"] for coin in holdings.values()),
+            ),
+        }
+        engaged[entry_id] = sum(coin["engaged"] for coin in holdings.values())
+
+    for merged in cryptos.values():
+        coin_engaged = merged.pop("engaged")
+        merged["profit_loss"] = merged["realized_profit_loss"] + merged["current_value"] - merged["investment"]
+        merged["profit_loss_percent"] = (merged["profit_loss"] / coin_engaged) * 100 if coin_engaged != 0 else 0
+
+    summary = {
+        "portfolios": len(portfolios),
+        "transactions": sum(p["transactions"] for p in portfolios.values()),
+        **total_fields(
+            sum(p["total_investment"] for p in portfolios.values()),
+            sum(p["total_value"] for p in portfolios.values()),
+            sum(p["total_realized_profit_loss"] for p in portfolios.values()),
+            sum(engaged.values()),
+        ),
+    }
+    return {"summary": summary, "portfolios": portfolios, "cryptos": cryptos}
+
+
+def get_all_transactions():
+    """Récupérer les transactions de tous les portefeuilles, préfixées par l'ID d'entrée"""
+    columns = ', '.join(('id',) + TRANSACTION_COLUMNS)
+    all_transactions = []
+    for entry_id, db_path in sorted(discover_portfolios().items()):
+        try:
+            ensure_schema(entry_id)
+            rows = _reader(db_path).execute(f'SELECT {columns} FROM transactions ORDER BY date, id')
+            all_transactions.extend((entry_id, *row) for row in rows)
+        except sqlite3.Error as e:
+            logging.error(f"Portefeuille {entry_id} ignoré dans la liste des transactions: {e}")
+    return all_transactions
@@ -0,0 +1,286 @@
+"""
+Fichier lots.py
+Ce fichier gère le calcul du prix de revient par lots : chaque achat ouvre un lot,
+chaque vente consomme des lots selon la méthode choisie (FIFO, LIFO, HIFO ou coût
+moyen pondéré) et enregistre la plus-value réalisée. L'état des lots est conservé en
+mémoire et mis à jour de façon incrémentale avec les nouvelles transactions ; il
+n'est recalculé depuis le début que si l'historique a été réécrit (ledger_epoch).
+"""
+
+import heapq
+import logging
+import threading
+from .const import DEFAULT_COST_BASIS_METHOD
+from .db import ensure_schema, get_connection, get_database_path, get_ledger_epoch
+
+COST_BASIS_METHODS = ('fifo', 'lifo', 'hifo', 'average')
+LOT_FETCH_SIZE = 5000
+EPSILON = 1e-12
+
+
+class LotBook:
+    """Lots ouverts d'une crypto, ordonnés par un tas selon la méthode : chaque opération est en O(log lots)"""
+
+    def __init__(self, method):
+        self.method = method
+        self.heap = []
+        self.quantity = 0.0
+        self.cost = 0.0
+        self.realized = 0.0
+        self.proceeds = 0.0
+        self.unmatched = 0.0
+        self.tx_count = 0
+
+    def _key(self, seq, unit_cost):
+        if self.method == 'fifo':
+            return (seq,)
+        if self.method == 'lifo':
+            return (-seq,)
+        return (-unit_cost, seq)  # hifo : le lot le plus cher est vendu en premier
+
+    def buy(self, seq, quantity, cost, date):
+        self.quantity += quantity
+        self.cost += cost
+        if self.method != 'average':
+            unit_cost = cost / quantity if quantity else 0
+            # Lot mutable [clé, quantité restante, coût unitaire, date]
+            heapq.heappush(self.heap, [self._key(seq, unit_cost), quantity, unit_cost, date])
+
+    def sell(self, quantity, proceeds):
+        """Consommer les lots pour une vente et retourner la plus-value réalisée"""
+        matched_cost = 0.0
+        remaining = quantity
+        if self.method == 'average':
+            matched = min(remaining, self.quantity)
+            if self.quantity > EPSILON:
+                matched_cost = self.cost * matched / self.quantity
+            remaining -= matched
+        else:
+            while remaining > EPSILON and self.heap:
+                lot = self.heap[0]
+                taken = min(remaining, lot[1])
+                matched_cost += taken * lot[2]
+                lot[1] -= taken
+                remaining -= taken
+                if lot[1] <= EPSILON:
+                    heapq.heappop(self.heap)
+        if remaining > EPSILON:
+            # Vente au-delà des quantités achetées : prix de revient nul pour l'excédent
+            self.unmatched += remaining
+        self.quantity = max(0.0, self.quantity - (quantity - max(remaining, 0)))
+        self.cost = max(0.0, self.cost - matched_cost)
+        if self.quantity <= EPSILON:
+            self.quantity = 0.0
+            self.cost = 0.0
+        realized = proceeds - matched_cost
+        self.realized += realized
+        self.proceeds += proceeds
+        return realized
+
+    def open_lots(self):
+        if self.method == 'average':
+            return [{"quantity": self.quantity, "unit_cost": self.cost / self.quantity if self.quantity else 0, "date": None}]
+        return [
+            {"quantity": quantity, "unit_cost": unit_cost, "date": date}
+            for _, quantity, unit_cost, date in sorted(self.heap)
+        ]
+
+
+class LedgerState:
+    """État des lots d'un portefeuille, à jour jusqu'à la transaction (date, id) 'cursor'"""
+
+    def __init__(self, method, epoch):
+        self.method = method
+        self.epoch = epoch
+        self.cursor = None
+        self.books = {}
+        self.realized_by_month = {}
+        self.sequence = 0  # Rang chronologique des achats, clé des méthodes FIFO et LIFO
+        self.lock = threading.Lock()
+
+    def apply(self, rows):
+        for tx_id, crypto_id, quantity, price_usd, transaction_type, date in rows:
+            book = self.books.get(crypto_id)
+            if book is None:
+                book = self.books[crypto_id] = LotBook(self.method)
+            quantity = quantity or 0
+            price_usd = price_usd or 0
+            book.tx_count += 1
+            if transaction_type == 'buy':
+                self.sequence += 1
+                book.buy(self.sequence, quantity, price_usd, date)
+            elif transaction_type == 'sell':
+                realized = book.sell(quantity, price_usd)
+                month = str(date or '')[:7]
+                by_coin = self.realized_by_month.setdefault(month, {})
+                by_coin[crypto_id] = by_coin.get(crypto_id, 0) + realized
+            self.cursor = (date, tx_id)
+
+    def catch_up(self, conn):
+        """Appliquer les transactions postérieures au curseur, par paquets (index (date, id))"""
+        while True:
+            if self.cursor is None:
+                rows = conn.execute('''
+                    SELECT id, crypto_id, quantity, price_usd, transaction_type, date FROM transactions
+                    ORDER BY date, id LIMIT ?
+                ''', (LOT_FETCH_SIZE,)).fetchall()
+            elif self.cursor[0] is None:
+                # Les transactions sans date sont triées en premier
+                rows = conn.execute('''
+                    SELECT id, crypto_id, quantity, price_usd, transaction_type, date FROM transactions
+                    WHERE (date IS NULL AND id > ?) OR date IS NOT NULL
+                    ORDER BY date, id LIMIT ?
+                ''', (self.cursor[1], LOT_FETCH_SIZE)).fetchall()
+            else:
+                rows = conn.execute('''
+                    SELECT id, crypto_id, quantity, price_usd, transaction_type, date FROM transactions
+                    WHERE (date, id) > (?, ?)
+                    ORDER BY date, id LIMIT ?
+                ''', (*self.cursor, LOT_FETCH_SIZE)).fetchall()
+            if not rows:
+                return
+            self.apply(rows)
+
+
+_states = {}
+_states_lock = threading.Lock()
+
+def get_ledger_state(entry_id, method=DEFAULT_COST_BASIS_METHOD):
+    """Retourner l'état des lots d'un portefeuille, mis à jour avec les nouvelles transactions"""
+    if method not in COST_BASIS_METHODS:
+        raise ValueError(f"Méthode de calcul invalide: {method}")
+    ensure_schema(entry_id)
+    key = (get_database_path(entry_id), method)
+    epoch = get_ledger_epoch(entry_id)
+    with _states_lock:
+        state = _states.get(key)
+        if state is None or state.epoch != epoch:
+            if state is not None:
+                logging.info(f"Historique modifié pour l'entrée {entry_id}: recalcul des lots ({method})")
+            state = _states[key] = LedgerState(method, epoch)
+    with state.lock:
+        state.catch_up(get_connection(entry_id))
+    return state
+
+
+def position_fields(book):
+    """Agrégats d'une crypto pour les vues de profit/perte : l'investissement est le prix de revient des lots détenus"""
+    return {
+        "quantity": book.quantity,
+        "invested": book.cost,
+        "realized": book.realized,
+        # Capital engagé (lots détenus + prix de revient des lots vendus), base des pourcentages
+        "engaged": book.cost + book.proceeds - book.realized,
+        "tx_count": book.tx_count,
+    }
+
+
+def value_position(position, current_price):
+    """Valoriser une position de position_fields : profit/perte = réalisé + latent"""
+    current_value = position["quantity"] * current_price
+    unrealized = current_value - position["invested"]
+    profit_loss = position["realized"] + unrealized
+    return {
+        "investment": position["invested"],
+        "current_value": current_value,
+        "profit_loss": profit_loss,
+        "profit_loss_percent": (profit_loss / position["engaged"]) * 100 if position["engaged"] != 0 else 0,
+        "realized_profit_loss": position["realized"],
+        "unrealized_profit_loss": unrealized,
+    }
+
+
+def total_fields(invested, value, realized, engaged):
+    """Totaux d'un ensemble de positions, avec les clés total_* des résumés"""
+    profit_loss = realized + value - invested
+    return {
+        "total_investment": invested,
+        "total_value": value,
+        "total_profit_loss": profit_loss,
+        "total_profit_loss_percent": (profit_loss / engaged) * 100 if engaged != 0 else 0,
+        "total_realized_profit_loss": realized,
+    }
+
+
+def get_positions(entry_id, method=DEFAULT_COST_BASIS_METHOD):
+    """Positions d'un portefeuille depuis l'état des lots : {crypto_id: position_fields}"""
+    state = get_ledger_state(entry_id, method)
+    with state.lock:
+        return {crypto_id: position_fields(book) for crypto_id, book in state.books.items()}
+
+
+def replay_positions(entry_id, as_of, method=DEFAULT_COST_BASIS_METHOD):
+    """Positions d'un portefeuille à une date : les lots sont rejoués jusqu'à as_of ('YYYY-MM-DDTHH:MM:SS').
+
+    Les transactions sans date sont exclues, comme dans le calcul vectorisé.
+    """
+    if method not in COST_BASIS_METHODS:
+        raise ValueError(f"Méthode de calcul invalide: {method}")
+    ensure_schema(entry_id)
+    state = LedgerState(method, None)
+    rows = get_connection(entry_id).execute('''
+        SELECT id, crypto_id, quantity, price_usd, transaction_type, date FROM transactions
+        WHERE date IS NOT NULL AND replace(date, ' ', 'T') <= ?
+        ORDER BY date, id
+    ''', (as_of,))
+    while True:
+        batch = rows.fetchmany(LOT_FETCH_SIZE)
+        if not batch:
+            break
+        state.apply(batch)
+    return {crypto_id: position_fields(book) for crypto_id, book in state.books.items()}
+
+
+def _period_key(month, period):
+    return month[:4] if period == 'year' else month
+
+
+def calculate_lots_report(entry_id, prices, method=DEFAULT_COST_BASIS_METHOD, period='year', include_lots=False):
+    """Plus-values réalisées et latentes par crypto, pour le portefeuille et par période (year|month)"""
+    if period not in ('year', 'month'):
+        raise ValueError(f"Période invalide: {period}")
+    state = get_ledger_state(entry_id, method)
+    with state.lock:
+        cryptos = {}
+        for crypto_id, book in state.books.items():
+            current_price = prices.get(crypto_id) or 0
+            current_value = book.quantity * current_price
+            unrealized = current_value - book.cost
+            cryptos[crypto_id] = {
+                "total_tokens": book.quantity,
+                "cost_basis": book.cost,
+                "average_cost": book.cost / book.quantity if book.quantity else 0,
+                "current_price": current_price,
+                "current_value": current_value,
+                "realized_profit_loss": book.realized,
+                "unrealized_profit_loss": unrealized,
+                "proceeds": book.proceeds,
+                "unmatched_quantity": book.unmatched,
+                "open_lots": book.open_lots() if include_lots else (len(book.heap) if method != 'average' else int(book.quantity > 0)),
+            }
+        periods = {}
+        for month, by_coin in state.realized_by_month.items():
+            entry = periods.setdefault(_period_key(month, period), {"realized_profit_loss": 0, "cryptos": {}})
+            for crypto_id, realized in by_coin.items():
+                entry["realized_profit_loss"] += realized
+                entry["cryptos"][crypto_id] = entry["cryptos"].get(crypto_id, 0) + realized
+
+    realized = sum(c["realized_profit_loss"] for c in cryptos.values())
+    unrealized = sum(c["unrealized_profit_loss"] for c in cryptos.values())
+    summary = {
+        "method": method,
+        "cost_basis": sum(c["cost_basis"] for c in cryptos.values()),
+        "current_value": sum(c["current_value"] for c in cryptos.values()),
+        "realized_profit_loss": realized,
+        "unrealized_profit_loss": unrealized,
+        "total_profit_loss": realized + unrealized,
+    }
+    return {"summary": summary, "cryptos": cryptos, "periods": dict(sorted(periods.items()))}
+
+
+def calculate_crypto_profit_loss(entry_id, crypto_id, current_price, method=DEFAULT_COST_BASIS_METHOD):
+    """Calculer le profit/perte d'une crypto : l'investissement est le prix de revient des lots encore détenus"""
+    state = get_ledger_state(entry_id, method)
+    with state.lock:
+        position = position_fields(state.books.get(crypto_id) or LotBook(method))
+    return value_position(position, current_price)
@@ -1,63 +1,134 @@
 import aiohttp
+import asyncio
+import json
 import os
 import logging
+from collections import OrderedDict
+from .const import HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT, HTTP_ETAG_CACHE_ENTRIES
 
 _LOGGER = logging.getLogger(__name__)
 
+# Session aiohttp partagée (une par boucle d'événements) et nombre d'entrées qui l'utilisent
+_session = None
+_session_loop = None
+_session_users = 0
+# Dernière réponse GET reçue avec un ETag, par URL : {url: (etag, en-têtes, corps)}
+_etag_cache = OrderedDict()
+
+
+class BackendResponse:
+    """Réponse HTTP dont le corps a été lu avant la libération de la connexion.
+
+    not_modified vaut True quand le serveur a répondu 304 : le corps est alors celui
+    de la réponse précédente, conservée en cache.
+    """
+
+    def __init__(self, status, headers, body, not_modified=False):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.not_modified = not_modified
+
+    async def text(self):
+        return self.body
+
+    async def json(self):
+        return json.loads(self.body)
+
+
+def _close_stale_session(session, loop):
+    """Fermer une session créée sur une autre boucle d'événements avant de la remplacer"""
+    if session.closed:
+        return
+    if loop.is_running() and not loop.is_closed():
+        # Ses connexions appartiennent à l'autre boucle : la fermeture y est planifiée
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+    else:
+        # Boucle arrêtée : aiohttp ne peut plus y fermer les connexions, la session est abandonnée
+        _LOGGER.debug("Session HTTP d'une boucle arrêtée abandonnée")
+        session.detach()
+
+def get_session():
+    """Retourner la session partagée, en la créant si besoin pour la boucle courante"""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        if _session is not None and _session_loop is not loop:
+            _close_stale_session(_session, _session_loop)
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+        _session_loop = loop
+    return _session
+
+async def async_open_session():
+    """Déclarer un utilisateur de la session partagée (une entrée de configuration)"""
+    global _session_users
+    _session_users += 1
+    get_session()
+
+async def async_close_session():
+    """Libérer la session partagée ; elle est fermée quand plus aucune entrée ne l'utilise"""
+    global _session, _session_users
+    _session_users = max(0, _session_users - 1)
+    if _session_users == 0 and _session is not None:
+        if _session_loop is asyncio.get_running_loop():
+            if not _session.closed:
+                await _session.close()
+        else:
+            _close_stale_session(_session, _session_loop)
+        _session = None
+
 async def send_req_backend(url, payload=None, title='', method='post', form_data=None):
     try:
-        async with aiohttp.ClientSession() as session:
-            _LOGGER.info(f"Appel de l'URL {url} avec payload : {payload if payload else form_data}")
-
-            supervisor_token = os.getenv("SUPERVISOR_TOKEN")
-            headers = {
-                "Authorization": f"Bearer {supervisor_token}",
-            }
-
-            if method in ['post', 'put']:
-                if form_data:
-                    async with session.request(method, url, data=form_data, headers=headers) as response:
-                        response_text = await response.text()
-                        _LOGGER.info(f"Statut de la réponse: {response.status}, Texte de la réponse: {response_text}")
-                        if response.status == 200:
-                            _LOGGER.info(f"Réponse 200 pour {title} : {response_text}")
-                            return response
-                        else:
-                            _LOGGER.error(f"Échec pour la requête : {title}, code de statut: {response.status}, texte de la réponse: {response_text}")
-                            return False
-                else:
-                    headers["Content-Type"] = "application/json"
-                    async with session.request(method, url, json=payload, headers=headers) as response:
-                        response_text = await response.text()
-                        _LOGGER.info(f"Statut de la réponse: {response.status}, Texte de la réponse: {response_text}")
-                        if response.status == 200:
-                            _LOGGER.info(f"Réponse 200 pour {title} : {response_text}")
-                            return response
-                        else:
-                            _LOGGER.error(f"Échec pour la requête : {title}, code de statut: {response.status}, texte de la réponse: {response_text}")
-                            return False
-            elif method == 'get':
-                async with session.get(url, headers=headers) as response:
-                    response_text = await response.text()
-                    _LOGGER.info(f"Statut de la réponse: {response.status}, Texte de la réponse: {response_text}")
-                    if response.status == 200:
-                        _LOGGER.info(f"Réponse 200 pour {title} : {response_text}")
-                        return response
-                    else:
-                        _LOGGER.error(f"Échec pour la requête : {title}, code de statut: {response.status}, texte de la réponse: {response_text}")
-                        return False
-            elif method == 'delete':
-                async with session.delete(url, headers=headers) as response:
-                    response_text = await response.text()
-                    _LOGGER.info(f"Statut de la réponse: {response.status}, Texte de la réponse: {response_text}")
-                    if response.status == 200:
-                        _LOGGER.info(f"Réponse 200 pour {title} : {response_text}")
-                        return response
-                    else:
-                        _LOGGER.error(f"Échec pour la requête : {title}, code de statut: {response.status}, texte de la réponse: {response_text}")
-                        return False
+        session = get_session()
+        _LOGGER.debug(f"Appel de l'URL {url} avec payload : {payload if payload else form_data}")
+
+        supervisor_token = os.getenv("SUPERVISOR_TOKEN")
+        headers = {
+            "Authorization": f"Bearer {supervisor_token}",
+        }
+
+        kwargs = {"headers": headers}
+        cached = _etag_cache.get(url) if method == 'get' else None
+        if cached:
+            # Requête conditionnelle : le serveur répond 304 sans corps si rien n'a changé
+            headers["If-None-Match"] = cached[0]
+        if method in ['post', 'put']:
+            if form_data:
+                kwargs["data"] = form_data
+            else:
+                headers["Content-Type"] = "application/json"
+                kwargs["json"] = payload
+        elif method not in ['get', 'delete']:
+            _LOGGER.error(f"Méthode HTTP non supportée pour {title}: {method}")
+            return False
+
+        async with session.request(method, url, **kwargs) as response:
+            if response.status == 304 and cached:
+                _etag_cache.move_to_end(url)
+                _LOGGER.debug(f"Réponse 304 pour {title} : contenu inchangé")
+                return BackendResponse(200, cached[1], cached[2], not_modified=True)
+            response_text = await response.text()
+            _LOGGER.debug(f"Statut de la réponse: {response.status}, Texte de la réponse: {response_text}")
+            if response.status == 200:
+                _LOGGER.debug(f"Réponse 200 pour {title} : {response_text}")
+                etag = response.headers.get("ETag")
+                if method == 'get' and etag:
+                    _etag_cache[url] = (etag, dict(response.headers), response_text)
+                    _etag_cache.move_to_end(url)
+                    while len(_etag_cache) > HTTP_ETAG_CACHE_ENTRIES:
+                        _etag_cache.popitem(last=False)
+                return BackendResponse(response.status, dict(response.headers), response_text)
+            else:
+                _LOGGER.error(f"Échec pour la requête : {title}, code de statut: {response.status}, texte de la réponse: {response_text}")
+                return False
     except Exception as e:
         _LOGGER.error(f"Erreur lors de l'appel de l'API: {e}")
         return False
-
-
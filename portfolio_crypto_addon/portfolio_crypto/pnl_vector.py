@@ -0,0 +1,214 @@
+"""
+Fichier pnl_vector.py
+Ce fichier fournit le calcul vectorisé des positions avec NumPy : les transactions
+sont chargées en colonnes (code de crypto, quantité et coût signés, horodatage) et
+les agrégats par crypto (et par portefeuille) sont obtenus par réductions groupées
+avec np.bincount, sans boucle Python par transaction. Le prix de revient des lots
+détenus et la plus-value réalisée viennent de l'état des lots (lots.py) : ils
+dépendent de l'ordre des ventes et ne se réduisent pas par simple somme.
+"""
+
+import numpy as np
+from .lots import total_fields
+
+TYPE_SIGNS = {'buy': 1.0, 'sell': -1.0}
+
+
+class TransactionColumns:
+    """Transactions d'un ou plusieurs portefeuilles sous forme de tableaux NumPy"""
+
+    def __init__(self, portfolio_codes, coin_codes, quantity, cost, is_buy, timestamps, portfolios, coins):
+        self.portfolio_codes = portfolio_codes
+        self.coin_codes = coin_codes
+        self.quantity = quantity  # signée : positive pour un achat, négative pour une vente
+        self.cost = cost  # signé : montant payé (achat) ou encaissé (vente)
+        self.is_buy = is_buy
+        self.timestamps = timestamps
+        self.portfolios = portfolios
+        self.coins = coins
+
+    def __len__(self):
+        return len(self.coin_codes)
+
+
+def parse_dates(dates):
+    """Convertir des dates texte ('YYYY-MM-DD' ou 'YYYY-MM-DD HH:MM:SS') en datetime64, NaT si illisible"""
+    try:
+        return np.array(dates, dtype='datetime64[s]')
+    except ValueError:
+        # Au moins une date illisible : conversion élément par élément
+        parsed = np.empty(len(dates), dtype='datetime64[s]')
+        for i, date in enumerate(dates):
+            try:
+                parsed[i] = np.datetime64(date, 's') if date else np.datetime64('NaT')
+            except ValueError:
+                parsed[i] = np.datetime64('NaT')
+        return parsed
+
+
+def parse_as_of(as_of):
+    """Date limite d'un calcul (datetime64 ou texte ISO) ; ValueError si elle est illisible"""
+    return np.datetime64(as_of, 's')
+
+
+def build_transaction_columns(rows_by_portfolio):
+    """Convertir {entry_id: [(crypto_id, quantity, price_usd, transaction_type, date), ...]} en colonnes"""
+    crypto_ids = []
+    quantities = []
+    prices = []
+    types = []
+    dates = []
+    portfolio_codes = []
+    for code, rows in enumerate(rows_by_portfolio.values()):
+        if not rows:
+            continue
+        crypto_column, quantity_column, price_column, type_column, date_column = zip(*rows)
+        crypto_ids.extend(crypto_column)
+        quantities.extend(quantity_column)
+        prices.extend(price_column)
+        types.extend(type_column)
+        dates.extend(date_column)
+        portfolio_codes.append(np.full(len(rows), code, dtype=np.int64))
+
+    # Codes de cryptos dans l'ordre de première apparition
+    coins = {}
+    coin_codes = np.fromiter((coins.setdefault(crypto_id or '', len(coins)) for crypto_id in crypto_ids), dtype=np.int64, count=len(crypto_ids))
+    type_column = np.array(types, dtype=object)
+    signs = np.zeros(len(type_column), dtype=np.float64)
+    for transaction_type, sign in TYPE_SIGNS.items():
+        signs[type_column == transaction_type] = sign
+    quantity = np.array(quantities, dtype=np.float64)
+    cost = np.array(prices, dtype=np.float64)
+    np.nan_to_num(quantity, copy=False)
+    np.nan_to_num(cost, copy=False)
+    return TransactionColumns(
+        np.concatenate(portfolio_codes) if portfolio_codes else np.empty(0, dtype=np.int64),
+        coin_codes,
+        quantity * signs,
+        cost * signs,
+        signs > 0,
+        parse_dates(dates),
+        list(rows_by_portfolio),
+        list(coins),
+    )
+
+
+def merge_transaction_columns(parts):
+    """Concaténer les colonnes de plusieurs portefeuilles (chacun issu de build_transaction_columns)"""
+    coins = {}
+    portfolios = []
+    portfolio_codes = []
+    coin_codes = []
+    for part in parts:
+        # Renumérotation des cryptos : une boucle par crypto, pas par transaction
+        remap = np.array([coins.setdefault(coin, len(coins)) for coin in part.coins], dtype=np.int64)
+        portfolio_codes.append(part.portfolio_codes + len(portfolios))
+        coin_codes.append(remap[part.coin_codes] if len(part) else part.coin_codes)
+        portfolios.extend(part.portfolios)
+
+    def concat(arrays, dtype):
+        return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+    return TransactionColumns(
+        concat(portfolio_codes, np.int64),
+        concat(coin_codes, np.int64),
+        concat([part.quantity for part in parts], np.float64),
+        concat([part.cost for part in parts], np.float64),
+        concat([part.is_buy for part in parts], bool),
+        concat([part.timestamps for part in parts], 'datetime64[s]'),
+        portfolios,
+        list(coins),
+    )
+
+
+def compute_positions(columns, prices, lot_positions, as_of=None):
+    """Agréger les positions par (portefeuille, crypto) et les valoriser.
+
+    prices : {crypto_id: prix}. lot_positions : {entry_id: {crypto_id: lots.position_fields}},
+    à la même date (household.get_portfolio_positions). as_of (datetime64 ou texte ISO)
+    limite le calcul aux transactions antérieures ou égales à cette date. Retourne un
+    dictionnaire de tableaux de forme (portefeuilles, cryptos).
+    """
+    n_portfolios = len(columns.portfolios)
+    n_coins = len(columns.coins)
+    mask = np.ones(len(columns), dtype=bool)
+    if as_of is not None:
+        mask = columns.timestamps <= parse_as_of(as_of)
+    groups = columns.portfolio_codes[mask] * n_coins + columns.coin_codes[mask]
+    size = n_portfolios * n_coins
+
+    def grouped_sum(weights):
+        return np.bincount(groups, weights=weights[mask], minlength=size).reshape(n_portfolios, n_coins)
+
+    quantity = grouped_sum(columns.quantity)
+    tx_count = np.bincount(groups, minlength=size).reshape(n_portfolios, n_coins)
+
+    # Prix de revient des lots détenus, plus-value réalisée et capital engagé : une boucle par crypto
+    invested = np.zeros((n_portfolios, n_coins))
+    realized = np.zeros((n_portfolios, n_coins))
+    engaged = np.zeros((n_portfolios, n_coins))
+    coin_codes = {coin: j for j, coin in enumerate(columns.coins)}
+    for i, entry_id in enumerate(columns.portfolios):
+        for crypto_id, position in lot_positions.get(entry_id, {}).items():
+            j = coin_codes.get(crypto_id or '')
+            if j is not None:
+                invested[i, j] = position["invested"]
+                realized[i, j] = position["realized"]
+                engaged[i, j] = position["engaged"]
+
+    price_vector = np.array([prices.get(coin) or 0.0 for coin in columns.coins], dtype=np.float64)
+    value = quantity * price_vector
+    profit_loss = realized + value - invested
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profit_loss_percent = np.where(engaged != 0, profit_loss / engaged * 100, 0.0)
+        average_price = np.where(quantity > 0, invested / quantity, 0.0)
+    return {
+        "quantity": quantity,
+        "invested": invested,
+        "realized": realized,
+        "engaged": engaged,
+        "average_price": average_price,
+        "tx_count": tx_count,
+        "current_price": price_vector,
+        "value": value,
+        "profit_loss": profit_loss,
+        "profit_loss_percent": profit_loss_percent,
+    }
+
+
+def positions_report(columns, positions):
+    """Mettre en forme les tableaux de compute_positions : totaux, par portefeuille et par crypto"""
+    def totals(index, count):
+        return {
+            "transactions": int(count),
+            **total_fields(*(float(positions[name][index].sum()) for name in ("invested", "value", "realized", "engaged"))),
+        }
+
+    tx_count = positions["tx_count"]
+    portfolios = {
+        entry_id: totals(i, tx_count[i].sum())
+        for i, entry_id in enumerate(columns.portfolios)
+    }
+    coin_invested = positions["invested"].sum(axis=0)
+    coin_value = positions["value"].sum(axis=0)
+    coin_realized = positions["realized"].sum(axis=0)
+    coin_engaged = positions["engaged"].sum(axis=0)
+    coin_quantity = positions["quantity"].sum(axis=0)
+    cryptos = {}
+    for j, crypto_id in enumerate(columns.coins):
+        profit_loss = coin_realized[j] + coin_value[j] - coin_invested[j]
+        cryptos[crypto_id] = {
+            "total_tokens": float(coin_quantity[j]),
+            "investment": float(coin_invested[j]),
+            "current_price": float(positions["current_price"][j]),
+            "current_value": float(coin_value[j]),
+            "profit_loss": float(profit_loss),
+            "profit_loss_percent": float(profit_loss / coin_engaged[j] * 100) if coin_engaged[j] != 0 else 0,
+            "realized_profit_loss": float(coin_realized[j]),
+            "transactions_count": int(tx_count[:, j].sum()),
+        }
+    return {
+        "summary": totals(slice(None), tx_count.sum()),
+        "portfolios": portfolios,
+        "cryptos": cryptos,
+    }
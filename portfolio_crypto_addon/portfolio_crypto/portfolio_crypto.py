@@ -3,20 +3,34 @@ Fichier portfolio_crypto.py
 Ce fichier gère l'application Flask et les routes API pour l'addon Portfolio Crypto.
 """
 
+import gzip
 import json
+import shutil
+import tempfile
 import requests
 import requests_cache
 from datetime import datetime, timedelta
 import logging
 import time
-from flask import Flask, jsonify, request, render_template, send_file
+from flask import Flask, Response, jsonify, request, render_template, send_file, stream_with_context
 from flask_cors import CORS
-from .db import add_transaction, get_transactions, delete_transaction, update_transaction, get_crypto_transactions, create_table, create_crypto_table, save_crypto, get_cryptos, calculate_crypto_profit_loss, load_crypto_attributes, delete_crypto_db, export_db, import_db, import_transactions, verify_cryptos, get_database_path
+from .db import add_transaction, get_transactions, get_transactions_page, delete_transaction, update_transaction, get_crypto_transactions, create_table, create_crypto_table, save_crypto, get_cryptos, load_crypto_attributes, delete_crypto_db, import_db, get_database_path, get_holdings, rebuild_holdings, verify_holdings, ensure_schema, reset_import_checkpoint
 import os
-from .const import COINGECKO_API_URL, UPDATE_INTERVAL, RATE_LIMIT, PORT_APP
-from .coingecko import send_req_coingecko, fetch_crypto_id_from_coingecko, get_crypto_price, get_historical_price
+from .const import COINGECKO_API_URL, UPDATE_INTERVAL, RATE_LIMIT, PORT_APP, DEFAULT_COST_BASIS_METHOD, TRANSACTIONS_PAGE_SIZE
+from .coingecko import send_req_coingecko, fetch_crypto_id_from_coingecko, get_crypto_price, get_crypto_prices
 from .outils import send_req_backend
-import asyncio
+from .price_history import get_price_history, get_historical_price
+from .coin_search import search_coins
+from .coin_index import coin_index
+from .bulk_transactions import parse_bulk_payload, ingest_transactions
+from .csv_import import import_csv
+from .db_export import export_stream
+from .lots import calculate_lots_report, calculate_crypto_profit_loss, get_positions, value_position, total_fields
+from .household import get_all_transactions, get_household_holdings, get_portfolio_positions, household_crypto_ids, calculate_household_summary, get_transaction_columns
+from .pnl_vector import compute_positions, positions_report
+from .equity import get_equity_curve
+from .async_bridge import run_sync
+from .response_cache import cached_response, versioned_response, invalidate_portfolio, household_version, price_version
 import aiocron
 
 
@@ -98,8 +112,7 @@ def initialize():
     if not entry_id:
         return jsonify({"error": "entry_id is required"}), 400
     try:
-        create_table(entry_id)
-        create_crypto_table(entry_id)
+        ensure_schema(entry_id)
         logging.info(f"Portfolio initialisé avec succès pour l'ID d'entrée: {entry_id}")
         return jsonify({"message": "Database initialized"}), 200
     except Exception as e:
@@ -114,12 +127,14 @@ def save_crypto_route():
         crypto_name = data['crypto_name']
         crypto_id = data['crypto_id']
         save_crypto(entry_id, crypto_name, crypto_id)
+        invalidate_portfolio(entry_id)
         return jsonify({"message": "Crypto sauvegardée"}), 200
     except Exception as e:
         logging.error(f"Erreur lors de la sauvegarde de la crypto: {e}")
         return jsonify({"error": "Erreur Interne"}), 500
 
 @app.route('/load_cryptos/<entry_id>', methods=['GET'])
+@cached_response()
 def load_cryptos(entry_id):
     """Charger toutes les cryptos pour un ID d'entrée donné depuis la base de données"""
     try:
@@ -130,16 +145,70 @@ def load_cryptos(entry_id):
         return jsonify({"error": "Erreur Interne"}), 500
 
 @app.route('/crypto_profit_loss/<entry_id>/<crypto_id>', methods=['GET'])
+@cached_response(uses_prices=True)
 def crypto_profit_loss(entry_id, crypto_id):
     """Calculer et retourner le profit/perte pour une crypto-monnaie spécifique et un ID d'entrée donné"""
     try:
-        result = calculate_crypto_profit_loss(entry_id, crypto_id)
+        current_price = run_sync(get_crypto_price(crypto_id))
+        result = calculate_crypto_profit_loss(entry_id, crypto_id, current_price, request.args.get('method', DEFAULT_COST_BASIS_METHOD))
         logging.info(f"Profit/perte calculé pour {crypto_id} dans l'entrée {entry_id}: {result}")
         return jsonify(result)
     except Exception as e:
         logging.error(f"Erreur lors du calcul du profit/perte pour {crypto_id} dans l'entrée {entry_id}: {e}")
         return jsonify({"error": "Erreur Interne"}), 500
 
+@app.route('/pnl', methods=['GET'])
+@versioned_response(lambda: household_version(request.args.getlist('entry_id')))
+def pnl():
+    """Profit/perte de plusieurs portefeuilles (entry_id répétable, tous par défaut) recalculé depuis les transactions, éventuellement à une date (as_of)"""
+    try:
+        columns = get_transaction_columns(request.args.getlist('entry_id'))
+        prices = run_sync(get_crypto_prices(columns.coins))
+        as_of = request.args.get('as_of')
+        lot_positions = get_portfolio_positions(columns.portfolios, as_of)
+        positions = compute_positions(columns, prices, lot_positions, as_of)
+        return jsonify(positions_report(columns, positions))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Erreur lors du calcul vectorisé du profit/perte: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
+@app.route('/equity_curve/<entry_id>', methods=['GET'])
+@cached_response(uses_prices=True, extra_version=price_version)
+def equity_curve(entry_id):
+    """Valeur du portefeuille dans le temps (resolution=1h|1d, start/end en timestamps unix)"""
+    try:
+        resolution = request.args.get('resolution', '1d')
+        start = request.args.get('start', type=int)
+        end = request.args.get('end', type=int)
+        return jsonify(get_equity_curve(entry_id, resolution, start, end))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Erreur lors du calcul de la courbe de valeur pour l'entrée {entry_id}: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
+@app.route('/lots/<entry_id>', methods=['GET'])
+@cached_response(uses_prices=True)
+def lots(entry_id):
+    """Plus-values réalisées et latentes par lots (method=fifo|lifo|hifo|average, period=year|month, lots=1 pour le détail des lots)"""
+    try:
+        prices = run_sync(get_crypto_prices(list(get_holdings(entry_id))))
+        result = calculate_lots_report(
+            entry_id,
+            prices,
+            request.args.get('method', DEFAULT_COST_BASIS_METHOD),
+            request.args.get('period', 'year'),
+            request.args.get('lots', '0') in ('1', 'true'),
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Erreur lors du calcul des lots pour l'entrée {entry_id}: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
 def get_data_with_retry(url, retries=5, backoff_factor=1.0):
     """Récupérer les données depuis une URL avec des tentatives de réessai en cas d'échec"""
     for i in range(retries):
@@ -168,80 +237,181 @@ def get_data_with_retry(url, retries=5, backoff_factor=1.0):
 
 
 def calculate_profit_loss(entry_id):
-    """Calculer le profit/perte pour un ID d'entrée donné"""
-    transactions = get_transactions(entry_id)
-    crypto_groups = {}
-    for transaction in transactions:
-        crypto_id = transaction[2]
-        if crypto_id not in crypto_groups:
-            crypto_groups[crypto_id] = []
-        crypto_groups[crypto_id].append(transaction)
-
-    total_investment = 0
-    total_value = 0
+    """Calculer le profit/perte pour un ID d'entrée donné (prix de revient par lots, réalisé + latent)"""
+    positions = get_positions(entry_id)
+    prices = run_sync(get_crypto_prices(list(positions)))
 
     results = []
-    for crypto_id, transactions in crypto_groups.items():
-        current_price = asyncio.run(get_crypto_price(crypto_id))
-        investment = 0
-        quantity_held = 0
-        for transaction in transactions:
-            if transaction[5] == 'buy':
-                investment += transaction[4]
-                quantity_held += transaction[3]
-            elif transaction[5] == 'sell':
-                investment -= transaction[4]
-                quantity_held -= transaction[3]
-
-        current_value = quantity_held * current_price
-        total_investment += investment
-        total_value += current_value
-        profit_loss = current_value - investment
-        profit_loss_percent = (profit_loss / investment) * 100 if investment != 0 else 0
-        results.append({
-            "crypto_id": crypto_id,
-            "investment": investment,
-            "current_value": current_value,
-            "profit_loss": profit_loss,
-            "profit_loss_percent": profit_loss_percent
-        })
-
-    total_profit_loss = total_value - total_investment
-    total_profit_loss_percent = (total_profit_loss / total_investment) * 100 if total_investment != 0 else 0
+    for crypto_id, position in positions.items():
+        results.append({"crypto_id": crypto_id, **value_position(position, prices[crypto_id])})
+
+    summary = total_fields(
+        sum(position["invested"] for position in positions.values()),
+        sum(result["current_value"] for result in results),
+        sum(position["realized"] for position in positions.values()),
+        sum(position["engaged"] for position in positions.values()),
+    )
+    return {"details": results, "summary": summary}
+
+def load_snapshot_coins(entry_id):
+    """Positions du portefeuille (état des lots), y compris les cryptos suivies sans transaction"""
+    empty = {"quantity": 0, "invested": 0, "realized": 0, "engaged": 0, "tx_count": 0}
+    coins = {crypto_id: dict(empty) for _, crypto_id in get_cryptos(entry_id)}
+    coins.update(get_positions(entry_id))
+    return coins
+
+def calculate_portfolio_snapshot(entry_id):
+    """Calculer les totaux et les données par crypto d'un portefeuille depuis l'état des lots"""
+    coins = load_snapshot_coins(entry_id)
+    return build_portfolio_snapshot(coins, run_sync(get_crypto_prices(list(coins))))
+
+def build_portfolio_snapshot(coins, prices):
+    """Valoriser les positions de load_snapshot_coins aux prix {crypto_id: prix}"""
+    cryptos = {}
+    for crypto_id, coin in coins.items():
+        current_price = prices[crypto_id]
+        cryptos[crypto_id] = {
+            **value_position(coin, current_price),
+            "transactions_count": coin["tx_count"],
+            "average_price": coin["invested"] / coin["quantity"] if coin["quantity"] > 0 else 0,
+            "current_price": current_price,
+            "total_tokens": coin["quantity"],
+        }
+
     summary = {
-        "total_investment": total_investment,
-        "total_value": total_value,
-        "total_profit_loss": total_profit_loss,
-        "total_profit_loss_percent": total_profit_loss_percent
+        "transactions": sum(coin["tx_count"] for coin in coins.values()),
+        **total_fields(
+            sum(coin["invested"] for coin in coins.values()),
+            sum(crypto["current_value"] for crypto in cryptos.values()),
+            sum(coin["realized"] for coin in coins.values()),
+            sum(coin["engaged"] for coin in coins.values()),
+        ),
     }
+    return {"summary": summary, "cryptos": cryptos}
 
-    return {"details": results, "summary": summary}
+@app.route('/holdings/<entry_id>/rebuild', methods=['POST'])
+def rebuild_holdings_route(entry_id):
+    """Recalculer la table 'holdings' d'un portefeuille depuis ses transactions"""
+    try:
+        rebuild_holdings(entry_id)
+        invalidate_portfolio(entry_id)
+        return jsonify({"message": "Holdings recalculés"}), 200
+    except Exception as e:
+        logging.error(f"Erreur lors du recalcul des holdings pour l'entrée {entry_id}: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
+@app.route('/holdings/<entry_id>/verify', methods=['GET'])
+def verify_holdings_route(entry_id):
+    """Vérifier la cohérence de la table 'holdings' avec les transactions"""
+    try:
+        mismatches = verify_holdings(entry_id)
+        return jsonify({"valid": not mismatches, "mismatches": mismatches}), 200
+    except Exception as e:
+        logging.error(f"Erreur lors de la vérification des holdings pour l'entrée {entry_id}: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
+@app.route('/snapshot/<entry_id>', methods=['GET'])
+@cached_response(uses_prices=True)
+def snapshot(entry_id):
+    """Retourner en une seule réponse les totaux et les données par crypto pour le coordinateur"""
+    try:
+        return jsonify(calculate_portfolio_snapshot(entry_id))
+    except Exception as e:
+        logging.error(f"Erreur lors du calcul de l'instantané du portefeuille {entry_id}: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
+TRANSACTION_PAGE_ARGS = ('limit', 'after', 'crypto_id', 'type', 'start', 'end')
 
 @app.route('/transactions/<entry_id>', methods=['GET'])
+@cached_response()
 def list_transactions(entry_id):
-    """Lister toutes les transactions pour un ID d'entrée donné"""
-    transactions = get_transactions(entry_id)
-    #logging.info(f"Transactions récupérées pour l'entrée {entry_id}: {transactions}")
-    return jsonify(transactions)
+    """Lister les transactions pour un ID d'entrée donné.
+
+    Sans paramètre, toutes les transactions sont retournées (liste). Avec limit, after,
+    crypto_id, type, start ou end (dates ISO incluses), la réponse est une page triée
+    par (date, id) : {"transactions": [...], "next": curseur à passer en after, ou null}.
+    """
+    if not any(name in request.args for name in TRANSACTION_PAGE_ARGS):
+        transactions = get_transactions(entry_id)
+        return jsonify(transactions)
+    try:
+        limit = request.args.get('limit', TRANSACTIONS_PAGE_SIZE)
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError(f"limit invalide: {limit}")
+        transactions, next_cursor = get_transactions_page(
+            entry_id,
+            limit,
+            request.args.get('after') or None,
+            request.args.get('crypto_id') or None,
+            request.args.get('type') or None,
+            request.args.get('start') or None,
+            request.args.get('end') or None,
+        )
+        return jsonify({"transactions": transactions, "next": next_cursor})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Erreur lors de la récupération des transactions pour l'entrée {entry_id}: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
 
 @app.route('/all_transactions', methods=['GET'])
+@versioned_response(lambda: household_version(uses_prices=False))
 def all_transactions():
-    """Lister toutes les transactions de toutes les bases de données"""
-    entry_ids = []  # Remplacer par une méthode pour récupérer tous les ID d'entrée si nécessaire
-    all_transactions = []
-    for entry_id in entry_ids:
-        transactions = get_transactions(entry_id)
-        all_transactions.extend(transactions)
-    #logging.info(f"Toutes les transactions récupérées: {all_transactions}")
-    return jsonify(all_transactions)
+    """Lister toutes les transactions de toutes les bases de données (l'ID d'entrée en première colonne)"""
+    try:
+        return jsonify(get_all_transactions())
+    except Exception as e:
+        logging.error(f"Erreur lors de la récupération de toutes les transactions: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
+@app.route('/household', methods=['GET'])
+@versioned_response(household_version)
+def household():
+    """Vue consolidée de tous les portefeuilles : totaux, totaux par portefeuille et par crypto"""
+    try:
+        holdings = get_household_holdings()
+        prices = run_sync(get_crypto_prices(household_crypto_ids(holdings)))
+        return jsonify(calculate_household_summary(holdings, prices))
+    except Exception as e:
+        logging.error(f"Erreur lors du calcul de la vue consolidée: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
 
 @app.route('/profit_loss/<entry_id>', methods=['GET'])
+@cached_response(uses_prices=True)
 def profit_loss(entry_id):
     """Calculer et retourner le profit/perte pour un ID d'entrée donné"""
     result = calculate_profit_loss(entry_id)
     logging.info(f"Profit/perte calculé pour l'entrée {entry_id}: {result}")
     return jsonify(result)
 
+@app.route('/search_coins', methods=['GET'])
+def search_coins_route():
+    """Suggestions de cryptos pour l'autocomplétion, depuis le catalogue local"""
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    try:
+        return jsonify(search_coins(query, limit))
+    except Exception as e:
+        logging.error(f"Erreur lors de la recherche de cryptos pour '{query}': {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
+@app.route('/price_history/<crypto_id>', methods=['GET'])
+@versioned_response(price_version)
+def price_history(crypto_id):
+    """Retourner les bougies OHLC agrégées d'une crypto-monnaie (resolution=1h|1d, start/end en timestamps unix)"""
+    try:
+        resolution = request.args.get('resolution', '1d')
+        start = request.args.get('start', type=int)
+        end = request.args.get('end', type=int)
+        return jsonify(get_price_history(crypto_id, resolution, start, end))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Erreur lors de la récupération de l'historique des prix pour {crypto_id}: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
 @app.route('/transaction/<entry_id>', methods=['POST'])
 def create_transaction(entry_id):
     """Créer une nouvelle transaction pour un ID d'entrée donné"""
@@ -249,7 +419,7 @@ def create_transaction(entry_id):
         data = request.json
         #logging.info(f"Données reçues pour une nouvelle transaction dans l'entrée {entry_id}: {data}")
         crypto_name = data['crypto_name']
-        crypto_id = asyncio.run(fetch_crypto_id_from_coingecko(crypto_name))  # Utiliser asyncio.run pour appeler la fonction asynchrone
+        crypto_id = run_sync(fetch_crypto_id_from_coingecko(crypto_name))  # Exécutée sur la boucle persistante du worker
         if not crypto_id:
             logging.error("Cryptomonnaie introuvable")
             return jsonify({"error": "Cryptomonnaie introuvable"}), 404
@@ -258,13 +428,13 @@ def create_transaction(entry_id):
         transaction_type = data['transaction_type']
         location = data['location']
         date = data['date']
-        historical_price = price_usd / quantity
-        #historical_price = get_historical_price(crypto_id, datetime.strptime(date, "%Y-%m-%d").strftime("%d-%m-%Y"))
-        #if not historical_price:
-        #    logging.warning(f"Prix historique non trouvé pour {crypto_id} à la date {date}. Utilisation du prix par défaut.")
-        #    historical_price = price_usd / quantity
+        historical_price = get_historical_price(crypto_id, date)
+        if not historical_price:
+            logging.warning(f"Prix historique non trouvé pour {crypto_id} à la date {date}. Utilisation du prix par défaut.")
+            historical_price = price_usd / quantity
 
         add_transaction(entry_id, crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price)
+        invalidate_portfolio(entry_id)
 
         logging.info(f"Transaction ajoutée: {crypto_name}, {crypto_id}, {quantity}, {price_usd}, {transaction_type}, {location}, {date}, {historical_price}")
         return jsonify({"message": "Transaction ajoutée"}), 201
@@ -272,6 +442,46 @@ def create_transaction(entry_id):
         logging.error(f"Erreur lors de l'ajout de la transaction: {e}")
         return jsonify({"error": "Erreur Interne"}), 500
 
+@app.route('/transactions/<entry_id>/bulk', methods=['POST'])
+def create_transactions_bulk(entry_id):
+    """Créer un lot de transactions (JSON ou NDJSON) dans une seule transaction ; strict=1 refuse tout le lot en cas d'erreur"""
+    try:
+        records = parse_bulk_payload(request.get_data(), request.content_type)
+    except ValueError as e:
+        return jsonify({"error": f"Corps invalide: {e}"}), 400
+    try:
+        if records and coin_index.is_empty():
+            # Premier démarrage : le téléchargement du catalogue est déclenché par la résolution d'un nom
+            first = next((data for _, data, _ in records if isinstance(data, dict)), {})
+            run_sync(fetch_crypto_id_from_coingecko(first.get('crypto_name') or ''))
+        strict = request.args.get('strict', '0') in ('1', 'true')
+        result = ingest_transactions(entry_id, records, strict)
+        invalidate_portfolio(entry_id)
+        status = 201 if result["inserted"] else (400 if result["errors"] else 200)
+        return jsonify(result), status
+    except Exception as e:
+        logging.error(f"Erreur lors de l'ajout des transactions par lot: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
+
+@app.route('/import_csv/<entry_id>', methods=['POST'])
+def import_csv_route(entry_id):
+    """Importer un export CSV de plateforme (binance, kraken, coinbase) ; un import interrompu reprend avec le même import_id"""
+    try:
+        file = request.files.get('file')
+        if file is None:
+            return jsonify({"error": "Fichier CSV manquant"}), 400
+        import_id = request.form.get('import_id') or file.filename or 'import'
+        symbol_map = json.loads(request.form.get('symbols') or '{}')
+        if request.form.get('restart') in ('1', 'true'):
+            reset_import_checkpoint(entry_id, import_id)
+        result = import_csv(entry_id, file.stream, import_id, request.form.get('format'), symbol_map)
+        invalidate_portfolio(entry_id)
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Erreur lors de l'import CSV pour l'entrée {entry_id}: {e}")
+        return jsonify({"error": "Erreur Interne"}), 500
 
 @app.route('/transaction/<entry_id>/<int:transaction_id>', methods=['DELETE'])
 def delete_transaction_endpoint(entry_id, transaction_id):
@@ -279,6 +489,7 @@ def delete_transaction_endpoint(entry_id, transaction_id):
     try:
         #logging.info(f"Tentative de suppression de la transaction avec ID: {transaction_id} dans l'entrée {entry_id}")
         delete_transaction(entry_id, transaction_id)
+        invalidate_portfolio(entry_id)
         logging.info(f"Transaction avec ID: {transaction_id} supprimée dans l'entrée {entry_id}")
         return jsonify({"message": "Transaction supprimée"}), 200
     except Exception as e:
@@ -292,7 +503,7 @@ def update_transaction_endpoint(entry_id, transaction_id):
         data = request.json
         #logging.info(f"Données reçues pour la mise à jour de la transaction dans l'entrée {entry_id}: {data}")
         crypto_name = data['crypto_name']
-        crypto_id = asyncio.run(fetch_crypto_id_from_coingecko(crypto_name))  # Utiliser asyncio.run pour appeler la fonction asynchrone
+        crypto_id = run_sync(fetch_crypto_id_from_coingecko(crypto_name))  # Exécutée sur la boucle persistante du worker
         if not crypto_id:
             logging.error("Cryptomonnaie introuvable")
             return jsonify({"error": "Cryptomonnaie introuvable"}), 404
@@ -301,12 +512,12 @@ def update_transaction_endpoint(entry_id, transaction_id):
         transaction_type = data['transaction_type']
         location = data['location']
         date = data['date']
-        historical_price = price_usd / quantity
-        #historical_price = get_historical_price(crypto_id, datetime.strptime(date, "%Y-%m-%d").strftime("%d-%m-%Y"))
-        #if not historical_price:
-        #    historical_price = price_usd / quantity
+        historical_price = get_historical_price(crypto_id, date)
+        if not historical_price:
+            historical_price = price_usd / quantity
 
         update_transaction(entry_id, transaction_id, crypto_name, crypto_id, quantity, price_usd, transaction_type, location, date, historical_price)
+        invalidate_portfolio(entry_id)
         logging.info(f"Transaction mise à jour avec ID: {transaction_id} dans l'entrée {entry_id}")
         return jsonify({"message": "Transaction mise à jour"}), 200
     except Exception as e:
@@ -314,16 +525,18 @@ def update_transaction_endpoint(entry_id, transaction_id):
         return jsonify({"error": "Erreur Interne"}), 500
 
 @app.route('/transactions/<entry_id>/<crypto_id>', methods=['GET'])
+@cached_response()
 def list_crypto_transactions(entry_id, crypto_id):
     """Lister toutes les transactions pour un ID d'entrée donné et un crypto_id spécifique"""
     transactions = get_crypto_transactions(entry_id, crypto_id)
-    logging.info(f"Transactions récupérées pour l'entrée {entry_id} et crypto_id {crypto_id}: {transactions}")
+    logging.debug(f"{len(transactions)} transaction(s) récupérée(s) pour l'entrée {entry_id} et crypto_id {crypto_id}")
     return jsonify(transactions)
 
 @app.route('/delete_crypto/<entry_id>/<crypto_id>', methods=['DELETE'])
 def delete_crypto(entry_id, crypto_id):
     """Supprimer une crypto-monnaie pour un ID d'entrée donné"""
     success = delete_crypto_db(entry_id, crypto_id)
+    invalidate_portfolio(entry_id)
     if success:
         return jsonify({"message": "Crypto supprimée"}), 200
     else:
@@ -332,10 +545,25 @@ def delete_crypto(entry_id, crypto_id):
 
 @app.route('/export_db/<entry_id>', methods=['GET'])
 def export_database(entry_id):
+    """Exporter une copie cohérente du portefeuille (format=sqlite|json|csv, compression=none|gzip|zstd)"""
     try:
-       
-        return export_db(entry_id)
+        chunks, mimetype, filename, cleanup = export_stream(
+            entry_id,
+            request.args.get('format', 'sqlite'),
+            request.args.get('compression', 'none'),
+        )
+        response = Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+        # Supprimer la copie même si l'envoi n'a jamais commencé
+        response.call_on_close(cleanup)
+        return response
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
+        logging.error(f"Erreur lors de l'exportation de la base de données pour l'ID d'entrée {entry_id}: {e}")
         return jsonify({"error": "Erreur Interne"}), 500
 
 @app.route('/import_db', methods=['POST'])
@@ -343,17 +571,31 @@ def import_database():
     try:
         entry_id = request.form['entry_id']
         file = request.files['file']
-        db_path = get_database_path(entry_id)
-        with open(db_path, 'wb') as db_file:
-            db_file.write(file.read())
-
-        missing_cryptos = import_db(entry_id, db_path)
-
-        
-        if missing_cryptos == False:
+        mode = request.form.get('mode', 'replace')
+        # Le fichier est enregistré à part puis attaché : la base du portefeuille n'est jamais écrasée
+        fd, upload_path = tempfile.mkstemp(suffix='.import.db', dir=os.path.dirname(get_database_path(entry_id)))
+        os.close(fd)
+        try:
+            if file.stream.read(2) == b'\x1f\x8b':
+                # Export compressé en gzip : décompression en flux vers le fichier temporaire
+                file.stream.seek(0)
+                with gzip.open(file.stream) as source, open(upload_path, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+            else:
+                file.stream.seek(0)
+                file.save(upload_path)
+            missing_cryptos = import_db(entry_id, upload_path, mode)
+        finally:
+            os.remove(upload_path)
+            invalidate_portfolio(entry_id)
+
+        if missing_cryptos:
             return jsonify({"message": "Importation partielle", "missing_cryptos": missing_cryptos}), 200
         else:
             return jsonify({"message": "Importation réussie"}), 200
+    except ValueError as e:
+        logging.error(f"Fichier d'import refusé: {e}")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Erreur lors de l'importation de la base de données: {e}")
         return jsonify({"error": "Erreur Interne"}), 500
@@ -0,0 +1,221 @@
+"""
+Fichier price_history.py
+Ce fichier gère l'historique des prix dans cache_prix_crypto.db : les relevés bruts
+sont ajoutés à chaque rafraîchissement puis agrégés en bougies OHLC 1h et 1d,
+chaque résolution ayant sa propre durée de rétention. La table daily_prices contient
+les prix journaliers passés récupérés par le rattrapage de l'historique (backfill.py).
+"""
+
+import sqlite3
+import logging
+import time
+from datetime import datetime, timezone
+from .const import PATH_DB_BASE, PRICE_HISTORY_RESOLUTIONS, PRICE_HISTORY_RETENTION_DAYS
+from .db import get_path_connection, ensure_initialized
+
+_LOGGER = logging.getLogger(__name__)
+
+PRICE_DB_PATH = f'{PATH_DB_BASE}/cache_prix_crypto.db'
+
+def create_price_history_tables(conn):
+    """Créer les tables d'historique si elles n'existent pas"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_ticks (
+            crypto_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            price REAL NOT NULL,
+            PRIMARY KEY (crypto_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_ohlc (
+            crypto_id TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            open_ts INTEGER,
+            close_ts INTEGER,
+            samples INTEGER,
+            PRIMARY KEY (crypto_id, resolution, bucket)
+        ) WITHOUT ROWID
+    ''')
+    # Prix à 00:00 UTC de chaque jour ; NULL si CoinGecko n'a pas de prix ce jour-là
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_prices (
+            crypto_id TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            price REAL,
+            PRIMARY KEY (crypto_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS history_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        ) WITHOUT ROWID
+    ''')
+
+def record_price_batch(conn, prices, ts=None):
+    """Ajouter un lot de prix à l'historique et mettre à jour les bougies concernées.
+
+    Aucun commit n'est fait ici : l'appelant inclut l'écriture dans sa propre transaction.
+    """
+    if not prices:
+        return
+    ts = int(ts if ts is not None else time.time())
+    create_price_history_tables(conn)
+    conn.executemany(
+        'INSERT OR REPLACE INTO price_ticks (crypto_id, ts, price) VALUES (?, ?, ?)',
+        [(crypto_id, ts, price) for crypto_id, price in prices.items()]
+    )
+    for resolution, seconds in PRICE_HISTORY_RESOLUTIONS.items():
+        bucket = ts - ts % seconds
+        # Les expressions du DO UPDATE lisent les valeurs de la bougie existante
+        conn.executemany('''
+            INSERT INTO price_ohlc (crypto_id, resolution, bucket, open, high, low, close, open_ts, close_ts, samples)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT (crypto_id, resolution, bucket) DO UPDATE SET
+                open = CASE WHEN excluded.open_ts < open_ts THEN excluded.open ELSE open END,
+                high = max(high, excluded.high),
+                low = min(low, excluded.low),
+                close = CASE WHEN excluded.close_ts >= close_ts THEN excluded.close ELSE close END,
+                open_ts = min(open_ts, excluded.open_ts),
+                close_ts = max(close_ts, excluded.close_ts),
+                samples = samples + 1
+        ''', [(crypto_id, resolution, bucket, price, price, price, price, ts, ts) for crypto_id, price in prices.items()])
+    prune_price_history(conn, prices.keys(), ts)
+
+def prune_price_history(conn, crypto_ids, now=None):
+    """Appliquer la rétention de chaque résolution pour les cryptos données"""
+    now = int(now if now is not None else time.time())
+    raw_limit = now - PRICE_HISTORY_RETENTION_DAYS["raw"] * 86400
+    # Suppression par crypto pour profiter de la clé primaire (crypto_id, ts)
+    conn.executemany('DELETE FROM price_ticks WHERE crypto_id = ? AND ts < ?',
+                     [(crypto_id, raw_limit) for crypto_id in crypto_ids])
+    for resolution in PRICE_HISTORY_RESOLUTIONS:
+        limit = now - PRICE_HISTORY_RETENTION_DAYS[resolution] * 86400
+        conn.executemany('DELETE FROM price_ohlc WHERE crypto_id = ? AND resolution = ? AND bucket < ?',
+                         [(crypto_id, resolution, limit) for crypto_id in crypto_ids])
+
+def parse_day(date):
+    """Timestamp de 00:00 UTC du jour d'une date 'YYYY-MM-DD[ HH:MM:SS]', None si illisible"""
+    try:
+        day = datetime.strptime(str(date)[:10], "%Y-%m-%d")
+    except ValueError:
+        return None
+    return int(day.replace(tzinfo=timezone.utc).timestamp())
+
+def save_daily_prices(conn, rows):
+    """Enregistrer des prix journaliers [(crypto_id, day, price)] ; un prix NULL n'écrase pas un prix connu.
+
+    La génération de l'historique est incrémentée pour que les courbes en cache soient recalculées.
+    """
+    if not rows:
+        return
+    create_price_history_tables(conn)
+    conn.executemany('''
+        INSERT INTO daily_prices (crypto_id, day, price) VALUES (?, ?, ?)
+        ON CONFLICT (crypto_id, day) DO UPDATE SET price = coalesce(excluded.price, price)
+    ''', rows)
+    conn.execute('''
+        INSERT INTO history_meta (key, value) VALUES ('daily_generation', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+    ''')
+
+def bump_price_generation(conn):
+    """Signaler un rafraîchissement des prix : les réponses en cache qui en dépendent deviennent périmées"""
+    create_price_history_tables(conn)
+    conn.execute('''
+        INSERT INTO history_meta (key, value) VALUES ('price_generation', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+    ''')
+
+def _reader(db_path):
+    """Connexion du thread courant à la base des prix, les tables d'historique étant créées une fois par processus"""
+    conn = get_path_connection(db_path)
+    ensure_initialized(db_path, lambda: create_price_history_tables(conn))
+    return conn
+
+def get_history_generation(db_path=PRICE_DB_PATH):
+    """Compteur incrémenté à chaque rattrapage de l'historique journalier"""
+    row = _reader(db_path).execute("SELECT value FROM history_meta WHERE key = 'daily_generation'").fetchone()
+    return row[0] if row else 0
+
+def get_daily_price(crypto_id, day, db_path=PRICE_DB_PATH):
+    """Prix d'une crypto pour un jour (timestamp de 00:00 UTC) : historique journalier, sinon bougie 1d locale"""
+    conn = _reader(db_path)
+    row = conn.execute('SELECT price FROM daily_prices WHERE crypto_id = ? AND day = ?', (crypto_id, day)).fetchone()
+    if row is None or row[0] is None:
+        row = conn.execute(
+            "SELECT open FROM price_ohlc WHERE crypto_id = ? AND resolution = '1d' AND bucket = ?",
+            (crypto_id, day)
+        ).fetchone()
+    return row[0] if row else None
+
+def get_historical_price(crypto_id, date):
+    """Récupérer le prix historique d'une crypto-monnaie pour une date 'YYYY-MM-DD' depuis l'historique local.
+
+    Aucun appel CoinGecko ici : les jours manquants sont rattrapés par le démon de prix
+    (backfill.py). Retourne None si le prix n'est pas encore connu.
+    """
+    day = parse_day(date)
+    if day is None:
+        return None
+    try:
+        return get_daily_price(crypto_id, day)
+    except sqlite3.Error as e:
+        _LOGGER.error(f"Erreur lors de la lecture du prix historique pour {crypto_id} à la date {date}: {e}")
+        return None
+
+def get_price_history(crypto_id, resolution='1d', start=None, end=None, db_path=PRICE_DB_PATH):
+    """Récupérer les bougies OHLC d'une crypto pour une résolution et une période (timestamps unix)"""
+    if resolution not in PRICE_HISTORY_RESOLUTIONS:
+        raise ValueError(f"Résolution inconnue: {resolution}")
+    cursor = _reader(db_path).execute('''
+        SELECT bucket, open, high, low, close
+        FROM price_ohlc
+        WHERE crypto_id = ? AND resolution = ? AND bucket >= ? AND bucket <= ?
+        ORDER BY bucket
+    ''', (crypto_id, resolution, int(start or 0), int(end if end is not None else time.time())))
+    return [
+        {"ts": bucket, "open": open_, "high": high, "low": low, "close": close}
+        for bucket, open_, high, low, close in cursor.fetchall()
+    ]
+
+def get_close_prices(crypto_ids, resolution='1d', start=None, end=None, db_path=PRICE_DB_PATH):
+    """Récupérer les prix de clôture de plusieurs cryptos : {crypto_id: [(bucket, close), ...]}"""
+    if resolution not in PRICE_HISTORY_RESOLUTIONS:
+        raise ValueError(f"Résolution inconnue: {resolution}")
+    series = {crypto_id: [] for crypto_id in crypto_ids}
+    if not series:
+        return series
+    conn = _reader(db_path)
+    start = int(start or 0)
+    end = int(end if end is not None else time.time())
+    for crypto_id in series:
+        if resolution == '1d':
+            # Les jours sans bougie locale sont complétés par l'historique rattrapé
+            cursor = conn.execute('''
+                SELECT bucket, close FROM price_ohlc
+                WHERE crypto_id = ? AND resolution = '1d' AND bucket >= ? AND bucket <= ?
+                UNION ALL
+                SELECT day, price FROM daily_prices AS d
+                WHERE crypto_id = ? AND day >= ? AND day <= ? AND price IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM price_ohlc AS o
+                      WHERE o.crypto_id = d.crypto_id AND o.resolution = '1d' AND o.bucket = d.day
+                  )
+                ORDER BY 1
+            ''', (crypto_id, start, end, crypto_id, start, end))
+        else:
+            cursor = conn.execute('''
+                SELECT bucket, close
+                FROM price_ohlc
+                WHERE crypto_id = ? AND resolution = ? AND bucket >= ? AND bucket <= ?
+                ORDER BY bucket
+            ''', (crypto_id, resolution, start, end))
+        series[crypto_id] = cursor.fetchall()
+    return series
@@ -0,0 +1,195 @@
+"""
+Fichier response_cache.py
+Ce fichier gère le cache des réponses des routes de lecture : les corps JSON sont
+conservés en mémoire (LRU borné, durée de vie limitée) sous la clé (route, entry_id,
+paramètres). Chaque entrée est associée à la version du portefeuille (compteur
+d'écritures de la base) et, si la réponse dépend des prix, au numéro de
+rafraîchissement des prix : une écriture ou de nouveaux prix, même validés par un
+autre processus, rendent l'entrée périmée. Les routes d'écriture invalident en plus
+les entrées du portefeuille concerné.
+
+La même version sert d'ETag : un client qui envoie If-None-Match avec l'ETag courant
+reçoit 304 Not Modified, sans calcul ni sérialisation.
+"""
+
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import Response, make_response, request
+from .const import RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL
+from .db import get_database_path, get_write_version
+from .coingecko import get_price_generation
+from .household import discover_portfolios
+from .price_history import get_history_generation
+
+
+class ResponseCache:
+    """Cache LRU à durée de vie : {clé: (version, expiration, corps, type MIME)}"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2], entry[3]
+
+    def put(self, key, version, body, mimetype):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, body, mimetype)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, entry_id=None):
+        """Oublier les réponses d'un portefeuille et celles qui couvrent tous les portefeuilles (toutes si entry_id est None)"""
+        with self._lock:
+            if entry_id is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[1] in (entry_id, None)]:
+                del self._entries[key]
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL)
+
+
+def portfolio_version(entry_id, uses_prices):
+    """Version d'une réponse : compteur d'écritures du portefeuille, et numéro de rafraîchissement des prix"""
+    version = get_write_version(entry_id)
+    return (version, get_price_generation()) if uses_prices else (version,)
+
+
+def household_version(entry_ids=None, uses_prices=True):
+    """Version d'une réponse couvrant plusieurs portefeuilles (tous par défaut)"""
+    portfolios = discover_portfolios()
+    version = tuple(
+        (entry_id, get_write_version(entry_id))
+        for entry_id in sorted(entry_ids or portfolios) if entry_id in portfolios
+    )
+    return (version, get_price_generation()) if uses_prices else (version,)
+
+
+def price_version(**kwargs):
+    """Version des réponses qui ne dépendent que de l'historique des prix"""
+    return (get_price_generation(), get_history_generation())
+
+
+def invalidate_portfolio(entry_id):
+    response_cache.invalidate(entry_id)
+
+
+def response_etag(key, version):
+    """ETag (sans guillemets) d'une réponse : empreinte de sa clé et de sa version"""
+    return hashlib.sha1(repr((key, version)).encode()).hexdigest()[:20]
+
+
+def etag_matches(if_none_match, etag):
+    """Vérifier si un en-tête If-None-Match désigne l'ETag donné (comparaison faible)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == '*' or candidate.strip('"') == etag:
+            return True
+    return False
+
+
+# Résultat de lookup_response quand le client a déjà la version courante
+NOT_MODIFIED = object()
+
+
+def request_key(name, entry_id, path_params, query_items):
+    """Clé d'une réponse : (route, entry_id, paramètres de chemin, paramètres de requête)"""
+    return (name, entry_id, tuple(sorted(path_params.items())), tuple(sorted(query_items)))
+
+
+def lookup_response(key, version, if_none_match):
+    """Partie commune aux adaptateurs Flask et Starlette.
+
+    Retourne (etag, NOT_MODIFIED) si l'en-tête If-None-Match désigne la version
+    courante, sinon (etag, (corps, type MIME)) depuis le cache ou (etag, None).
+    """
+    etag = response_etag(key, version)
+    if etag_matches(if_none_match, etag):
+        return etag, NOT_MODIFIED
+    return etag, response_cache.get(key, version)
+
+
+def store_response(key, version, body, mimetype):
+    response_cache.put(key, version, body, mimetype)
+
+
+def _serve(key, version, compute):
+    """Adaptateur Flask : 304, réponse en cache ou réponse calculée (conservée si 200)"""
+    etag, cached = lookup_response(key, version, request.headers.get('If-None-Match'))
+    if cached is NOT_MODIFIED:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    if cached is not None:
+        response = Response(cached[0], mimetype=cached[1])
+    else:
+        response = make_response(compute())
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        store_response(key, version, response.get_data(), response.mimetype)
+    response.set_etag(etag)
+    return response
+
+
+def _request_key(view, entry_id, kwargs):
+    return request_key(view.__name__, entry_id, kwargs, request.args.items(multi=True))
+
+
+def cached_response(uses_prices=False, extra_version=None):
+    """Décorateur des routes Flask de lecture d'un portefeuille (paramètre entry_id).
+
+    Seules les réponses 200 sont conservées et reçoivent un ETag ; un portefeuille dont
+    la base n'existe pas encore n'est jamais mis en cache. extra_version (fonction sans
+    argument) complète la version pour les réponses qui dépendent d'autres données.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(entry_id, **kwargs):
+            if not os.path.exists(get_database_path(entry_id)):
+                return view(entry_id, **kwargs)
+            key = _request_key(view, entry_id, kwargs)
+            version = portfolio_version(entry_id, uses_prices)
+            if extra_version is not None:
+                version += extra_version()
+            return _serve(key, version, lambda: view(entry_id, **kwargs))
+        return wrapper
+    return decorator
+
+
+def versioned_response(version):
+    """Décorateur des routes Flask de lecture qui ne concernent pas un seul portefeuille.
+
+    version : fonction appelée pendant la requête avec les paramètres de la route, qui
+    retourne la version des données de la réponse (household_version, price_version...).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            key = _request_key(view, None, kwargs)
+            return _serve(key, version(**kwargs), lambda: view(**kwargs))
+        return wrapper
+    return decorator
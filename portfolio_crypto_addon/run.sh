@@ -125,11 +125,19 @@ EOL
 #export GUNICORN_CONF=/app/gunicorn_config.py
 
 # Start the cron job for updating prices
-python3 /app/portfolio_crypto/cron_job_price.py &
+python3 -m portfolio_crypto.cron_job_price &
 
-# Démarrer l'application Flask avec Gunicorn
-gunicorn --config $GUNICORN_CONF --bind 0.0.0.0:5000 portfolio_crypto.portfolio_crypto:app &
-gunicorn --config $GUNICORN_CONF --bind 0.0.0.0:8099 portfolio_crypto.portfolio_crypto:app &
+# Mode de service de l'API : gunicorn (WSGI, par défaut) ou asgi (uvicorn, un seul processus pour les deux ports)
+SERVER_MODE="${SERVER_MODE:-$(python3 -c "import json; print(json.load(open('/data/options.json')).get('server_mode', 'gunicorn'))" 2>/dev/null || echo gunicorn)}"
+
+if [ "$SERVER_MODE" = "asgi" ]; then
+    # Démarrer l'API en ASGI : routes asynchrones et application Flask en repli, ports 5000 et 8099
+    python3 -m portfolio_crypto.asgi &
+else
+    # Démarrer l'application Flask avec Gunicorn
+    gunicorn --config $GUNICORN_CONF --bind 0.0.0.0:5000 portfolio_crypto.portfolio_crypto:app &
+    gunicorn --config $GUNICORN_CONF --bind 0.0.0.0:8099 portfolio_crypto.portfolio_crypto:app &
+fi
 
 # Attendre que l'application Flask démarre correctement
 sleep 5